@@ -0,0 +1,245 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import dbpool
+
+
+class PoolMetrics:
+    """
+    Counters for one pool. Times are in seconds.
+    """
+    __slots__ = ('leases', 'calls', 'errors', 'waiting', 'max_waiting', 'in_use',
+                 'wait_time', 'max_wait_time', 'busy_time')
+
+    def __init__(self):
+        self.leases = 0
+        self.calls = 0
+        self.errors = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_use = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.busy_time = 0.0
+
+    def as_dict(self):
+        metrics = {name: getattr(self, name) for name in self.__slots__}
+        metrics['avg_wait_time'] = self.wait_time / self.leases if self.leases else 0.0
+        metrics['avg_call_time'] = self.busy_time / self.calls if self.calls else 0.0
+        return metrics
+
+
+class _Worker:
+    """
+    A single database thread. Everything submitted to it runs on the same thread,
+    so it always sees the same pooled connection from dbpool.
+    """
+    __slots__ = ('executor', 'scope')
+
+    def __init__(self, name):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.scope = None
+
+
+class AsyncCursor:
+    """
+    A cursor whose execute() runs on the leased worker thread.
+
+    Rows are fetched eagerly on the worker, so fetchone() and fetchall() are
+    plain synchronous calls that never touch the database.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+        self._rows = deque()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    async def execute(self, sql, parameters=()):
+        def execute(conn):
+            cursor = conn.execute(sql, parameters)
+            return cursor.fetchall(), cursor.lastrowid, cursor.rowcount
+
+        rows, self.lastrowid, self.rowcount = await self._conn.run_with_connection(execute)
+        self._rows = deque(rows)
+        return self
+
+    async def executemany(self, sql, seq_of_parameters):
+        def executemany(conn):
+            cursor = conn.executemany(sql, seq_of_parameters)
+            return cursor.rowcount
+
+        self.rowcount = await self._conn.run_with_connection(executemany)
+        self._rows = deque()
+        return self
+
+    def fetchone(self):
+        return self._rows.popleft() if self._rows else None
+
+    def fetchall(self):
+        rows = list(self._rows)
+        self._rows.clear()
+        return rows
+
+
+class AsyncConnection:
+    """
+    A connection leased from a DatabasePool for the duration of an `async with` block.
+    """
+    def __init__(self, pool, worker):
+        self._pool = pool
+        self._worker = worker
+
+    def cursor(self):
+        return AsyncCursor(self)
+
+    async def execute(self, sql, parameters=()):
+        return await self.cursor().execute(sql, parameters)
+
+    async def commit(self):
+        await self.run_with_connection(lambda conn: conn.commit())
+
+    async def rollback(self):
+        await self.run_with_connection(lambda conn: conn.rollback())
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a synchronous helper (e.g. `get_user_role`) on the leased worker thread.
+        Helpers that use dbpool.connection() share this block's connection.
+        """
+        return await self._pool._submit(self._worker, fn, *args, **kwargs)
+
+    async def run_with_connection(self, fn):
+        return await self._pool._submit(self._worker, lambda: fn(self._worker.scope[1]))
+
+
+class DatabasePool:
+    """
+    A bounded pool of database threads for use from coroutines.
+
+    Usage:
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            await cursor.execute('SELECT ...', (...,))
+            rows = cursor.fetchall()
+            role = await conn.run(get_user_role, username)
+            await conn.commit()
+
+        role = await pool.run(get_user_role, username)
+
+    At most `size` blocks hold a worker at once; the rest wait without blocking
+    the event loop. A block always runs on one thread, so its statements share
+    one transaction, and uncommitted work is rolled back when it exits.
+    """
+    def __init__(self, name, size, path=None):
+        self.name = name
+        self.size = size
+        self.path = path
+        self._idle = deque(_Worker(f'{name}-db-{i}') for i in range(size))
+        self._waiters = deque()
+        self._metrics = PoolMetrics()
+
+    @asynccontextmanager
+    async def connection(self):
+        worker = await self._acquire()
+        try:
+            await self._submit(worker, self._enter, worker)
+            try:
+                yield AsyncConnection(self, worker)
+            finally:
+                await self._submit(worker, self._exit, worker)
+        finally:
+            self._release(worker)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a synchronous database helper on a pool thread and returns its result.
+        """
+        worker = await self._acquire()
+        try:
+            return await self._submit(worker, self._call, fn, args, kwargs)
+        finally:
+            self._release(worker)
+
+    def metrics(self):
+        metrics = self._metrics.as_dict()
+        metrics['name'] = self.name
+        metrics['size'] = self.size
+        return metrics
+
+    def shutdown(self):
+        for worker in self._idle:
+            worker.executor.shutdown(wait=True)
+
+    def _call(self, fn, args, kwargs):
+        with dbpool.connection(self.path):
+            return fn(*args, **kwargs)
+
+    def _enter(self, worker):
+        scope = dbpool.connection(self.path)
+        worker.scope = (scope, scope.__enter__())
+
+    def _exit(self, worker):
+        scope, _ = worker.scope
+        worker.scope = None
+        scope.__exit__(None, None, None)
+
+    async def _acquire(self):
+        metrics = self._metrics
+        start = time.perf_counter()
+        if self._idle:
+            worker = self._idle.popleft()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            metrics.waiting += 1
+            metrics.max_waiting = max(metrics.max_waiting, metrics.waiting)
+            try:
+                worker = await waiter
+            except asyncio.CancelledError:
+                # Cancelled after a worker was handed over: pass it on.
+                if waiter.done() and not waiter.cancelled():
+                    metrics.in_use += 1
+                    self._release(waiter.result())
+                raise
+            finally:
+                metrics.waiting -= 1
+        waited = time.perf_counter() - start
+        metrics.leases += 1
+        metrics.in_use += 1
+        metrics.wait_time += waited
+        metrics.max_wait_time = max(metrics.max_wait_time, waited)
+        return worker
+
+    def _release(self, worker):
+        self._metrics.in_use -= 1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(worker)
+                return
+        self._idle.append(worker)
+
+    async def _submit(self, worker, fn, *args, **kwargs):
+        metrics = self._metrics
+        start = time.perf_counter()
+        metrics.calls += 1
+        try:
+            return await asyncio.wrap_future(worker.executor.submit(fn, *args, **kwargs))
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            metrics.busy_time += time.perf_counter() - start
+
+
+# Short OLTP queries issued by request handlers.
+pool = DatabasePool('default', 8)
+
+# Long-running reads (catalog listings, reports) get their own threads so they
+# cannot occupy every slot of the default pool.
+bulk_pool = DatabasePool('bulk', 2)
+
+POOLS = (pool, bulk_pool)
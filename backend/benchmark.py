@@ -0,0 +1,907 @@
+"""
+Benchmarks and load tests for the backend.
+
+Every benchmark runs against a throwaway database in a temporary directory and
+prints its results; nothing touches `db.db`. Run from the `backend/` directory
+(handlers read `config.toml` on import):
+
+    python benchmark.py loop-latency
+    python benchmark.py course-stats
+    python benchmark.py courseware-range
+    python benchmark.py recommender
+    python benchmark.py vector-index
+    python benchmark.py inbox-push
+    python benchmark.py login-burst
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import dbpool
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+    return samples[index]
+
+
+def report(name, samples):
+    """
+    Prints latency percentiles (milliseconds) for a list of durations in seconds.
+    """
+    ms = [s * 1000 for s in samples]
+    print(f'{name:<32} n={len(ms):<6} p50={percentile(ms, 50):8.2f}ms '
+          f'p95={percentile(ms, 95):8.2f}ms p99={percentile(ms, 99):8.2f}ms '
+          f'max={max(ms) if ms else 0:8.2f}ms mean={statistics.mean(ms) if ms else 0:8.2f}ms')
+
+
+def use_temp_database():
+    """
+    Points the connection pool at a fresh database file and returns its path.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix='manthano-bench-'), 'bench.db')
+    dbpool.close_all()
+    dbpool.DATABASE = path
+    return path
+
+
+def login_cookie(app, username):
+    """
+    Registers a session for `username` and returns a Cookie header for it.
+    """
+    import sessions
+    from tornado.web import create_signed_value
+
+    secret = app.settings['cookie_secret']
+    session_id = sessions.store.create(username)
+    user = create_signed_value(secret, 'user', username).decode()
+    session = create_signed_value(secret, 'session_id', session_id).decode()
+    return f'user={user}; session_id={session}'
+
+
+# A catalog-sized query that keeps SQLite busy for a while (~0.5s).
+SLOW_CATALOG_SQL = '''
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 3000000)
+    SELECT COUNT(*) FROM n
+'''
+
+
+async def _loop_latency(blocking, requests, concurrency, slow_queries):
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.httpserver import HTTPServer
+    from tornado.routing import PathMatches, Rule
+    from tornado.testing import bind_unused_port
+    from asyncdb import bulk_pool
+    from components.user.base import BaseHandler
+    from server import make_app
+
+    class SlowCatalogHandler(BaseHandler):
+        async def get(self):
+            if blocking:
+                # What every handler did before: run the query on the IOLoop.
+                with dbpool.connection() as conn:
+                    conn.execute(SLOW_CATALOG_SQL).fetchall()
+            else:
+                async with bulk_pool.connection() as conn:
+                    await conn.execute(SLOW_CATALOG_SQL)
+            self.write('done')
+
+    app = make_app()
+    app.wildcard_router.rules.insert(0, Rule(PathMatches(r'/bench/slow'), SlowCatalogHandler))
+    cookie = login_cookie(app, 'bench.user')
+
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+    client = AsyncHTTPClient(max_clients=concurrency + slow_queries)
+    base = f'http://127.0.0.1:{port}'
+
+    async def slow():
+        for _ in range(slow_queries):
+            await client.fetch(f'{base}/bench/slow', headers={'Cookie': cookie}, request_timeout=600)
+
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def fast():
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            await client.fetch(f'{base}/api/', headers={'Cookie': cookie}, request_timeout=600)
+            latencies.append(time.perf_counter() - start)
+
+    slow_task = asyncio.ensure_future(slow())
+    await asyncio.sleep(0.05)
+    await asyncio.gather(*(fast() for _ in range(concurrency)))
+    await slow_task
+    server.stop()
+    client.close()
+    return latencies
+
+
+def bench_loop_latency(args):
+    """
+    p99 latency of `/api/` while slow catalog queries run concurrently, with the
+    slow query executed on the IOLoop (the old behaviour) and on the database pool.
+    """
+    from migrations import migrate
+
+    use_temp_database()
+    migrate()
+    for blocking in (True, False):
+        latencies = asyncio.run(_loop_latency(blocking, args.requests, args.concurrency, args.slow_queries))
+        report('/api/ (slow query on IOLoop)' if blocking else '/api/ (slow query on pool)', latencies)
+
+
+def bench_course_stats(args):
+    """
+    Catalog rating read and course_stats maintenance at catalog scale.
+    """
+    import random
+    from database import add_rating, rebuild_course_stats
+    from migrations import migrate
+
+    use_temp_database()
+    migrate()
+    rng = random.Random(42)
+    with dbpool.connection() as conn:
+        start = time.perf_counter()
+        conn.executemany('INSERT INTO courses (id, title, description, owner, category) VALUES (?, ?, ?, ?, ?)',
+                         ((i, f'C{i}', f'Course {i}', f'teacher{i % 500}', 'General') for i in range(1, args.courses + 1)))
+        conn.executemany('''INSERT INTO rating (course_id, sender_name, star, difficulty, workload, grading, gain, comment)
+                            VALUES (?, ?, ?, 'Medium', 'Moderate', 'Fair Grading', 'High Gain', '')''',
+                         ((rng.randint(1, args.courses), f'student{i % 50000}', rng.randint(1, 5)) for i in range(args.ratings)))
+        conn.commit()
+        print(f'seeded {args.courses} courses and {args.ratings} ratings in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    rebuild_course_stats()
+    print(f'rebuild_course_stats: {time.perf_counter() - start:.2f}s')
+
+    def timed(fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    with dbpool.connection() as conn:
+        def catalog_from_stats():
+            conn.execute('''
+                SELECT c.id, c.title, c.description, c.owner, s.rating_avg, s.rating_count
+                FROM courses c LEFT JOIN course_stats s ON s.course_id = c.id
+            ''').fetchall()
+
+        def catalog_per_course_avg():
+            courses = conn.execute('SELECT id, title, description, owner FROM courses').fetchall()
+            for course in courses:
+                conn.execute('SELECT AVG(star) FROM rating WHERE course_id = ?', (course[0],)).fetchone()
+
+        report('catalog via course_stats', timed(catalog_from_stats, 20))
+        report('catalog via AVG per course', timed(catalog_per_course_avg, 3))
+
+    def rate():
+        add_rating('bench', rng.randint(1, 5), 'Medium', 'Moderate', 'Fair Grading', 'High Gain', '', rng.randint(1, args.courses))
+
+    report('add_rating + stats update', timed(rate, 500))
+
+
+def _serve_courseware(sock, cached):
+    """
+    Server process of the courseware-range benchmark.
+    """
+    from tornado.httpserver import HTTPServer
+    import components.course.courseware as courseware
+    from asyncdb import pool
+    from server import make_app
+
+    if not cached:
+        # Query the database on every request, as before the cache existed.
+        handler = courseware.CourseWareFileHandlerWithAuth
+
+        async def load_file_info(self, chapter_id, filename, version):
+            return await pool.run(handler.file_info, chapter_id, filename, version)
+
+        handler.load_file_info = load_file_info
+
+    async def serve():
+        HTTPServer(make_app()).add_sockets([sock])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+async def _courseware_range(port, cookies, seeks, range_size, video_size):
+    import random
+    from tornado.httpclient import AsyncHTTPClient
+
+    client = AsyncHTTPClient(max_clients=len(cookies))
+    url = f'http://127.0.0.1:{port}/api/files/courseware/1/lecture.mp4'
+    first, seeking = [], []
+
+    async def viewer(cookie, rng):
+        for i in range(seeks):
+            start_byte = rng.randrange(0, video_size - range_size)
+            start = time.perf_counter()
+            response = await client.fetch(url, headers={
+                'Cookie': cookie, 'Range': f'bytes={start_byte}-{start_byte + range_size - 1}'}, request_timeout=600)
+            (seeking if i else first).append(time.perf_counter() - start)
+            assert response.code == 206, response.code
+
+    start = time.perf_counter()
+    await asyncio.gather(*(viewer(cookie, random.Random(i)) for i, cookie in enumerate(cookies)))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return first, seeking, elapsed
+
+
+def bench_courseware_range(args):
+    """
+    Concurrent viewers seeking through one video with Range requests, with and
+    without the courseware authorization cache. The server runs in its own process.
+    """
+    import hashlib
+    import multiprocessing
+    from tornado.netutil import bind_sockets
+    from blobstore import add_courseware_version
+    from migrations import migrate
+    from server import make_app  # reads config.toml from the working directory
+
+    path = use_temp_database()
+    os.chdir(os.path.dirname(path))  # courseware is stored relative to it
+    migrate()
+    video = os.urandom(args.video_size)
+    with open('upload.tmp', 'wb') as f:
+        f.write(video)
+    with dbpool.connection() as conn:
+        conn.execute("INSERT INTO courses (id, title, description, owner, category) VALUES (1, 'CS101', '', 'teacher', 'General')")
+        conn.execute("INSERT INTO chapters (id, title, content, type, course_id) VALUES (1, 'Lecture 1', '', 'teaching', 1)")
+        conn.commit()
+    add_courseware_version(1, 'lecture.mp4', 'upload.tmp', hashlib.sha256(video).hexdigest(), len(video), 'video/mp4', 'teacher')
+    # Sessions are in the shared SQLite store, so the server process sees them.
+    app = make_app()
+    cookies = [login_cookie(app, f'viewer{i}') for i in range(args.viewers)]
+    dbpool.close_all()
+
+    for cached in (False, True):
+        # Each request opens a connection; the default backlog (128) would drop connects.
+        sock = bind_sockets(0, '127.0.0.1', backlog=args.viewers)[0]
+        port = sock.getsockname()[1]
+        server = multiprocessing.get_context('fork').Process(target=_serve_courseware, args=(sock, cached), daemon=True)
+        server.start()
+        try:
+            first, seeking, elapsed = asyncio.run(_courseware_range(port, cookies, args.seeks, args.range_size, args.video_size))
+        finally:
+            server.terminate()
+            server.join()
+            sock.close()
+        label = 'auth cache' if cached else 'no auth cache'
+        report(f'first request ({label})', first)
+        report(f'seeks ({label})', seeking)
+        print(f'{"":<32} {(len(first) + len(seeking)) / elapsed:.0f} requests/s')
+
+
+def bench_recommender(args):
+    """
+    Memory and build time of the sparse collaborative-filtering matrices at
+    catalog scale, and recommendation latency.
+    """
+    import tracemalloc
+    import numpy as np
+    from migrations import migrate
+    from recommender import EmbeddingStore, RecommenderService, load_interactions, top_k_neighbours
+
+    class RandomEmbeddingStore(EmbeddingStore):
+        def _encode(self, texts):
+            vectors = np.random.default_rng(0).standard_normal((len(texts), 384)).astype(np.float32)
+            return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    path = use_temp_database()
+    migrate()
+    rng = np.random.default_rng(42)
+    # Course popularity follows a power law, as enrolments in a real catalog do.
+    popularity = 1 / np.arange(1, args.courses + 1) ** 0.8
+    popularity /= popularity.sum()
+    enrolments = rng.choice(args.courses, size=(args.students, args.enrolments), p=popularity) + 1
+    likes = rng.choice(args.courses, size=args.students, p=popularity) + 1
+    with dbpool.connection() as conn:
+        start = time.perf_counter()
+        conn.executemany('INSERT INTO courses (id, title, description, owner, category) VALUES (?, ?, ?, ?, ?)',
+                         ((i, f'C{i}', f'Course {i}', f'teacher{i % 500}', 'General') for i in range(1, args.courses + 1)))
+        conn.executemany('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)',
+                         ((int(course), f'student{s}') for s, row in enumerate(enrolments) for course in row))
+        conn.executemany('INSERT INTO course_likes (course_id, student) VALUES (?, ?)',
+                         ((int(course), f'student{s}') for s, course in enumerate(likes)))
+        conn.commit()
+        interactions = conn.execute('SELECT (SELECT COUNT(*) FROM course_students) + (SELECT COUNT(*) FROM course_likes)').fetchone()[0]
+        print(f'seeded {args.courses} courses, {args.students} students and {interactions} interactions '
+              f'in {time.perf_counter() - start:.1f}s')
+
+    def measure(label, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        # Measured again under tracemalloc, which slows the Python parts down.
+        tracemalloc.start()
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{label:<32} {elapsed:8.2f}s  peak {peak / 2 ** 20:8.1f} MiB')
+        return result
+
+    course_ids = list(range(1, args.courses + 1))
+    with dbpool.connection() as conn:
+        matrix, students = measure('load_interactions (CSR)', lambda: load_interactions(conn, course_ids))
+    neighbours = measure(f'top_k_neighbours (k={args.neighbours})', lambda: top_k_neighbours(matrix, args.neighbours))
+
+    def size(m):
+        return (m.data.nbytes + m.indices.nbytes + m.indptr.nbytes) / 2 ** 20
+
+    print(f'{"interaction matrix":<32} {size(matrix):8.1f} MiB  ({matrix.nnz} non-zeros)')
+    print(f'{"neighbour matrix":<32} {size(neighbours):8.1f} MiB  ({neighbours.nnz} non-zeros)')
+    # What the dense pivot_table + cosine_similarity version allocated (float64).
+    print(f'{"dense pivot table would need":<32} {2 * args.courses * len(students) * 8 / 2 ** 20:8.1f} MiB')
+    print(f'{"dense similarity would need":<32} {(2 * args.courses) ** 2 * 8 / 2 ** 20:8.1f} MiB')
+
+    service = RecommenderService(RandomEmbeddingStore(os.path.join(os.path.dirname(path), 'recommender')),
+                                 neighbours=args.neighbours)
+    start = time.perf_counter()
+    service.refresh()
+    print(f'{"refresh (first, encodes all)":<32} {time.perf_counter() - start:8.2f}s')
+    start = time.perf_counter()
+    service.refresh()
+    print(f'{"refresh (nothing changed)":<32} {time.perf_counter() - start:8.2f}s')
+
+    samples = []
+    for s in rng.choice(args.students, size=1000):
+        start = time.perf_counter()
+        service.recommend(f'student{s}')
+        samples.append(time.perf_counter() - start)
+    report('recommend', samples)
+
+
+def bench_vector_index(args):
+    """
+    Top-k query latency and recall of the vector indexes on course-embedding-sized vectors.
+    """
+    import importlib.util
+    import numpy as np
+    from vectorindex import make_index
+
+    rng = np.random.default_rng(42)
+    # Clustered vectors, like embeddings of courses on related topics.
+    topics = rng.standard_normal((args.courses // 50, args.dim)).astype(np.float32)
+    vectors = topics[rng.integers(len(topics), size=args.courses)] + 0.5 * rng.standard_normal((args.courses, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.integers(args.courses, size=args.queries)
+    exact = [set(np.argsort(-(vectors @ vectors[q]))[1:args.k + 1].tolist()) for q in queries]
+
+    for name in ('flat', 'ivf', 'hnsw'):
+        if name == 'hnsw' and importlib.util.find_spec('hnswlib') is None:
+            print('hnsw: hnswlib is not installed')
+            continue
+        index = make_index(name, args.dim)
+        start = time.perf_counter()
+        index.add(range(args.courses), vectors)
+        print(f'{name + " build":<32} {time.perf_counter() - start:8.2f}s')
+        samples, found = [], 0
+        for q, expected in zip(queries, exact):
+            start = time.perf_counter()
+            results = index.search(vectors[q], args.k, exclude={int(q)})
+            samples.append(time.perf_counter() - start)
+            found += len(expected & {item_id for item_id, _ in results})
+        report(f'{name} top-{args.k}', samples)
+        print(f'{"":<32} recall {found / (args.k * len(queries)):.3f}')
+
+        start = time.perf_counter()
+        index.remove(range(0, args.courses, 100))
+        index.add(range(0, args.courses, 100), vectors[::100])
+        print(f'{name + " remove + re-add 1%":<32} {time.perf_counter() - start:8.3f}s')
+
+
+def _serve_inbox_push(sock):
+    """
+    Server process of the inbox-push benchmark.
+    """
+    from tornado.httpserver import HTTPServer
+    from components.inbox import inbox_feed
+    from server import make_app
+
+    async def serve():
+        HTTPServer(make_app()).add_sockets([sock])
+        inbox_feed.start()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def _process_usage(pid):
+    """
+    Returns the resident memory (bytes) and CPU time (seconds) of a process.
+    """
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return rss, (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+async def _inbox_push(port, pid, cookies, teacher_cookie, idle, rounds):
+    from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+    from tornado.websocket import websocket_connect
+
+    url = f'ws://127.0.0.1:{port}/api/inbox/ws'
+    rss_before, _ = _process_usage(pid)
+    connecting = asyncio.Semaphore(200)
+    connect_times = []
+
+    async def connect(cookie):
+        async with connecting:
+            start = time.perf_counter()
+            socket = await websocket_connect(HTTPRequest(url, headers={'Cookie': cookie}, request_timeout=600))
+            connect_times.append(time.perf_counter() - start)
+            return socket
+
+    sockets = await asyncio.gather(*(connect(cookie) for cookie in cookies))
+    report(f'connect ({len(sockets)} sockets)', connect_times)
+
+    await asyncio.sleep(1)
+    rss, cpu = _process_usage(pid)
+    await asyncio.sleep(idle)
+    _, idle_cpu = _process_usage(pid)
+    print(f'{"server memory":<32} {(rss - rss_before) / len(sockets) / 1024:8.1f} KiB per idle connection')
+    print(f'{"server CPU while idle":<32} {100 * (idle_cpu - cpu) / idle:8.2f}% over {idle}s')
+
+    client = AsyncHTTPClient()
+    delivery, after_response, posts, cpu_times = [], [], [], []
+    for i in range(rounds):
+        received = [None] * len(sockets)
+
+        async def receive(n, socket):
+            await socket.read_message()
+            received[n] = time.perf_counter()
+
+        readers = asyncio.gather(*(receive(n, socket) for n, socket in enumerate(sockets)))
+        _, cpu = _process_usage(pid)
+        start = time.perf_counter()
+        await client.fetch(f'http://127.0.0.1:{port}/api/courses/1/notifications', method='POST',
+                           body=f'course_id=1&body=Notice+{i}', headers={'Cookie': teacher_cookie}, request_timeout=600)
+        responded = time.perf_counter()
+        await readers
+        cpu_times.append(_process_usage(pid)[1] - cpu)
+        posts.append(responded - start)
+        delivery.extend(at - start for at in received)
+        after_response.extend(at - responded for at in received)
+    report('POST notification', posts)
+    report('delivery (from POST)', delivery)
+    report('delivery (after response)', after_response)
+    report('server CPU per notification', cpu_times)
+
+    client.close()
+    for socket in sockets:
+        socket.close()
+
+
+def bench_inbox_push(args):
+    """
+    Memory and CPU of idle inbox WebSocket connections, and how long a course
+    notification takes to reach all of them. The server runs in its own process.
+    """
+    import multiprocessing
+    from tornado.netutil import bind_sockets
+    from migrations import migrate
+    from server import make_app  # reads config.toml from the working directory
+
+    use_temp_database()
+    migrate()
+    with dbpool.connection() as conn:
+        conn.executemany('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+                         ((f'student{i}', '', f'student{i}@example.com', 'student') for i in range(args.connections)))
+        conn.execute("INSERT INTO courses (id, title, description, owner, category) VALUES (1, 'CS101', '', 'teacher', 'General')")
+        conn.executemany('INSERT INTO course_students (course_id, student) VALUES (1, ?)',
+                         ((f'student{i}',) for i in range(args.connections)))
+        conn.commit()
+    app = make_app()
+    start = time.perf_counter()
+    cookies = [login_cookie(app, f'student{i}') for i in range(args.connections)]
+    teacher_cookie = login_cookie(app, 'teacher')
+    print(f'created {args.connections} sessions in {time.perf_counter() - start:.1f}s')
+    dbpool.close_all()
+
+    sock = bind_sockets(0, '127.0.0.1', backlog=1024)[0]
+    server = multiprocessing.get_context('fork').Process(target=_serve_inbox_push, args=(sock,), daemon=True)
+    server.start()
+    try:
+        asyncio.run(_inbox_push(sock.getsockname()[1], server.pid, cookies, teacher_cookie, args.idle, args.rounds))
+    finally:
+        server.terminate()
+        server.join()
+        sock.close()
+
+
+def bench_post_search(args):
+    """
+    Forum full-text search over posts and a large number of replies.
+    """
+    import itertools
+    import random
+    from migrations import migrate
+    from search import search_posts, rebuild_search_index
+
+    use_temp_database()
+    migrate()
+    rng = random.Random(42)
+    # Made-up words with Zipf-like frequencies, like real text.
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'zen', 'dar', 'pel', 'gru', 'shi', 'tor', 'bex', 'qua']
+    vocabulary = sorted({''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(args.vocabulary * 2)})
+    rng.shuffle(vocabulary)
+    vocabulary = vocabulary[:args.vocabulary]
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+    def text(words):
+        return ' '.join(rng.choices(vocabulary, cum_weights=weights, k=words))
+
+    posts = max(1, args.comments // 20)
+    with dbpool.connection() as conn:
+        start = time.perf_counter()
+        conn.executemany("INSERT INTO posts (id, course_id, title, sender_name, content, likes, tag) VALUES (?, 1, ?, 'bench', ?, 0, 'Tech')",
+                         ((i, text(6), text(60)) for i in range(1, posts + 1)))
+        conn.executemany("INSERT INTO post_comments (post_id, floor, commenter_name, comment_content) VALUES (?, ?, 'bench', ?)",
+                         ((1 + i % posts, 2 + i // posts, text(args.words)) for i in range(args.comments)))
+        conn.commit()
+        print(f'seeded {posts} posts and {args.comments} replies (indexed on insert) in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    rebuild_search_index()
+    print(f'rebuild_search_index: {time.perf_counter() - start:.1f}s')
+
+    queries = {
+        'rare word': lambda: vocabulary[rng.randint(5000, len(vocabulary) - 1)],
+        'mid-frequency word': lambda: vocabulary[rng.randint(200, 1000)],
+        'common word': lambda: vocabulary[rng.randint(0, 10)],
+        'two words': lambda: f'{vocabulary[rng.randint(20, 200)]} {vocabulary[rng.randint(20, 200)]}',
+        'prefix': lambda: vocabulary[rng.randint(200, 1000)][:4] + '*',
+    }
+    for name, query in queries.items():
+        samples = []
+        for _ in range(args.queries):
+            q = query()
+            start = time.perf_counter()
+            search_posts(q, 20, 0)
+            samples.append(time.perf_counter() - start)
+        report(f'search: {name}', samples)
+
+    samples = []
+    with dbpool.connection() as conn:
+        for _ in range(3):
+            q = queries['mid-frequency word']()
+            start = time.perf_counter()
+            conn.execute("SELECT id FROM post_comments WHERE comment_content LIKE ? LIMIT 20", (f'%{q}%',)).fetchall()
+            samples.append(time.perf_counter() - start)
+    report('LIKE scan (no ranking)', samples)
+
+
+def bench_user_search(args):
+    """
+    Typeahead student search, indexed versus loading every student and filtering.
+    """
+    import random
+    from database import get_users_by_role_with_id, search_users
+    from migrations import migrate
+
+    use_temp_database()
+    migrate()
+    rng = random.Random(42)
+    first = ['anna', 'ben', 'chloe', 'david', 'emma', 'felix', 'grace', 'henry', 'isla', 'jack', 'kai', 'lena',
+             'mia', 'noah', 'olivia', 'paul', 'quinn', 'rosa', 'sam', 'tara', 'uma', 'victor', 'wei', 'yuki', 'zoe']
+    last = ['smith', 'garcia', 'chen', 'muller', 'rossi', 'kim', 'novak', 'silva', 'tanaka', 'okafor', 'jensen',
+            'dubois', 'kowalski', 'nguyen', 'haddad', 'ivanova', 'patel', 'obrien', 'lindqvist', 'moreau']
+    names = [f'{rng.choice(first)}.{rng.choice(last)}{i}' for i in range(args.users)]
+    with dbpool.connection() as conn:
+        start = time.perf_counter()
+        conn.executemany("INSERT INTO users (username, password_hash, email, role) VALUES (?, '', ?, ?)",
+                         ((name, f'{name}@example.com', 'teacher' if i % 50 == 0 else 'student')
+                          for i, name in enumerate(names)))
+        conn.commit()
+        print(f'seeded {args.users} users in {time.perf_counter() - start:.1f}s')
+
+    def typed(name):
+        # What the search box holds after each keystroke of typing a name.
+        return [name[:n] for n in range(1, len(name) + 1)]
+
+    queries = {
+        'typing a name': [q for name in rng.sample(names, 20) for q in typed(name)],
+        'typing a surname': [q for name in rng.sample(names, 20) for q in typed(name.split('.')[1])],
+        'no match': [f'zz{rng.randint(0, 10 ** 6)}' for _ in range(50)],
+    }
+    for name, batch in queries.items():
+        samples = []
+        for q in batch[:args.queries]:
+            start = time.perf_counter()
+            search_users(q, 'student', 20)
+            samples.append(time.perf_counter() - start)
+        report(f'search_users: {name}', samples)
+
+    samples = []
+    for q in queries['typing a name'][:5]:
+        start = time.perf_counter()
+        [user for user in get_users_by_role_with_id('student') if q.lower() in user['username'].lower()]
+        samples.append(time.perf_counter() - start)
+    report('load all students and filter', samples)
+
+
+def bench_course_search(args):
+    """
+    Catalog search with facet counts, versus sending the whole catalog.
+    """
+    import json
+    import random
+    from migrations import migrate
+    from search import search_courses
+
+    use_temp_database()
+    migrate()
+    rng = random.Random(42)
+    subjects = ['algebra', 'calculus', 'statistics', 'physics', 'chemistry', 'biology', 'history', 'poetry',
+                'economics', 'painting', 'music', 'philosophy', 'programming', 'databases', 'networks', 'robotics']
+    words = ['introduction', 'advanced', 'applied', 'theory', 'practice', 'methods', 'foundations', 'topics',
+             'seminar', 'workshop', 'project', 'analysis', 'design', 'modern', 'classical', 'research']
+    filler = ['the', 'and', 'students', 'learn', 'course', 'weekly', 'with', 'of', 'for', 'how', 'to', 'use']
+    categories = ['Mathematics', 'Science', 'Humanities', 'Arts', 'Computer Science', 'Business']
+    with dbpool.connection() as conn:
+        for i in range(args.courses):
+            subject = rng.choice(subjects)
+            description = rng.choices(filler, k=args.words - 6) + rng.choices(words, k=4) + [subject, rng.choice(subjects)]
+            rng.shuffle(description)
+            conn.execute('INSERT INTO courses (title, description, owner, category, type) VALUES (?, ?, ?, ?, ?)',
+                         (f'{rng.choice(words).title()} {subject.title()} {i}', ' '.join(description), f'teacher{i % 500}',
+                          rng.choice(categories), rng.choice(['open', 'ongoing', 'closed'])))
+        conn.commit()
+
+    def timed(fn, repeat=50):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    report('search: one subject', timed(lambda: search_courses(rng.choice(subjects))))
+    report('search: two words', timed(lambda: search_courses(f'{rng.choice(words)} {rng.choice(subjects)}')))
+    report('search: word in every course', timed(lambda: search_courses('students')))
+    report('search: prefix + filters', timed(lambda: search_courses('prog*', 'Computer Science', 'open')))
+    report('browse: category, no words', timed(lambda: search_courses('', rng.choice(categories))))
+
+    with dbpool.connection() as conn:
+        def whole_catalog():
+            rows = conn.execute('''
+                SELECT c.id, c.title, c.description, c.owner, s.rating_avg, s.rating_count
+                FROM courses c LEFT JOIN course_stats s ON s.course_id = c.id
+            ''').fetchall()
+            return json.dumps([{'id': r[0], 'title': r[1], 'instructor': r[3], 'description': r[2],
+                                'rating': r[4] or 0, 'rating_count': r[5] or 0} for r in rows])
+        report('/api/course/all body', timed(whole_catalog, 10))
+        page = json.dumps(search_courses(rng.choice(subjects)))
+        print(f'response size: whole catalog {len(whole_catalog()) / 2 ** 20:.1f}MiB, search page {len(page) / 1024:.1f}KiB')
+
+
+def bench_watch_time(args):
+    """
+    Video heartbeats written behind in batches, versus one commit per heartbeat.
+    """
+    import asyncio
+    from migrations import migrate
+    from watchtracker import WatchTracker
+
+    use_temp_database()
+    migrate()
+    with dbpool.connection() as conn:
+        conn.executemany("INSERT INTO chapters (id, title, content, course_id) VALUES (?, 'Chapter', '', 1)",
+                         ((i,) for i in range(1, args.chapters + 1)))
+        conn.commit()
+    watchers = [(f'student{i}', 1 + i % args.chapters) for i in range(args.watchers)]
+    # Every watcher sends a heartbeat every 5 seconds, spread over the seconds.
+    per_second = [watchers[second::5] for second in range(5)]
+    heartbeats = args.watchers * args.seconds // 5
+
+    with dbpool.connection() as conn:
+        start = time.perf_counter()
+        for second in range(args.seconds):
+            for username, chapter_id in per_second[second % 5]:
+                conn.execute('''
+                    INSERT INTO watch_sessions (username, chapter_id, watched, last_watched)
+                    VALUES (?, ?, 5, CURRENT_TIMESTAMP)
+                    ON CONFLICT(username, chapter_id) DO UPDATE SET watched = watched + 5
+                ''', (username, chapter_id))
+                conn.commit()
+        elapsed = time.perf_counter() - start
+    print(f'commit per heartbeat: {heartbeats} heartbeats, {heartbeats} commits in {elapsed:.2f}s '
+          f'({heartbeats / elapsed:.0f} heartbeats/s)')
+
+    now = [0.0]
+    tracker = WatchTracker(clock=lambda: now[0])
+
+    async def write_behind():
+        heartbeat_time, flush_samples = 0.0, []
+        for second in range(args.seconds):
+            now[0] = second
+            start = time.perf_counter()
+            for username, chapter_id in per_second[second % 5]:
+                tracker.heartbeat(username, chapter_id, interacted=True)
+            heartbeat_time += time.perf_counter() - start
+            tracker.sweep()
+            if second % tracker.flush_interval == tracker.flush_interval - 1:
+                start = time.perf_counter()
+                await tracker.flush()
+                flush_samples.append(time.perf_counter() - start)
+        return heartbeat_time, flush_samples
+
+    heartbeat_time, flush_samples = asyncio.run(write_behind())
+    elapsed = heartbeat_time + sum(flush_samples)
+    print(f'write-behind: {heartbeats} heartbeats, {tracker.flushes} commits in {elapsed:.2f}s '
+          f'({heartbeats / elapsed:.0f} heartbeats/s)')
+    report('flush', flush_samples)
+
+
+def _serve_login(sock, offload, settings):
+    """
+    Server process of the login-burst benchmark.
+    """
+    import signal
+    import sys
+    from tornado.httpserver import HTTPServer
+    import passwords
+    from asyncdb import pool
+    from server import make_app
+
+    passwords.configure(settings)
+    if offload:
+        passwords.password_hasher.start()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    else:
+        # What LoginHandler did before: check the password on a database thread.
+        async def verify(password, password_hash):
+            return await pool.run(passwords._check_password, password, password_hash)
+
+        passwords.password_hasher.verify = verify
+
+    async def serve():
+        HTTPServer(make_app()).add_sockets([sock])
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        passwords.password_hasher.shutdown()
+
+
+async def _login_burst(port, logins, probe_interval):
+    from tornado.httpclient import AsyncHTTPClient
+
+    client = AsyncHTTPClient(max_clients=logins + 1)
+    base = f'http://127.0.0.1:{port}'
+
+    async def probe():
+        start = time.perf_counter()
+        await client.fetch(f'{base}/api/posts/feed', request_timeout=600)
+        return time.perf_counter() - start
+
+    idle = [await probe() for _ in range(20)]
+    statuses, login_times = {}, []
+
+    async def login(i):
+        start = time.perf_counter()
+        response = await client.fetch(f'{base}/api/login', method='POST', body=f'username=student{i}&password=secret',
+                                      request_timeout=600, raise_error=False)
+        login_times.append(time.perf_counter() - start)
+        statuses[response.code] = statuses.get(response.code, 0) + 1
+
+    burst = asyncio.ensure_future(asyncio.gather(*(login(i) for i in range(logins))))
+    busy = []
+    while not burst.done():
+        busy.append(await probe())
+        await asyncio.sleep(probe_interval)
+    await burst
+    client.close()
+    return idle, busy, login_times, statuses
+
+
+def bench_login_burst(args):
+    """
+    Simultaneous logins, and the latency of an unrelated endpoint (/api/posts/feed)
+    meanwhile, with bcrypt on the database threads (the old behaviour) and in
+    the password hasher's worker processes. The server runs in its own process.
+    """
+    import bcrypt
+    import multiprocessing
+    from tornado.netutil import bind_sockets
+    from migrations import migrate
+    import server  # reads config.toml from the working directory
+
+    use_temp_database()
+    migrate()
+    password_hash = bcrypt.hashpw(b'secret', bcrypt.gensalt(rounds=args.rounds))
+    with dbpool.connection() as conn:
+        conn.executemany('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+                         ((f'student{i}', password_hash, f'student{i}@example.com', 'student') for i in range(args.logins)))
+        conn.commit()
+    dbpool.close_all()
+    # Every login comes from 127.0.0.1, so let the whole burst through the per-IP bucket.
+    settings = {'ip_burst': args.logins, 'max_queue': args.max_queue, 'workers': args.workers}
+
+    for offload in (False, True):
+        sock = bind_sockets(0, '127.0.0.1', backlog=args.logins * 2)[0]
+        # Not a daemon: daemons may not start the hasher's worker processes.
+        process = multiprocessing.get_context('fork').Process(target=_serve_login, args=(sock, offload, settings))
+        process.start()
+        try:
+            time.sleep(1)  # let the hasher's workers start
+            idle, busy, login_times, statuses = asyncio.run(_login_burst(sock.getsockname()[1], args.logins, args.probe_interval))
+        finally:
+            process.terminate()
+            process.join()
+            sock.close()
+        label = 'hasher processes' if offload else 'database threads'
+        report(f'feed, idle ({label})', idle)
+        report(f'feed, during burst ({label})', busy)
+        report(f'login ({label})', login_times)
+        print(f'{"":<32} responses: {dict(sorted(statuses.items()))}')
+
+
+BENCHMARKS = {
+    'loop-latency': (bench_loop_latency, [
+        ('--requests', 2000), ('--concurrency', 20), ('--slow-queries', 4),
+    ]),
+    'course-stats': (bench_course_stats, [
+        ('--courses', 10000), ('--ratings', 1000000),
+    ]),
+    'courseware-range': (bench_courseware_range, [
+        ('--viewers', 1000), ('--seeks', 10), ('--range-size', 64 * 1024), ('--video-size', 64 * 1024 * 1024),
+    ]),
+    'recommender': (bench_recommender, [
+        ('--courses', 10000), ('--students', 200000), ('--enrolments', 5), ('--neighbours', 50),
+    ]),
+    'vector-index': (bench_vector_index, [
+        ('--courses', 10000), ('--dim', 384), ('--queries', 1000), ('--k', 10),
+    ]),
+    'inbox-push': (bench_inbox_push, [
+        ('--connections', 10000), ('--idle', 10), ('--rounds', 5),
+    ]),
+    'post-search': (bench_post_search, [
+        ('--comments', 1000000), ('--words', 30), ('--vocabulary', 20000), ('--queries', 200),
+    ]),
+    'course-search': (bench_course_search, [
+        ('--courses', 20000), ('--words', 40),
+    ]),
+    'watch-time': (bench_watch_time, [
+        ('--watchers', 5000), ('--chapters', 200), ('--seconds', 60),
+    ]),
+    'user-search': (bench_user_search, [
+        ('--users', 500000), ('--queries', 500),
+    ]),
+    'login-burst': (bench_login_burst, [
+        ('--logins', 500), ('--rounds', 12), ('--workers', 1), ('--max-queue', 200), ('--probe-interval', 0.05),
+    ]),
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backend benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    for name, (fn, options) in BENCHMARKS.items():
+        sub = subparsers.add_parser(name, help=fn.__doc__.strip().splitlines()[0])
+        for flag, default in options:
+            sub.add_argument(flag, type=type(default), default=default)
+        sub.set_defaults(fn=fn)
+    args = parser.parse_args()
+    args.fn(args)
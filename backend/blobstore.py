@@ -0,0 +1,149 @@
+"""
+Content-addressed storage for courseware.
+
+Every distinct file content is stored once, as files/blobs/<sha256[:2]>/<sha256>,
+and counted in the `blobs` table by the number of courseware versions that use
+it. Each upload of a (chapter_id, filename) adds a row to `courseware_versions`,
+so earlier versions stay downloadable and identical uploads share one blob.
+
+Blob files are only created or removed while holding SQLite's write lock
+(BEGIN IMMEDIATE), so an upload can never race with the removal of the same blob.
+"""
+
+import os
+
+from dbpool import connection
+
+BLOB_DIR = 'files/blobs'
+
+
+def blob_path(sha256):
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+
+def _begin(conn):
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+
+
+def add_courseware_version(chapter_id, filename, upload_path, sha256, size, content_type, uploaded_by):
+    """
+    Moves the file at `upload_path` into the blob store (or drops it if the blob
+    already exists) and records it as the next version of the courseware.
+    Returns the new version number.
+    """
+    with connection() as conn:
+        _begin(conn)
+        try:
+            path = blob_path(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(upload_path)
+            else:
+                os.replace(upload_path, path)
+            conn.execute('''
+                INSERT INTO blobs (sha256, size, refcount) VALUES (?, ?, 1)
+                ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1
+            ''', (sha256, size))
+            version = conn.execute('''
+                SELECT COALESCE(MAX(version), 0) + 1 FROM courseware_versions WHERE chapter_id = ? AND filename = ?
+            ''', (chapter_id, filename)).fetchone()[0]
+            conn.execute('''
+                INSERT INTO courseware_versions (chapter_id, filename, version, sha256, size, content_type, uploaded_by)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (chapter_id, filename, version, sha256, size, content_type, uploaded_by))
+            if not conn.execute('SELECT 1 FROM courseware WHERE chapter_id = ? AND filename = ?', (chapter_id, filename)).fetchone():
+                conn.execute('INSERT INTO courseware (chapter_id, filename) VALUES (?, ?)', (chapter_id, filename))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return version
+
+
+def delete_courseware_versions(chapter_id, filename):
+    """
+    Drops every version of the courseware and the blobs no longer used by any version.
+    The caller commits; call collect_blobs() afterwards to remove unused blob files.
+    """
+    with connection() as conn:
+        conn.execute('''
+            UPDATE blobs SET refcount = refcount - (
+                SELECT COUNT(*) FROM courseware_versions v
+                WHERE v.sha256 = blobs.sha256 AND v.chapter_id = ? AND v.filename = ?
+            )
+            WHERE sha256 IN (SELECT sha256 FROM courseware_versions WHERE chapter_id = ? AND filename = ?)
+        ''', (chapter_id, filename, chapter_id, filename))
+        conn.execute('DELETE FROM courseware_versions WHERE chapter_id = ? AND filename = ?', (chapter_id, filename))
+
+
+def collect_blobs():
+    """
+    Removes blobs with no remaining versions, and their files. Returns the number removed.
+    """
+    with connection() as conn:
+        _begin(conn)
+        try:
+            unused = [row[0] for row in conn.execute('SELECT sha256 FROM blobs WHERE refcount <= 0')]
+            conn.execute('DELETE FROM blobs WHERE refcount <= 0')
+            for sha256 in unused:
+                try:
+                    os.remove(blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(unused)
+
+
+def get_courseware_version(chapter_id, filename, version=None):
+    """
+    Returns (version, sha256, size, content_type) of the given or latest version, or None.
+    """
+    with connection() as conn:
+        if version is None:
+            return conn.execute('''
+                SELECT version, sha256, size, content_type FROM courseware_versions
+                WHERE chapter_id = ? AND filename = ? ORDER BY version DESC LIMIT 1
+            ''', (chapter_id, filename)).fetchone()
+        return conn.execute('''
+            SELECT version, sha256, size, content_type FROM courseware_versions
+            WHERE chapter_id = ? AND filename = ? AND version = ?
+        ''', (chapter_id, filename, version)).fetchone()
+
+
+def import_legacy_courseware(root='files/courseware'):
+    """
+    Adds courseware files stored before the blob store (files/courseware/<chapter_id>/<filename>)
+    as version 1 of their courseware. Returns the number of files imported.
+    """
+    import hashlib
+    import shutil
+    import tempfile
+
+    with connection() as conn:
+        rows = conn.execute('''
+            SELECT cw.chapter_id, cw.filename, c.owner FROM courseware cw
+            JOIN chapters ch ON ch.id = cw.chapter_id
+            JOIN courses c ON c.id = ch.course_id
+            WHERE NOT EXISTS (SELECT 1 FROM courseware_versions v WHERE v.chapter_id = cw.chapter_id AND v.filename = cw.filename)
+        ''').fetchall()
+
+    imported = 0
+    for chapter_id, filename, owner in rows:
+        path = os.path.join(root, str(chapter_id), filename)
+        if not os.path.isfile(path):
+            continue
+        os.makedirs(BLOB_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=BLOB_DIR)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+                target.write(chunk)
+        shutil.copystat(path, temp_path)
+        add_courseware_version(chapter_id, filename, temp_path, digest.hexdigest(), os.path.getsize(path), None, owner)
+        imported += 1
+    return imported
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class GroupCache:
+    """
+    An in-process LRU cache whose entries are organised in groups, e.g. one group
+    per course holding one entry per viewer role. A whole group is invalidated
+    at once when the underlying data changes.
+
+    Entries also expire after `ttl` seconds (if given), which bounds staleness
+    when another process changed the data. A group holds at most `max_entries`
+    entries (if given), dropping its least recently used one, so keys taken from
+    requests cannot grow a group without bound.
+    """
+    def __init__(self, max_groups=1024, ttl=None, max_entries=None):
+        self.max_groups = max_groups
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, group, key):
+        with self._lock:
+            entries = self._groups.get(group)
+            entry = entries.get(key) if entries else None
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                del entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._groups.move_to_end(group)
+            entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def epoch(self):
+        """
+        Returns a token to pass to set(). Take it before reading the data to be
+        cached: if anything is invalidated in between, set() drops the value.
+        """
+        return self._epoch
+
+    def set(self, group, key, value, epoch=None):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            entries = self._groups.get(group)
+            if entries is None:
+                entries = self._groups[group] = OrderedDict()
+                if len(self._groups) > self.max_groups:
+                    self._groups.popitem(last=False)
+            else:
+                self._groups.move_to_end(group)
+            entries[key] = (value, expires)
+            entries.move_to_end(key)
+            if self.max_entries is not None and len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, group):
+        with self._lock:
+            self._epoch += 1
+            self._groups.pop(group, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._groups.clear()
+
+    def metrics(self):
+        return {'groups': len(self._groups), 'hits': self.hits, 'misses': self.misses}
+
+
+# Rendered GET /api/courses/<id> bodies, grouped by course id and keyed by whether
+# the viewer is a student (students only see published chapters).
+course_detail_cache = GroupCache(max_groups=4096, ttl=300)
+
+# What CourseWareFileHandlerWithAuth needs to authorize a download (owner, visibility,
+# blob), grouped by chapter id and keyed by (filename, version). A video player sends
+# many Range requests per viewer. Files that do not exist are not cached.
+courseware_access_cache = GroupCache(max_groups=4096, ttl=30, max_entries=256)
+
+# Rendered GET /api/posts/feed pages, grouped by (posts version, course_id, tag) and
+# keyed by (decoded cursor position, limit), for the limits in
+# PostFeedHandler.CACHED_LIMITS only. A new post bumps the version, and the groups of
+# older versions are never read again and fall out of the LRU.
+post_feed_cache = GroupCache(max_groups=1024, max_entries=64)
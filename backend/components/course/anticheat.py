@@ -1,44 +1,38 @@
-import time
+import tornado.escape
 import tornado.web
+from components.user.base import BaseHandler
+from watchtracker import watch_tracker
 
-class VideoAnticheatHandler(tornado.web.RequestHandler):
+class VideoAnticheatHandler(BaseHandler):
     """
     Handles video anti-cheat functionalities.
     """
-    users_watch_time = {}
-
     @tornado.web.authenticated
     def post(self):
-        username = self.get_current_user()
-        data = tornado.escape.json_decode(self.request.body)
-        watch_time = data.get('watch_time')
+        """
+        Heartbeat from the video player, sent every few seconds while a chapter's video plays.
 
-        if username in self.users_watch_time and self.users_watch_time[username]['active']:
-            self.write({"violation": True})
-            return
+        Body (JSON):
+        - chapter_id: the chapter being watched.
+        - interacted: whether the viewer interacted with the page since the last heartbeat.
+        - playing: false when the video is paused or closed, which ends the session.
 
-        self.users_watch_time[username] = {
-            'watch_time': watch_time,
-            'last_active': time.time(),
-            'active': True
-        }
+        Returns {"violation": false}, or {"violation": true, "reason": ...} where the
+        reason is "another_video" (another chapter is already playing) or "hang_up"
+        (no interaction for too long); the player should then stop.
+        """
+        username = self.get_current_user()
+        try:
+            data = tornado.escape.json_decode(self.request.body)
+            chapter_id = int(data['chapter_id'])
+        except (ValueError, KeyError, TypeError):
+            self.set_status(400)
+            self.write("Bad Request: chapter_id is required.")
+            return
 
-        # Check if the user is "cheating" by being inactive or playing more than one video
-        if watch_time >= 300:  # After 5 minutes of watching
-            last_active = self.users_watch_time[username]['last_active']
-            if time.time() - last_active > 60:  # Assume user inactive if no activity for 60 seconds
-                self.write({"violation": True})
-            else:
-                self.write({"violation": False})
-        else:
+        if not data.get('playing', True):
+            watch_tracker.stop(username, chapter_id)
             self.write({"violation": False})
-
-    @staticmethod
-    def check_inactivity():
-        """
-        Periodic check for user inactivity. This can be run as a background task.
-        """
-        current_time = time.time()
-        for user_id, data in VideoAnticheatHandler.users_watch_time.items():
-            if data['active'] and current_time - data['last_active'] > 60:
-                data['active'] = False
\ No newline at end of file
+            return
+        reason = watch_tracker.heartbeat(username, chapter_id, bool(data.get('interacted')))
+        self.write({"violation": True, "reason": reason} if reason else {"violation": False})
@@ -1,25 +1,33 @@
 import os
 import json
+import asyncio
+import mimetypes
 import time
 import sqlite3
 import tornado.web
 from components.user.base import BaseHandler
-from database import DATABASE, get_user_role
-
-class CourseWareHandler(BaseHandler):
+from database import get_user_role
+from asyncdb import pool
+from dbpool import connection
+from cache import course_detail_cache, courseware_access_cache
+from uploads import StreamingUploadMixin
+from blobstore import add_courseware_version, delete_courseware_versions, collect_blobs, get_courseware_version, blob_path
+
+@tornado.web.stream_request_body
+class CourseWareHandler(StreamingUploadMixin, BaseHandler):
     """
     Handles the courseware of a chapter.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
-        Uploads a courseware to the chapter.
+        Uploads a courseware to the chapter. The body is streamed to disk (see uploads.py).
 
         Supported file formats: PDF, MD, TXT, DOCX, PPTX, XLSX, JPG, PNG, MP4, MOV, AVI, MKV.
 
         Note:
-        - The courseware will be stored in the 'files/courseware' directory.
-        - The filename will be hashed and stored in the database.
+        - The content is stored once in the blob store (see blobstore.py), named by its SHA-256.
+        - Uploading a file with the same name again adds a new version; earlier versions are kept.
         - Only the owner of the course can upload courseware.
         - The courseware is invisible to students by default.
 
@@ -32,41 +40,34 @@ class CourseWareHandler(BaseHandler):
         """
         username = self.get_current_user()
         chapter_id = self.get_argument("chapter_id")
-        file = self.request.files['file'][0]
+        file = self.get_upload('file')
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                filename = file['filename'] # + time.strftime('%Y%m%d%H%M%S') # Add timestamp for versioning
-                file_path = f'files/courseware/{chapter_id}/{filename}'
-                if not os.path.exists(f'files/courseware/{chapter_id}'):
-                    os.makedirs(f'files/courseware/{chapter_id}')
-                with open(file_path, 'wb') as f:
-                    f.write(file['body'])
-                cursor.execute('''
-                    INSERT INTO courseware (chapter_id, filename) VALUES (?, ?)
-                ''', (chapter_id, filename))
-                conn.commit()
-                self.write(filename)
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to upload courseware to this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner, c.id FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
+                ''', (chapter_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    filename = file.filename
+                    await conn.run(add_courseware_version, chapter_id, filename, file.path, file.sha256,
+                                   file.size, file.content_type, username)
+                    courseware_access_cache.invalidate(int(chapter_id))
+                    course_detail_cache.invalidate(owner[1])
+                    self.write(filename)
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to upload courseware to this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns the courseware of the chapter.
 
@@ -75,52 +76,63 @@ class CourseWareHandler(BaseHandler):
 
         Required arguments:
         - chapter_id: The id of the chapter.
+
+        Optional arguments:
+        - filename: Only for the owner; returns the versions of this courseware instead.
         """
         username = self.get_current_user()
         chapter_id = self.get_argument("chapter_id")
+        filename = self.get_argument("filename", None)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    SELECT filename FROM courseware WHERE chapter_id = ?
-                ''', (chapter_id,))
-                courseware = cursor.fetchall()
-                self.write(json.dumps(courseware))
-            else:
-                cursor.execute('''
-                    SELECT published FROM chapters WHERE id = ?
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
                 ''', (chapter_id,))
-                published = cursor.fetchone()
-                if published and published[0] == 1:
-                    cursor.execute('''
-                        SELECT filename, is_visible, is_downloadable FROM courseware WHERE chapter_id = ?
+                owner = cursor.fetchone()
+                if owner and owner[0] == username and filename:
+                    await cursor.execute('''
+                        SELECT version, sha256, size, content_type, uploaded_by, uploaded_at FROM courseware_versions
+                        WHERE chapter_id = ? AND filename = ? ORDER BY version DESC
+                    ''', (chapter_id, filename))
+                    versions = [{'version': v[0], 'sha256': v[1], 'size': v[2], 'content_type': v[3], 'uploaded_by': v[4],
+                                 'uploaded_at': v[5], 'link': f'/api/files/courseware/{chapter_id}/{filename}?version={v[0]}'}
+                                for v in cursor.fetchall()]
+                    self.write(json.dumps(versions))
+                elif owner and owner[0] == username:
+                    await cursor.execute('''
+                        SELECT filename FROM courseware WHERE chapter_id = ?
                     ''', (chapter_id,))
                     courseware = cursor.fetchall()
-                    if get_user_role(username) == 'student':
-                        courseware = [file for file in courseware if file[1] == 1]
                     self.write(json.dumps(courseware))
                 else:
-                    self.set_status(403)
-                    self.write("Forbidden: You do not have permission to access the courseware of this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    await cursor.execute('''
+                        SELECT published FROM chapters WHERE id = ?
+                    ''', (chapter_id,))
+                    published = cursor.fetchone()
+                    if published and published[0] == 1:
+                        await cursor.execute('''
+                            SELECT filename, is_visible, is_downloadable FROM courseware WHERE chapter_id = ?
+                        ''', (chapter_id,))
+                        courseware = cursor.fetchall()
+                        if await conn.run(get_user_role, username) == 'student':
+                            courseware = [file for file in courseware if file[1] == 1]
+                        self.write(json.dumps(courseware))
+                    else:
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to access the courseware of this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
-        Deletes the courseware of the chapter.
+        Deletes the courseware of the chapter, with all its versions.
 
         Note:
         - Only the owner of the course can delete courseware.
@@ -133,36 +145,39 @@ class CourseWareHandler(BaseHandler):
         chapter_id = self.get_argument("chapter_id")
         filename = self.get_argument("filename")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    DELETE FROM courseware WHERE chapter_id = ? AND filename = ?
-                ''', (chapter_id, filename))
-                file_path = f'files/courseware/{filename}'
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                conn.commit()
-                self.write("Courseware deleted successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to delete courseware from this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner, c.id FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
+                ''', (chapter_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        DELETE FROM courseware WHERE chapter_id = ? AND filename = ?
+                    ''', (chapter_id, filename))
+                    await conn.run(delete_courseware_versions, chapter_id, filename)
+                    # Files uploaded before the blob store existed.
+                    file_path = f'files/courseware/{chapter_id}/{filename}'
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    await conn.commit()
+                    courseware_access_cache.invalidate(int(chapter_id))
+                    await conn.run(collect_blobs)
+                    course_detail_cache.invalidate(owner[1])
+                    self.write("Courseware deleted successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to delete courseware from this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def put(self):
+    async def put(self):
         """
         Updates the visibility or downloadability of the courseware of the chapter.
 
@@ -185,33 +200,32 @@ class CourseWareHandler(BaseHandler):
         is_visible = self.get_argument("is_visible")
         is_downloadable = self.get_argument("is_downloadable")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    UPDATE courseware SET is_visible = ?, is_downloadable = ? WHERE chapter_id = ? AND filename = ?
-                ''', (is_visible, is_downloadable, chapter_id, filename))
-                conn.commit()
-                self.write({"is_visible": is_visible, "is_downloadable": is_downloadable})
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to update the visibility of courseware in this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
+                ''', (chapter_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        UPDATE courseware SET is_visible = ?, is_downloadable = ? WHERE chapter_id = ? AND filename = ?
+                    ''', (is_visible, is_downloadable, chapter_id, filename))
+                    await conn.commit()
+                    courseware_access_cache.invalidate(int(chapter_id))
+                    self.write({"is_visible": is_visible, "is_downloadable": is_downloadable})
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to update the visibility of courseware in this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
-class CourseWareFileHandlerWithAuth(tornado.web.StaticFileHandler):
+class CourseWareFileHandlerWithAuth(BaseHandler, tornado.web.StaticFileHandler):
     """
     File handler with authentication for courseware.
 
@@ -221,52 +235,122 @@ class CourseWareFileHandlerWithAuth(tornado.web.StaticFileHandler):
     2. If the user is a student, they can access the courseware only if it is visible.
 
     However, when requesting the file, the path should be '/files/courseware/<chapter_id>/<filename>'.
+    The latest version is served unless `?version=<n>` is given. Files are served
+    from the blob store, with the content hash as a strong ETag.
     """
-    def validate_absolute_path(self, root, absolute_path):
-        username = self.get_current_user()
-        chapter_id = self.request.path.split('/')[-2]
-        filename = self.request.path.split('/')[-1]
+    blob = None
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+    # (chapter_id, filename, version) -> Future of a file_info() call in progress.
+    _loading = {}
+
+    async def prepare(self):
+        """
+        Checks access to the requested file before it is served.
+
+        What decides access (the course owner, the file's visibility and the blob
+        to serve) is the same for every viewer, so it is cached briefly per file
+        (cache.courseware_access_cache) and concurrent misses share one query.
+        A video player's Range requests then never touch the database.
+        """
+        await super().prepare()
+        username = self.get_current_user()
+        chapter_id, _, filename = self.path_args[0].partition('/')
+        version = self.get_argument("version", None)
+        if not username:
+            raise tornado.web.HTTPError(403)
+        if not chapter_id.isdigit() or (version is not None and not version.isdigit()):
+            raise tornado.web.HTTPError(404)
 
         try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and (owner[0] == username or get_user_role(username) == 'admin'):
-                return absolute_path
-            else:
-                try:
-                    cursor.execute('''
-                        SELECT is_visible FROM courseware WHERE chapter_id = ? AND filename = ?
-                    ''', (chapter_id, filename))
-                    is_visible = cursor.fetchone()
-                    if is_visible and is_visible[0] == 1:
-                        return absolute_path
-                except sqlite3.Error:
-                    return absolute_path
-                else:
-                    raise tornado.web.HTTPError(403)
+            info = await self.load_file_info(int(chapter_id), filename, int(version) if version else None)
+            if info is None:
+                raise tornado.web.HTTPError(404)
+            owner, is_visible, self.blob = info
+            if owner != username and is_visible != 1 and await pool.run(get_user_role, username) != 'admin':
+                raise tornado.web.HTTPError(403)
         except sqlite3.Error as e:
             self.set_status(500)
             print(e)
-            self.write(str(e))
+            self.finish(str(e))
+            return
+        if version and not self.blob:
+            raise tornado.web.HTTPError(404)
+
+    async def load_file_info(self, chapter_id, filename, version):
+        key = (filename, version)
+        info = courseware_access_cache.get(chapter_id, key)
+        if info is not None:
+            return info
+        loading = self._loading.get((chapter_id, key))
+        if loading is not None:
+            return await loading
+        epoch = courseware_access_cache.epoch()
+        loading = self._loading[(chapter_id, key)] = asyncio.ensure_future(
+            pool.run(self.file_info, chapter_id, filename, version))
+        try:
+            info = await loading
         finally:
-            conn.close()
-
+            del self._loading[(chapter_id, key)]
+        # Only files that exist: any filename can be asked for, and each would take an entry.
+        if info is not None and (info[1] is not None or info[2] is not None):
+            courseware_access_cache.set(chapter_id, key, info, epoch)
+        return info
+
+    @staticmethod
+    def file_info(chapter_id, filename, version):
+        """
+        Returns (owner, is_visible, blob) for a courseware file, or None if the
+        chapter does not exist. blob is the (version, sha256, size, content_type)
+        to serve, or None for files stored before the blob store.
+        """
+        with connection() as conn:
+            owner = conn.execute('''
+                SELECT owner FROM courses c
+                JOIN chapters ch ON c.id = ch.course_id
+                WHERE ch.id = ?
+            ''', (chapter_id,)).fetchone()
+            if not owner:
+                return None
+            is_visible = conn.execute('''
+                SELECT is_visible FROM courseware WHERE chapter_id = ? AND filename = ?
+            ''', (chapter_id, filename)).fetchone()
+            return owner[0], is_visible[0] if is_visible else None, get_courseware_version(chapter_id, filename, version)
 
-class HomeworkProjectHandler(BaseHandler):
+    def validate_absolute_path(self, root, absolute_path):
+        if self.blob:
+            absolute_path = os.path.abspath(blob_path(self.blob[1]))
+        if not os.path.isfile(absolute_path):
+            raise tornado.web.HTTPError(404)
+        return absolute_path
+
+    def compute_etag(self):
+        if self.blob:
+            return f'"{self.blob[1]}"'
+        return super().compute_etag()
+
+    def get_content_type(self):
+        if self.blob:
+            return mimetypes.guess_type(self.path)[0] or self.blob[3] or 'application/octet-stream'
+        return super().get_content_type()
+
+    def set_extra_headers(self, path):
+        # A numbered version never changes, so browsers may keep it; the latest
+        # version is revalidated with its ETag on every use.
+        if self.blob and self.get_argument("version", None):
+            self.set_header("Cache-Control", "private, max-age=31536000, immutable")
+        else:
+            self.set_header("Cache-Control", "private, no-cache")
+
+
+@tornado.web.stream_request_body
+class HomeworkProjectHandler(StreamingUploadMixin, BaseHandler):
     """
     Handles the homework and project submissions of a chapter.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
-        Uploads a homework or project submission to the chapter.
+        Uploads a homework or project submission to the chapter. The body is streamed to disk (see uploads.py).
 
         Supported file formats: PDF, MD, TXT, DOCX, PPTX, XLSX, JPG, PNG, MP4, MOV, AVI, MKV.
 
@@ -286,39 +370,33 @@ class HomeworkProjectHandler(BaseHandler):
         username = self.get_current_user()
         course_id = self.get_argument("course_id")
         chapter_id = self.get_argument("chapter_id")
-        file = self.request.files['file'][0]
-
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute('''
-                SELECT student FROM course_students WHERE course_id = ? AND student = ?
-            ''', (course_id, username))
-            student = cursor.fetchone()
-            if student:
-                filename = file['filename'] # + time.strftime('%Y%m%d%H%M%S') # Add timestamp for versioning
-                file_path = f'files/hwpj/{chapter_id}/{filename}'
-                if not os.path.exists(f'files/hwpj/{chapter_id}'):
-                    os.makedirs(f'files/hwpj/{chapter_id}')
-                with open(file_path, 'wb') as f:
-                    f.write(file['body'])
-                cursor.execute('''
-                    INSERT INTO hwpj (chapter_id, filename) VALUES (?, ?)
-                ''', (chapter_id, filename))
-                conn.commit()
-                self.write(filename)
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You are not enrolled in this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+        file = self.get_upload('file')
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    SELECT student FROM course_students WHERE course_id = ? AND student = ?
+                ''', (course_id, username))
+                student = cursor.fetchone()
+                if student:
+                    filename = file.filename # + time.strftime('%Y%m%d%H%M%S') # Add timestamp for versioning
+                    await self.save_upload(file, f'files/hwpj/{chapter_id}/{filename}')
+                    await cursor.execute('''
+                        INSERT INTO hwpj (chapter_id, filename) VALUES (?, ?)
+                    ''', (chapter_id, filename))
+                    await conn.commit()
+                    self.write(filename)
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You are not enrolled in this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns the submissions of the chapter.
 
@@ -331,46 +409,44 @@ class HomeworkProjectHandler(BaseHandler):
         username = self.get_current_user()
         chapter_id = self.get_argument("chapter_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    SELECT filename FROM hwpj WHERE chapter_id = ?
-                ''', (chapter_id,))
-                submissions = cursor.fetchall()
-                self.write(json.dumps(submissions))
-            else:
-                cursor.execute('''
-                    SELECT published FROM chapters WHERE id = ?
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
                 ''', (chapter_id,))
-                published = cursor.fetchone()
-                if published and published[0] == 1:
-                    cursor.execute('''
-                        SELECT filename, is_visible, is_downloadable FROM hwpj WHERE chapter_id = ?
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        SELECT filename FROM hwpj WHERE chapter_id = ?
                     ''', (chapter_id,))
                     submissions = cursor.fetchall()
-                    if get_user_role(username) == 'student':
-                        submissions = [file for file in submissions if file[1] == 1]
                     self.write(json.dumps(submissions))
                 else:
-                    self.set_status(403)
-                    self.write("Forbidden: You do not have permission to access the submissions of this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    await cursor.execute('''
+                        SELECT published FROM chapters WHERE id = ?
+                    ''', (chapter_id,))
+                    published = cursor.fetchone()
+                    if published and published[0] == 1:
+                        await cursor.execute('''
+                            SELECT filename, is_visible, is_downloadable FROM hwpj WHERE chapter_id = ?
+                        ''', (chapter_id,))
+                        submissions = cursor.fetchall()
+                        if await conn.run(get_user_role, username) == 'student':
+                            submissions = [file for file in submissions if file[1] == 1]
+                        self.write(json.dumps(submissions))
+                    else:
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to access the submissions of this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         Deletes the submission of the chapter.
 
@@ -385,36 +461,34 @@ class HomeworkProjectHandler(BaseHandler):
         chapter_id = self.get_argument("chapter_id")
         filename = self.get_argument("filename")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    DELETE FROM hwpj WHERE chapter_id = ? AND filename = ?
-                ''', (chapter_id, filename))
-                file_path = f'files/hwpj/{filename}'
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                conn.commit()
-                self.write("Submission deleted successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to delete submissions from this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
+                ''', (chapter_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        DELETE FROM hwpj WHERE chapter_id = ? AND filename = ?
+                    ''', (chapter_id, filename))
+                    file_path = f'files/hwpj/{filename}'
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    await conn.commit()
+                    self.write("Submission deleted successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to delete submissions from this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def put(self):
+    async def put(self):
         """
         Updates the visibility or downloadability of the submission of the chapter.
 
@@ -437,27 +511,25 @@ class HomeworkProjectHandler(BaseHandler):
         is_visible = self.get_argument("is_visible")
         is_downloadable = self.get_argument("is_downloadable")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses c
-                JOIN chapters ch ON c.id = ch.course_id
-                WHERE ch.id = ?
-            ''', (chapter_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    UPDATE hwpj SET is_visible = ?, is_downloadable = ? WHERE chapter_id = ? AND filename = ?
-                ''', (is_visible, is_downloadable, chapter_id, filename))
-                conn.commit()
-                self.write({"is_visible": is_visible, "is_downloadable": is_downloadable})
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to update the visibility of submissions in this chapter.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
\ No newline at end of file
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses c
+                    JOIN chapters ch ON c.id = ch.course_id
+                    WHERE ch.id = ?
+                ''', (chapter_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        UPDATE hwpj SET is_visible = ?, is_downloadable = ? WHERE chapter_id = ? AND filename = ?
+                    ''', (is_visible, is_downloadable, chapter_id, filename))
+                    await conn.commit()
+                    self.write({"is_visible": is_visible, "is_downloadable": is_downloadable})
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to update the visibility of submissions in this chapter.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
\ No newline at end of file
@@ -4,16 +4,21 @@ import time
 import tornado.web
 import re
 from components.user.base import BaseHandler
-from database import DATABASE
+from database import update_course_stats
+from asyncdb import pool, bulk_pool
+from recommender import recommender
+from leaderboard import popularity, WEIGHTS
+from components.inbox import inbox_feed
 
 class CourseNotifHandler(BaseHandler):
     """
     Handles the notifications of a course.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
-        Sends a notification to the course.
+        Sends a notification to the course. It is stored once and shows up in the
+        inbox of every student of the course.
         """
         username = self.get_current_user()
         course_id = self.get_argument("course_id")
@@ -21,33 +26,27 @@ class CourseNotifHandler(BaseHandler):
         body = self.get_argument("body")
         priority = self.get_argument("priority", 0)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    SELECT student FROM course_students WHERE course_id = ?
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
                 ''', (course_id,))
-                students = cursor.fetchall()
-                for student in students:
-                    cursor.execute('''
-                        INSERT INTO messages (sender, receiver, subject, body, timestamp, read, type, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (username, student[0], subject, body, time.strftime('%Y-%m-%d %H:%M:%S'), 0, 'course', priority))
-                conn.commit()
-                self.write("Notification sent to the course successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to send notifications to this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp, type, priority) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (course_id, username, subject, body, time.strftime('%Y-%m-%d %H:%M:%S'), 'course', priority))
+                    await conn.commit()
+                    inbox_feed.wake()
+                    self.write("Notification sent to the course successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to send notifications to this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
 class CourseLikeHandler(BaseHandler):
@@ -56,7 +55,7 @@ class CourseLikeHandler(BaseHandler):
     """
 
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns the number of likes of a course.
 
@@ -64,23 +63,21 @@ class CourseLikeHandler(BaseHandler):
         """
         course_id = re.search(r'/(\d+)', self.request.uri).group(1)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT COUNT(*) FROM course_likes WHERE course_id = ?
-            ''', (course_id,))
-            likes = cursor.fetchone()
-            self.write(json.dumps(likes[0]))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT COUNT(*) FROM course_likes WHERE course_id = ?
+                ''', (course_id,))
+                likes = cursor.fetchone()
+                self.write(json.dumps(likes[0]))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Likes a course.
 
@@ -91,39 +88,39 @@ class CourseLikeHandler(BaseHandler):
         username = self.get_current_user()
         course_id = re.search(r'/(\d+)', self.request.uri).group(1)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT student FROM course_students WHERE course_id = ?
-            ''', (course_id,))
-            students = cursor.fetchall()
-            if (username,) in students:
-                cursor.execute('''
-                    SELECT student FROM course_likes WHERE course_id = ? AND student = ?
-                ''', (course_id, username))
-                like = cursor.fetchone()
-                if like:
-                    cursor.execute('''
-                        DELETE FROM course_likes WHERE course_id = ? AND student = ?
+            try:
+                await cursor.execute('''
+                    SELECT student FROM course_students WHERE course_id = ?
+                ''', (course_id,))
+                students = cursor.fetchall()
+                if (username,) in students:
+                    await cursor.execute('''
+                        SELECT liked_at FROM course_likes WHERE course_id = ? AND student = ?
                     ''', (course_id, username))
-                    conn.commit()
-                    self.write("Course unliked successfully.")
+                    like = cursor.fetchone()
+                    if like:
+                        await cursor.execute('''
+                            DELETE FROM course_likes WHERE course_id = ? AND student = ?
+                        ''', (course_id, username))
+                        await conn.commit()
+                        popularity.record(course_id, -WEIGHTS['like'], at=like[0])
+                        self.write("Course unliked successfully.")
+                    else:
+                        await cursor.execute('''
+                            INSERT INTO course_likes (course_id, student) VALUES (?, ?)
+                        ''', (course_id, username))
+                        await conn.commit()
+                        popularity.record(course_id, WEIGHTS['like'])
+                        self.write("Course liked successfully.")
                 else:
-                    cursor.execute('''
-                        INSERT INTO course_likes (course_id, student) VALUES (?, ?)
-                    ''', (course_id, username))
-                    conn.commit()
-                    self.write("Course liked successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to like this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to like this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
 class CheckLikeHandler(BaseHandler):
@@ -131,7 +128,7 @@ class CheckLikeHandler(BaseHandler):
     Checks if the user has liked the course.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns whether the user has liked the course.
 
@@ -140,23 +137,21 @@ class CheckLikeHandler(BaseHandler):
         username = self.get_current_user()
         course_id = re.search(r'/(\d+)', self.request.uri).group(1)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT student FROM course_likes WHERE course_id = ? AND student = ?
-            ''', (course_id, username))
-            like = cursor.fetchone()
-            if like:
-                self.write("true")
-            else:
-                self.write("false")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT student FROM course_likes WHERE course_id = ? AND student = ?
+                ''', (course_id, username))
+                like = cursor.fetchone()
+                if like:
+                    self.write("true")
+                else:
+                    self.write("false")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
 class CourseRecommendHandler(BaseHandler):
@@ -164,13 +159,72 @@ class CourseRecommendHandler(BaseHandler):
     Handles the recommendations of a course.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
-        Returns the recommended courses for the user.
+        Returns the recommended courses for the user as [course_id, score] pairs.
+
+        Recommendations are precomputed by `database.py recommend-users`; users
+        without any (e.g. new users) get the most popular courses from the
+        popularity leaderboard.
         """
         username = self.get_current_user()
-        recommended_courses = recommend_courses_with_content(username)
-        self.write(json.dumps(recommended_courses))
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    SELECT course_id, score FROM user_recommendations WHERE username = ? ORDER BY rank
+                ''', (username,))
+                recommended_courses = [list(row) for row in cursor.fetchall()]
+                if not recommended_courses:
+                    if not popularity.loaded:
+                        await conn.run(popularity.load)
+                    recommended_courses = [pair for pair in popularity.top_courses(10) if pair[1] > 0]
+                self.write(json.dumps(recommended_courses))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+class SimilarCoursesHandler(BaseHandler):
+    """
+    Handles the courses similar to a course.
+    """
+    @tornado.web.authenticated
+    async def get(self):
+        """
+        Returns the courses whose descriptions are most similar to the course's, most similar first.
+        """
+        course_id = int(re.search(r'/(\d+)', self.request.path).group(1))
+        count = self.get_argument("count", "10")
+        if not count.isdigit():
+            self.set_status(400)
+            self.write("Bad Request: count must be a number.")
+            return
+        similar = await bulk_pool.run(recommender.similar, course_id, min(int(count), 50))
+        if similar is None:
+            self.set_status(404)
+            self.write("Course not found.")
+            return
+        if not similar:
+            self.write(json.dumps([]))
+            return
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                scores = dict(similar)
+                await cursor.execute(f'''
+                    SELECT id, title, description, owner FROM courses WHERE id IN ({','.join('?' * len(scores))})
+                ''', tuple(scores))
+                courses = {course[0]: course for course in cursor.fetchall()}
+                self.write(json.dumps([{'id': course_id, 'title': courses[course_id][1], 'description': courses[course_id][2],
+                                        'instructor': courses[course_id][3], 'score': score}
+                                       for course_id, score in similar if course_id in courses]))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
 
 class CourseCommentsHandler(BaseHandler):
     """
@@ -179,7 +233,7 @@ class CourseCommentsHandler(BaseHandler):
     Note: This is different from the evaluation comments.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Adds a comment to a course.
 
@@ -192,46 +246,42 @@ class CourseCommentsHandler(BaseHandler):
         course_id = self.get_argument("course_id")
         comment = self.get_argument("content")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                INSERT INTO course_comments (course_id, student, comment) VALUES (?, ?, ?)
-            ''', (course_id, username, comment))
-            conn.commit()
-            self.write("Comment added successfully.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    INSERT INTO course_comments (course_id, student, comment) VALUES (?, ?, ?)
+                ''', (course_id, username, comment))
+                await conn.commit()
+                self.write("Comment added successfully.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Gets the comments of a course.
         """
         course_id = self.get_argument("course_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT student, comment, date_submitted FROM course_comments WHERE course_id = ?
-            ''', (course_id,))
-            comments = cursor.fetchall()
-            comments = [{'user': comment[0], 'content': comment[1], 'timestamp': comment[2]} for comment in comments]
-            self.write(json.dumps(comments))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT student, comment, date_submitted FROM course_comments WHERE course_id = ?
+                ''', (course_id,))
+                comments = cursor.fetchall()
+                comments = [{'user': comment[0], 'content': comment[1], 'timestamp': comment[2]} for comment in comments]
+                self.write(json.dumps(comments))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         Deletes a comment from a course.
 
@@ -244,28 +294,26 @@ class CourseCommentsHandler(BaseHandler):
         username = self.get_current_user()
         comment_id = self.get_argument("comment_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT student FROM course_comments WHERE id = ?
-            ''', (comment_id,))
-            student = cursor.fetchone()
-            if student and student[0] == username:
-                cursor.execute('''
-                    DELETE FROM course_comments WHERE id = ?
+            try:
+                await cursor.execute('''
+                    SELECT student FROM course_comments WHERE id = ?
                 ''', (comment_id,))
-                conn.commit()
-                self.write("Comment deleted successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to delete this comment.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                student = cursor.fetchone()
+                if student and student[0] == username:
+                    await cursor.execute('''
+                        DELETE FROM course_comments WHERE id = ?
+                    ''', (comment_id,))
+                    await conn.commit()
+                    self.write("Comment deleted successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to delete this comment.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class CourseRatingHandler(BaseHandler):
     """
@@ -274,7 +322,7 @@ class CourseRatingHandler(BaseHandler):
     Note: This is the evaluation/rating.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Adds a rating to a course.
 
@@ -298,46 +346,51 @@ class CourseRatingHandler(BaseHandler):
         gain = self.get_argument("gain")
         comment = self.get_argument("comment")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
         try:
-            cursor.execute('''
-                INSERT INTO rating (course_id, sender_name, star, difficulty, workload, grading, gain, comment) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                (course_id, username, star, difficulty, workload, grading, gain, comment))
-            conn.commit()
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            star = int(star)
+        except ValueError:
+            self.set_status(400)
+            self.write("Invalid star value.")
+            return
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    INSERT INTO rating (course_id, sender_name, star, difficulty, workload, grading, gain, comment) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (course_id, username, star, difficulty, workload, grading, gain, comment))
+                await conn.run(update_course_stats, course_id, star, 1)
+                await conn.commit()
+                popularity.record(course_id, WEIGHTS['rating'] * (star - 3))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Gets the rating of a course.
         """
         course_id = self.get_argument("course_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT sender_name, star, difficulty, workload, grading, gain, comment, date_submitted FROM rating WHERE course_id = ?
-            ''', (course_id,))
-            rating = cursor.fetchall()
-            rates = [{'sender_name': rate[0], 'star': rate[1], 'difficulty': rate[2], 'workload': rate[3], 'grading': rate[4], 'gain': rate[5],
-                      'comment': rate[6], 'timestamp': rate[7]} for rate in rating]
-            self.write(json.dumps(rates))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT sender_name, star, difficulty, workload, grading, gain, comment, date_submitted FROM rating WHERE course_id = ?
+                ''', (course_id,))
+                rating = cursor.fetchall()
+                rates = [{'sender_name': rate[0], 'star': rate[1], 'difficulty': rate[2], 'workload': rate[3], 'grading': rate[4], 'gain': rate[5],
+                          'comment': rate[6], 'timestamp': rate[7]} for rate in rating]
+                self.write(json.dumps(rates))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         Deletes a feedback from the rating of a course.
 
@@ -350,36 +403,38 @@ class CourseRatingHandler(BaseHandler):
         username = self.get_current_user()
         feedback_id = self.get_argument("feedback_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT sender_name FROM rating WHERE id = ?
-            ''', (feedback_id,))
-            student = cursor.fetchone()
-            if student and student[0] == username:
-                cursor.execute('''
-                    DELETE FROM rating WHERE id = ?
+            try:
+                await cursor.execute('''
+                    SELECT sender_name, course_id, star, strftime('%s', date_submitted) FROM rating WHERE id = ?
                 ''', (feedback_id,))
-                conn.commit()
-                self.write("Feedback deleted successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to delete this feedback.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
-
-from ..sendEmail import send_email
+                student = cursor.fetchone()
+                if student and student[0] == username:
+                    await cursor.execute('''
+                        DELETE FROM rating WHERE id = ?
+                    ''', (feedback_id,))
+                    await conn.run(update_course_stats, student[1], student[2], -1)
+                    await conn.commit()
+                    # Retract the rating at the time it was given, as rebuild_popularity() counts it.
+                    popularity.record(student[1], -WEIGHTS['rating'] * (student[2] - 3),
+                                      at=float(student[3]) if student[3] else None)
+                    self.write("Feedback deleted successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to delete this feedback.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+from ..sendEmail import queue_emails, outbox
 class CourseSendNotificationHandler(BaseHandler):
     """
     Sends email notifications to the students of a course.
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Sends a notification to the students of a course.
 
@@ -394,44 +449,40 @@ class CourseSendNotificationHandler(BaseHandler):
         body = self.get_argument("body")
         priority = self.get_argument("priority", 0)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                # Get the name of the course
-                cursor.execute('''
-                    SELECT title FROM courses WHERE id = ?
-                ''', (course_id,))
-                course_name = cursor.fetchone()[0]
-                subject = f'Notification from {course_name}'
-                # TABLE: course_students: course_id, student (student is the username)
-                # TABLE: users: username, email
-                cursor.execute('''
-                    SELECT student FROM course_students WHERE course_id = ?
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
                 ''', (course_id,))
-                students = cursor.fetchall()
-                for student in students:
-                    cursor.execute('''
-                        SELECT email FROM users WHERE username = ?
-                    ''', (student[0],))
-                    email = cursor.fetchone()
-                    if email:
-                        send_email(email[0], subject, body)
-                        cursor.execute('''
-                            INSERT INTO messages (sender, receiver, subject, body, timestamp, read, type, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (username, student[0], subject, body, time.strftime('%Y-%m-%d %H:%M:%S'), 0, 'course', priority))
-                conn.commit()
-                self.write("Notification sent to the course successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to send notifications to this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
\ No newline at end of file
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    # Get the name of the course
+                    await cursor.execute('''
+                        SELECT title FROM courses WHERE id = ?
+                    ''', (course_id,))
+                    course_name = cursor.fetchone()[0]
+                    subject = f'Notification from {course_name}'
+                    await cursor.execute('''
+                        SELECT u.email FROM course_students cs
+                        JOIN users u ON u.username = cs.student
+                        WHERE cs.course_id = ?
+                    ''', (course_id,))
+                    emails = cursor.fetchall()
+                    # One inbox entry for the whole course (see InboxHandler.get).
+                    await cursor.execute('''
+                        INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp, type, priority) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (course_id, username, subject, body, time.strftime('%Y-%m-%d %H:%M:%S'), 'course', priority))
+                    # Delivered in the background; committed together with the broadcast.
+                    await conn.run(queue_emails, [(email, subject, body) for email, in emails], False)
+                    await conn.commit()
+                    outbox.wake()
+                    inbox_feed.wake()
+                    self.write("Notification sent to the course successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to send notifications to this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
\ No newline at end of file
@@ -3,84 +3,135 @@ import sqlite3
 import re
 import tornado.web
 from components.user.base import BaseHandler
-from database import DATABASE, get_user_role
+from database import get_user_role
+from asyncdb import pool, bulk_pool
+from cache import course_detail_cache
+from leaderboard import popularity, WEIGHTS
+from search import search_courses
 
 class AllCoursesHandler(BaseHandler):
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the courses.
         """
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with bulk_pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    SELECT c.id, c.title, c.description, c.owner, s.rating_avg, s.rating_count
+                    FROM courses c
+                    LEFT JOIN course_stats s ON s.course_id = c.id
+                ''')
+                courses = cursor.fetchall()
+                update_courses = [{'id': course[0], 'title': course[1], 'instructor': course[3], 'description': course[2],
+                                   'rating': course[4] or 0, 'rating_count': course[5] or 0} for course in courses]
+
+                self.write(json.dumps(update_courses))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+class CourseSearchHandler(BaseHandler):
+    MAX_LIMIT = 50
+
+    @tornado.web.authenticated
+    async def get(self):
+        """
+        Searches the catalog: courses whose title, description or category hold
+        all the words of `q`, best match first, or every course without `q`.
+
+        GET /api/course/search?q=algebra&category=Mathematics&type=open&limit=20&offset=0
+
+        Returns {'total', 'facets', 'courses', 'next_offset'}, where facets
+        counts the matches per category and per type.
+        """
+        q = self.get_argument("q", "")
+        category = self.get_argument("category", None) or None
+        course_type = self.get_argument("type", None) or None
+        limit = self.get_argument("limit", "20")
+        offset = self.get_argument("offset", "0")
+        if not limit.isdigit() or not offset.isdigit() or not 0 < int(limit) <= self.MAX_LIMIT:
+            self.set_status(400)
+            self.write(f"Bad Request: limit must be a number between 1 and {self.MAX_LIMIT} and offset a number.")
+            return
+        limit, offset = int(limit), int(offset)
 
         try:
-            cursor.execute('''
-                SELECT id, title, description, owner FROM courses
-            ''')
-            courses = cursor.fetchall()
-            update_courses = []
-
-            cursor.execute('''
-                SELECT course_id
-                FROM rating
-            ''')
-            course_ids = cursor.fetchall()
-
-            for course in courses:
-                star = 2+course[0]*23%31*1.0/10.0
-                for course_id in course_ids:
-                    if course_id == course[0]:
-                        cursor.execute('''
-                            SELECT AVG(star) AS average_star
-                            FROM rating
-                            WHERE course_id = ?
-                        ''', (course_id))
-
-                        star = cursor.fetchall()[0]
-                        print(star)
-
-                update_courses.append({'id': course[0], 'title': course[1], 'instructor': course[3], 'description': course[2], 'rating': star})
-
-            self.write(json.dumps(update_courses))
+            total, facets, courses = await pool.run(search_courses, q, category, course_type, limit, offset)
         except sqlite3.Error as e:
             self.set_status(500)
             self.write(str(e))
-        finally:
-            conn.close()
+            return
+        self.write(json.dumps({'total': total, 'facets': facets, 'courses': courses,
+                               'next_offset': offset + limit if offset + limit < total else None}))
+
+class PopularCoursesHandler(BaseHandler):
+    @tornado.web.authenticated
+    async def get(self):
+        """
+        Returns the most popular courses, most popular first.
+
+        GET /api/courses/popular?k=10
+        """
+        k = self.get_argument("k", "10")
+        if not k.isdigit():
+            self.set_status(400)
+            self.write("Bad Request: k must be a number.")
+            return
+        if not popularity.loaded:
+            await pool.run(popularity.load)
+        top = popularity.top_courses(min(int(k), 100))
+        if not top:
+            self.write(json.dumps([]))
+            return
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute(f'''
+                    SELECT id, title, description, owner FROM courses WHERE id IN ({','.join('?' * len(top))})
+                ''', tuple(course_id for course_id, _ in top))
+                courses = {course[0]: course for course in cursor.fetchall()}
+                self.write(json.dumps([{'id': course_id, 'title': courses[course_id][1], 'description': courses[course_id][2],
+                                        'instructor': courses[course_id][3], 'popularity': score}
+                                       for course_id, score in top if course_id in courses]))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class AddCourseHandler(BaseHandler):
     """
     Handles the requests to add a course.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the requests to add a course.
         """
         username = self.get_current_user()
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if get_user_role(username) == 'admin':
-                cursor.execute('''
-                    SELECT title, description, owner, category FROM add_course_requests
-                ''')
-                requests = cursor.fetchall()
-                self.write(json.dumps(requests))
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to access this page.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                if await conn.run(get_user_role, username) == 'admin':
+                    await cursor.execute('''
+                        SELECT title, description, owner, category FROM add_course_requests
+                    ''')
+                    requests = cursor.fetchall()
+                    self.write(json.dumps(requests))
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to access this page.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         If the request is from the owner, submits a request to add a course.
         If the request is from an admin, approves or denies a request to add a course based on the title and owner.
@@ -92,48 +143,46 @@ class AddCourseHandler(BaseHandler):
         action = self.get_argument("action", None)
         category = self.get_argument("category")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        try:
-            if action:
-                if get_user_role(username) == 'admin':
-                    if action == 'approve':
-                        cursor.execute('''
-                            INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)
-                        ''', (title, description, owner, category))
-                        cursor.execute('''
-                            DELETE FROM add_course_requests WHERE title = ? AND owner = ?
-                        ''', (title, owner))
-                        conn.commit()
-                        self.write("Request approved successfully.")
-                    elif action == 'deny':
-                        cursor.execute('''
-                            DELETE FROM add_course_requests WHERE title = ? AND owner = ?
-                        ''', (title, owner))
-                        conn.commit()
-                        self.write("Request denied successfully.")
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                if action:
+                    if await conn.run(get_user_role, username) == 'admin':
+                        if action == 'approve':
+                            await cursor.execute('''
+                                INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)
+                            ''', (title, description, owner, category))
+                            await cursor.execute('''
+                                DELETE FROM add_course_requests WHERE title = ? AND owner = ?
+                            ''', (title, owner))
+                            await conn.commit()
+                            self.write("Request approved successfully.")
+                        elif action == 'deny':
+                            await cursor.execute('''
+                                DELETE FROM add_course_requests WHERE title = ? AND owner = ?
+                            ''', (title, owner))
+                            await conn.commit()
+                            self.write("Request denied successfully.")
+                        else:
+                            self.set_status(400)
+                            self.write("Invalid action.")
                     else:
-                        self.set_status(400)
-                        self.write("Invalid action.")
-                else:
-                    self.set_status(403)
-                    self.write("Forbidden: You do not have permission to perform this action.")
-            else:
-                if get_user_role(username) == 'teacher':
-                    cursor.execute('''
-                        INSERT INTO add_course_requests (title, description, owner, category) VALUES (?, ?, ?, ?)
-                    ''', (title, description, username, category))
-                    conn.commit()
-                    self.write("Request sent successfully.")
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to perform this action.")
                 else:
-                    self.set_status(403)
-                    self.write("Forbidden: You do not have permission to add a course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    if await conn.run(get_user_role, username) == 'teacher':
+                        await cursor.execute('''
+                            INSERT INTO add_course_requests (title, description, owner, category) VALUES (?, ?, ?, ?)
+                        ''', (title, description, username, category))
+                        await conn.commit()
+                        self.write("Request sent successfully.")
+                    else:
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to add a course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
 class DetailedCourseHandler(BaseHandler):
@@ -156,65 +205,67 @@ class DetailedCourseHandler(BaseHandler):
         2. If the request is sent by a student, chapters that are not published by the teacher will not be shown.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns the detailed information of a specific course.
         """
         username = self.get_current_user()
-        course_id = re.search(r'/(\d+)', self.request.path).group(1)
+        course_id = int(re.search(r'/(\d+)', self.request.path).group(1))
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        student_view = await pool.run(get_user_role, username) == 'student'
+        body = course_detail_cache.get(course_id, student_view)
+        if body is not None:
+            self.write(body)
+            return
+        epoch = course_detail_cache.epoch()
 
-        try:
-            cursor.execute('''
-                SELECT title, description, owner, type FROM courses WHERE id = ?
-            ''', (course_id,))
-            course = cursor.fetchone()
-            if course:
-                cursor.execute('''
-                    SELECT student FROM course_students WHERE course_id = ?
-                ''', (course_id,))
-                students = cursor.fetchall()
-                students = [student[0] for student in students]
-                course = list(course)
-                course.append(students)
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-                cursor.execute('''
-                    SELECT id, title, content, type, published FROM chapters WHERE course_id = ?
+            try:
+                await cursor.execute('''
+                    SELECT title, description, owner, type FROM courses WHERE id = ?
                 ''', (course_id,))
-                chapters = cursor.fetchall()
-                if get_user_role(username) == 'student':
-                    chapters = [chapter for chapter in chapters if chapter[4] == 1]
-
-                new_chapters = []
-                for chapter in chapters:
-                    cursor.execute('''
-                        SELECT filename FROM courseware WHERE chapter_id = ?
-                    ''', (chapter[0],))
-                    courseware = cursor.fetchall()
-                    courseware = [{'name': c[0], 'link': f'/files/courseware/{c[0]}'} for c in courseware]
-                    chapter = list(chapter)
-                    print(chapter)
-                    chapter.append(courseware)
-                    print(chapter)
-                    chapter = {'id': chapter[0], 'title': chapter[1], 'content': chapter[2], 'type': chapter[3], 'published': chapter[4], 'courseware': courseware}
-                    new_chapters.append(chapter)
-
-                course.append(new_chapters)
-                course = {'id': course_id, 'title': course[0], 'description': course[1], 'owner': course[2], 'type': course[3], 'students': course[4], 'chapters': new_chapters}
-                self.write(json.dumps(course))
-            else:
-                self.set_status(404)
-                self.write("Course not found.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                course = cursor.fetchone()
+                if course:
+                    await cursor.execute('''
+                        SELECT student FROM course_students WHERE course_id = ?
+                    ''', (course_id,))
+                    students = [student[0] for student in cursor.fetchall()]
+
+                    # Students only see published chapters.
+                    await cursor.execute('''
+                        SELECT id, title, content, type, published FROM chapters
+                        WHERE course_id = ? AND (published = 1 OR ? = 0)
+                        ORDER BY id
+                    ''', (course_id, student_view))
+                    chapters = cursor.fetchall()
+
+                    # Courseware of every chapter of the course in one query.
+                    await cursor.execute('''
+                        SELECT cw.chapter_id, cw.filename FROM courseware cw
+                        JOIN chapters ch ON ch.id = cw.chapter_id
+                        WHERE ch.course_id = ?
+                    ''', (course_id,))
+                    courseware = {}
+                    for chapter_id, filename in cursor.fetchall():
+                        courseware.setdefault(chapter_id, []).append({'name': filename, 'link': f'/files/courseware/{filename}'})
+
+                    new_chapters = [{'id': chapter[0], 'title': chapter[1], 'content': chapter[2], 'type': chapter[3], 'published': chapter[4],
+                                     'courseware': courseware.get(chapter[0], [])} for chapter in chapters]
+                    course = {'id': str(course_id), 'title': course[0], 'description': course[1], 'owner': course[2], 'type': course[3], 'students': students, 'chapters': new_chapters}
+                    body = json.dumps(course)
+                    course_detail_cache.set(course_id, student_view, body, epoch)
+                    self.write(body)
+                else:
+                    self.set_status(404)
+                    self.write("Course not found.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Adds a chapter to the course.
         """
@@ -224,31 +275,30 @@ class DetailedCourseHandler(BaseHandler):
         content = self.get_argument("content")
         chapter_type = self.get_argument("type")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)
-                ''', (title, content, chapter_type, course_id))
-                conn.commit()
-                self.write("Chapter added successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to add chapters to this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
+                ''', (course_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)
+                    ''', (title, content, chapter_type, course_id))
+                    await conn.commit()
+                    course_detail_cache.invalidate(int(course_id))
+                    self.write("Chapter added successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to add chapters to this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         Deletes a chapter from the course.
         """
@@ -256,31 +306,30 @@ class DetailedCourseHandler(BaseHandler):
         course_id = re.search(r'/(\d+)', self.request.path).group(1)
         chapter_id = self.get_argument("chapter_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    DELETE FROM chapters WHERE id = ?
-                ''', (chapter_id,))
-                conn.commit()
-                self.write("Chapter deleted successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to delete chapters from this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
+                ''', (course_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        DELETE FROM chapters WHERE id = ?
+                    ''', (chapter_id,))
+                    await conn.commit()
+                    course_detail_cache.invalidate(int(course_id))
+                    self.write("Chapter deleted successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to delete chapters from this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def put(self):
+    async def put(self):
         """
         Updates the published status of a chapter in the course.
         """
@@ -289,28 +338,27 @@ class DetailedCourseHandler(BaseHandler):
         chapter_id = self.get_argument("chapter_id")
         published = self.get_argument("published")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    UPDATE chapters SET published = ? WHERE id = ?
-                ''', (published, chapter_id))
-                conn.commit()
-                self.write("Chapter published status updated successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to update the published status of chapters in this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
+                ''', (course_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        UPDATE chapters SET published = ? WHERE id = ?
+                    ''', (published, chapter_id))
+                    await conn.commit()
+                    course_detail_cache.invalidate(int(course_id))
+                    self.write("Chapter published status updated successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to update the published status of chapters in this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 
 class CourseProgressHandler(BaseHandler):
@@ -318,7 +366,7 @@ class CourseProgressHandler(BaseHandler):
     Handles the progress of a course for a student.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Gets the progress of a course for the current user.
 
@@ -328,25 +376,23 @@ class CourseProgressHandler(BaseHandler):
         username = self.get_current_user()
         course_id = self.get_argument("course_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT chapter_id FROM course_progress WHERE username = ? AND chapter_id IN (SELECT id FROM chapters WHERE course_id = ?)
-            ''', (username, course_id))
-            chapters = cursor.fetchall()
-            chapters = {'chapters': chapters}
-            print(chapters)
-            self.write(json.dumps(chapters))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT chapter_id FROM course_progress WHERE username = ? AND chapter_id IN (SELECT id FROM chapters WHERE course_id = ?)
+                ''', (username, course_id))
+                chapters = cursor.fetchall()
+                chapters = {'chapters': chapters}
+                print(chapters)
+                self.write(json.dumps(chapters))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Updates the progress of a course for the current user.
         Essentially, this handler is used to mark a chapter as completed by the student.
@@ -357,20 +403,18 @@ class CourseProgressHandler(BaseHandler):
         username = self.get_current_user()
         chapter_id = self.get_argument("chapter_id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute('''
-                INSERT INTO course_progress (username, chapter_id) VALUES (?, ?)
-            ''', (username, chapter_id))
-            conn.commit()
-            self.write("Chapter marked as completed successfully.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    INSERT INTO course_progress (username, chapter_id) VALUES (?, ?)
+                ''', (username, chapter_id))
+                await conn.commit()
+                self.write("Chapter marked as completed successfully.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
         
 
 class AddCourseStudentHandler(BaseHandler):
@@ -378,7 +422,7 @@ class AddCourseStudentHandler(BaseHandler):
     POST /courses/<course_id>/students
     """
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Adds a student to the course.
         """
@@ -386,31 +430,31 @@ class AddCourseStudentHandler(BaseHandler):
         course_id = re.search(r'/(\d+)', self.request.path).group(1)
         student = self.get_argument("student")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    INSERT INTO course_students (course_id, student) VALUES (?, ?)
-                ''', (course_id, student))
-                conn.commit()
-                self.write("Student added to the course successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to add students to this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
+                ''', (course_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        INSERT INTO course_students (course_id, student) VALUES (?, ?)
+                    ''', (course_id, student))
+                    await conn.commit()
+                    course_detail_cache.invalidate(int(course_id))
+                    popularity.record(course_id, WEIGHTS['enroll'])
+                    self.write("Student added to the course successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to add students to this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         Removes a student from the course.
         """
@@ -418,25 +462,30 @@ class AddCourseStudentHandler(BaseHandler):
         course_id = re.search(r'/(\d+)', self.request.path).group(1)
         student = self.get_argument("student")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT owner FROM courses WHERE id = ?
-            ''', (course_id,))
-            owner = cursor.fetchone()
-            if owner and owner[0] == username:
-                cursor.execute('''
-                    DELETE FROM course_students WHERE course_id = ? AND student = ?
-                ''', (course_id, student))
-                conn.commit()
-                self.write("Student removed from the course successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to remove students from this course.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
\ No newline at end of file
+            try:
+                await cursor.execute('''
+                    SELECT owner FROM courses WHERE id = ?
+                ''', (course_id,))
+                owner = cursor.fetchone()
+                if owner and owner[0] == username:
+                    await cursor.execute('''
+                        SELECT enrolled_at FROM course_students WHERE course_id = ? AND student = ?
+                    ''', (course_id, student))
+                    enrolments = cursor.fetchall()
+                    await cursor.execute('''
+                        DELETE FROM course_students WHERE course_id = ? AND student = ?
+                    ''', (course_id, student))
+                    await conn.commit()
+                    course_detail_cache.invalidate(int(course_id))
+                    for (enrolled_at,) in enrolments:
+                        popularity.record(course_id, -WEIGHTS['enroll'], at=enrolled_at)
+                    self.write("Student removed from the course successfully.")
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to remove students from this course.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
\ No newline at end of file
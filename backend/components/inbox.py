@@ -1,16 +1,149 @@
+import asyncio
+import base64
+import binascii
+import heapq
 import json
 import sqlite3
 import time
+import tornado.ioloop
+import tornado.iostream
 import tornado.web
+import tornado.websocket
 from components.user.base import BaseHandler
-from database import DATABASE
+from asyncdb import pool
+from dbpool import connection
+from pubsub import Hub, QueueOverflow
+
+
+def encode_cursor(message):
+    """
+    Returns an opaque cursor pointing just after `message`, a row returned by InboxHandler.get.
+    """
+    position = [message[7], message[4], message[8]]  # priority, timestamp, id
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (priority, timestamp, id) position of a cursor. Raises ValueError if it is invalid.
+    """
+    try:
+        priority, timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not (isinstance(priority, int) and isinstance(timestamp, str) and isinstance(message_id, int)):
+        raise ValueError("Invalid cursor.")
+    return priority, timestamp, message_id
+
+
+MESSAGE_COLUMNS = 'sender, receiver, subject, body, timestamp, read, type, priority, id'
+
+# A course broadcast as a message of the inbox of the user bound to both
+# placeholders. Its id in the inbox is the negated broadcast id.
+BROADCAST_COLUMNS = '''
+    b.sender, ?, b.subject, b.body, b.timestamp,
+    EXISTS (SELECT 1 FROM course_broadcast_reads r WHERE r.username = ? AND r.broadcast_id = b.id),
+    b.type, b.priority, -b.id
+'''
+
+
+def inbox_order(message):
+    return message[7], message[4], message[8]  # priority, timestamp, id
+
+
+def load_inbox(username, filters, position=None, count=None):
+    """
+    Returns up to `count` messages (all if None) of the inbox of `username` in
+    inbox order, starting after the (priority, timestamp, id) `position`.
+
+    The inbox is the user's own messages merged with the broadcasts of the
+    courses they are enrolled in. Each source is read in inbox order from its
+    index. `filters` maps the columns type, sender, priority and read to the
+    values wanted.
+    """
+    message_conditions, message_params = [], []
+    broadcast_conditions, broadcast_params = [], []
+    if position:
+        message_conditions.append('(priority, timestamp, id) < (?, ?, ?)')
+        message_params.extend(position)
+        broadcast_conditions.append('(b.priority, b.timestamp, -b.id) < (?, ?, ?)')
+        broadcast_params.extend(position)
+    for column in ('type', 'sender', 'priority'):
+        if filters.get(column) is not None:
+            message_conditions.append(f'{column} = ?')
+            message_params.append(filters[column])
+            broadcast_conditions.append(f'b.{column} = ?')
+            broadcast_params.append(filters[column])
+    if filters.get('read') is not None:
+        message_conditions.append('read = ?')
+        message_params.append(filters['read'])
+        broadcast_conditions.append('EXISTS (SELECT 1 FROM course_broadcast_reads r WHERE r.username = ? AND r.broadcast_id = b.id) = ?')
+        broadcast_params.extend([username, filters['read']])
+    limit = -1 if count is None else count
+
+    with connection() as conn:
+        sources = [conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS} FROM messages
+            WHERE receiver = ? {''.join(' AND ' + condition for condition in message_conditions)}
+            ORDER BY priority DESC, timestamp DESC, id DESC LIMIT ?
+        ''', [username, *message_params, limit]).fetchall()]
+        courses = conn.execute('SELECT course_id FROM course_students WHERE student = ?', (username,)).fetchall()
+        for course_id, in courses:
+            sources.append(conn.execute(f'''
+                SELECT {BROADCAST_COLUMNS} FROM course_broadcasts b
+                WHERE b.course_id = ? {''.join(' AND ' + condition for condition in broadcast_conditions)}
+                ORDER BY b.priority DESC, b.timestamp DESC, b.id LIMIT ?
+            ''', [username, username, course_id, *broadcast_params, limit]).fetchall())
+    return list(heapq.merge(*sources, key=inbox_order, reverse=True))[:count]
+
+
+def load_message(username, message_id):
+    """
+    Returns a message of the inbox of `username`, or None.
+    """
+    with connection() as conn:
+        if message_id > 0:
+            return conn.execute(f'''
+                SELECT {MESSAGE_COLUMNS} FROM messages WHERE id = ? AND receiver = ?
+            ''', (message_id, username)).fetchone()
+        return conn.execute(f'''
+            SELECT {BROADCAST_COLUMNS} FROM course_broadcasts b
+            JOIN course_students cs ON cs.course_id = b.course_id AND cs.student = ?
+            WHERE b.id = ?
+        ''', (username, username, username, -message_id)).fetchone()
+
+
+def mark_read(username, message_id):
+    """
+    Marks a message of the inbox of `username` as read. Returns False if there is no such message.
+    """
+    with connection() as conn:
+        if message_id > 0:
+            # A trigger on `messages` keeps inbox_unread in step.
+            found = conn.execute('''
+                UPDATE messages SET read = 1 WHERE id = ? AND receiver = ?
+            ''', (message_id, username)).rowcount > 0
+        else:
+            found = conn.execute('''
+                SELECT 1 FROM course_broadcasts b
+                JOIN course_students cs ON cs.course_id = b.course_id AND cs.student = ?
+                WHERE b.id = ?
+            ''', (username, -message_id)).fetchone() is not None
+            if found:
+                # A trigger on `course_broadcast_reads` keeps course_broadcast_read_counts in step.
+                conn.execute('''
+                    INSERT OR IGNORE INTO course_broadcast_reads (username, broadcast_id) VALUES (?, ?)
+                ''', (username, -message_id))
+        conn.commit()
+    return found
+
 
 class InboxHandler(BaseHandler):
     """
     Handles the inbox of students, teachers, and admins.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         With no parameters, returns all the messages of the inbox of the user. Sorted based on factors `priority` and `timestamp`.
 
@@ -24,9 +157,16 @@ class InboxHandler(BaseHandler):
 
         With the parameter `read`, returns all the messages of the inbox of the user with the given read status.
 
-        With the parameter `limit`, returns the first `limit` messages of the inbox of the user.
+        With the parameter `limit`, returns the first `limit` messages of the inbox of the user. When the page
+        is full, the `X-Next-Cursor` response header holds the cursor of the next page.
+
+        With the parameter `cursor`, returns the messages that follow the page the cursor came from.
 
         With the parameter `offset`, returns the messages of the inbox of the user starting from the `offset` index.
+        Deep offsets are slow, prefer `cursor`.
+
+        Messages are [sender, receiver, subject, body, timestamp, read, type, priority, id]. The inbox includes
+        the broadcasts of the user's courses, with negative ids.
         """
         username = self.get_current_user()
         message_id = self.get_argument("id", None)
@@ -36,6 +176,7 @@ class InboxHandler(BaseHandler):
         read = self.get_argument("read", None)
         limit = self.get_argument("limit", None)
         offset = self.get_argument("offset", None)
+        position = self.get_argument("cursor", None)
 
         try:
             limit = int(limit) if limit else None
@@ -44,77 +185,50 @@ class InboxHandler(BaseHandler):
             self.set_status(400)
             self.write("Invalid limit or offset value.")
             return
+        try:
+            position = decode_cursor(position) if position else None
+        except ValueError as e:
+            self.set_status(400)
+            self.write(str(e))
+            return
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        filters = {"type": message_type, "sender": sender}
+        try:
+            filters["priority"] = int(priority) if priority else None
+        except ValueError:
+            self.set_status(400)
+            self.write("Invalid priority value.")
+            return
+        try:
+            filters["read"] = int(read) if read else None
+        except ValueError:
+            self.set_status(400)
+            self.write("Invalid read value.")
+            return
 
         try:
             if message_id:
-                cursor.execute('''
-                    SELECT sender, receiver, subject, body, timestamp, read, type, priority
-                    FROM messages
-                    WHERE id = ? AND receiver = ?
-                ''', (message_id, username))
-                result = cursor.fetchone()
+                try:
+                    result = await pool.run(load_message, username, int(message_id))
+                except ValueError:
+                    result = None
                 if result:
                     self.write(json.dumps(result))
                 else:
                     self.set_status(404)
                     self.write("Message not found.")
             else:
-                query = '''
-                    SELECT sender, receiver, subject, body, timestamp, read, type, priority
-                    FROM messages
-                    WHERE receiver = ?
-                '''
-                params = [username]
-
-                if message_type:
-                    query += ' AND type = ?'
-                    params.append(message_type)
-                if sender:
-                    query += ' AND sender = ?'
-                    params.append(sender)
-                if priority:
-                    try:
-                        priority = int(priority)
-                        query += ' AND priority = ?'
-                        params.append(priority)
-                    except ValueError:
-                        self.set_status(400)
-                        self.write("Invalid priority value.")
-                        return
-                if read:
-                    try:
-                        read = int(read)
-                        query += ' AND read = ?'
-                        params.append(read)
-                    except ValueError:
-                        self.set_status(400)
-                        self.write("Invalid read value.")
-                        return
-
-                query += ' ORDER BY priority DESC, timestamp DESC'
-
-                if limit:
-                    query += ' LIMIT ?'
-                    params.append(limit)
-                if offset:
-                    query += ' OFFSET ?'
-                    params.append(offset)
-
-                cursor.execute(query, params)
-                result = cursor.fetchall()
+                count = (offset or 0) + limit if limit else None
+                result = (await pool.run(load_inbox, username, filters, position, count))[offset:]
+                if limit and len(result) == limit:
+                    self.set_header("X-Next-Cursor", encode_cursor(result[-1]))
                 self.write(json.dumps(result))
-
         except sqlite3.Error as e:
             self.set_status(500)
             self.write(f"Database error: {str(e)}")
-        finally:
-            conn.close()
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Sends a message to the user's inbox.
 
@@ -140,39 +254,331 @@ class InboxHandler(BaseHandler):
         message_type = self.get_argument("type", 'message')
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    INSERT INTO messages (sender, receiver, subject, body, timestamp, priority, type) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (sender, receiver, subject, body, timestamp, priority, message_type))
+                await conn.commit()
+                inbox_feed.wake()
+                self.write("Message sent successfully.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+    @tornado.web.authenticated
+    async def put(self):
+        """
+        Marks a message in the user's inbox as read.
+        """
+        username = self.get_current_user()
+        try:
+            message_id = int(self.get_argument("id"))
+        except ValueError:
+            message_id = 0
 
         try:
-            cursor.execute('''
-                INSERT INTO messages (sender, receiver, subject, body, timestamp, priority, type) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (sender, receiver, subject, body, timestamp, priority, message_type))
-            conn.commit()
-            self.write("Message sent successfully.")
+            if message_id and await pool.run(mark_read, username, message_id):
+                self.write("Message read status updated successfully.")
+            else:
+                self.set_status(404)
+                self.write("Message not found.")
         except sqlite3.Error as e:
             self.set_status(500)
             self.write(str(e))
-        finally:
-            conn.close()
 
+
+class UnreadCountHandler(BaseHandler):
+    """
+    Handles the unread message count of the inbox.
+    """
     @tornado.web.authenticated
-    def put(self):
+    async def get(self):
+        """
+        Returns the number of unread messages in the user's inbox, e.g. {"unread": 3}.
+
+        Reads the counter kept in `inbox_unread` instead of counting messages, as every open page polls this.
+        Unread course broadcasts come from the per-course counters, one lookup per enrolled course.
+        """
+        username = self.get_current_user()
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                await cursor.execute('''
+                    SELECT unread FROM inbox_unread WHERE username = ?
+                ''', (username,))
+                row = cursor.fetchone()
+                await cursor.execute('''
+                    SELECT COALESCE(SUM(t.total - COALESCE(r.reads, 0)), 0) FROM course_students cs
+                    JOIN course_broadcast_counts t ON t.course_id = cs.course_id
+                    LEFT JOIN course_broadcast_read_counts r ON r.username = cs.student AND r.course_id = cs.course_id
+                    WHERE cs.student = ?
+                ''', (username,))
+                broadcasts = cursor.fetchone()[0]
+                self.write(json.dumps({"unread": (row[0] if row else 0) + broadcasts}))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+
+def last_ids():
+    """
+    Returns the newest message id and the newest course broadcast id.
+    """
+    with connection() as conn:
+        return [conn.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0,
+                conn.execute('SELECT MAX(id) FROM course_broadcasts').fetchone()[0] or 0]
+
+
+def messages_after(after_id, limit, receiver=None):
+    """
+    Returns up to `limit` messages with an id above `after_id`, oldest first, for
+    everyone or only for `receiver`.
+    """
+    with connection() as conn:
+        if receiver is None:
+            return conn.execute(f'''
+                SELECT {MESSAGE_COLUMNS} FROM messages WHERE id > ? ORDER BY id LIMIT ?
+            ''', (after_id, limit)).fetchall()
+        return conn.execute(f'''
+            SELECT {MESSAGE_COLUMNS} FROM messages WHERE receiver = ? AND id > ? ORDER BY id LIMIT ?
+        ''', (receiver, after_id, limit)).fetchall()
+
+
+def broadcasts_after(after_id, limit, receiver=None):
+    """
+    Returns up to `limit` course broadcasts with an id above `after_id`, oldest first.
+
+    For `receiver`, returns those of their courses as inbox messages. Otherwise
+    returns (broadcast, students) pairs, where broadcast is an inbox message
+    without a receiver and students are the receivers.
+    """
+    with connection() as conn:
+        if receiver is not None:
+            return conn.execute(f'''
+                SELECT {BROADCAST_COLUMNS} FROM course_students cs
+                JOIN course_broadcasts b ON b.course_id = cs.course_id
+                WHERE cs.student = ? AND b.id > ? ORDER BY b.id LIMIT ?
+            ''', (receiver, receiver, receiver, after_id, limit)).fetchall()
+        broadcasts = conn.execute(f'''
+            SELECT course_id, {BROADCAST_COLUMNS} FROM course_broadcasts b WHERE id > ? ORDER BY id LIMIT ?
+        ''', (None, None, after_id, limit)).fetchall()
+        return [(broadcast[1:], [student for student, in conn.execute(
+                    'SELECT student FROM course_students WHERE course_id = ?', (broadcast[0],))])
+                for broadcast in broadcasts]
+
+
+class InboxFeed:
+    """
+    Publishes new messages and course broadcasts to `hub`, keyed by receiver.
+
+    While anyone is subscribed, the feed reads what was added since its last
+    poll every `poll_interval` seconds, so it also delivers messages inserted by
+    other server processes. Handlers that insert messages call wake() after
+    committing, which delivers them to this process's connections at once.
+    """
+    def __init__(self, hub, poll_interval=1.0, batch_size=1000):
+        self.hub = hub
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._last_ids = None  # [message id, broadcast id]
+        self._polling = False
+        self._again = False
+
+    def start(self):
+        tornado.ioloop.PeriodicCallback(self.poll, self.poll_interval * 1000).start()
+
+    def wake(self):
+        if self.hub.has_subscribers():
+            tornado.ioloop.IOLoop.current().add_callback(self.poll)
+
+    async def prime(self):
+        """
+        Makes sure the feed knows where it starts, so everything added from now
+        on gets published. Call it after subscribing, before catching up.
+        """
+        if self._last_ids is None:
+            self._last_ids = await pool.run(last_ids)
+
+    async def poll(self):
+        if self._polling:
+            self._again = True
+            return
+        self._polling = True
+        try:
+            while True:
+                self._again = False
+                if self._last_ids is None or not self.hub.has_subscribers():
+                    # Nobody to deliver to: only keep up with the newest ids.
+                    self._last_ids = await pool.run(last_ids)
+                    return
+                messages = await pool.run(messages_after, self._last_ids[0], self.batch_size)
+                for message in messages:
+                    self.hub.publish(message[1], message)
+                if messages:
+                    self._last_ids[0] = messages[-1][8]
+                broadcasts = await pool.run(broadcasts_after, self._last_ids[1], self.batch_size)
+                for broadcast, students in broadcasts:
+                    for student in students:
+                        if self.hub.has_subscribers(student):
+                            self.hub.publish(student, (broadcast[0], student, *broadcast[2:]))
+                if broadcasts:
+                    self._last_ids[1] = -broadcasts[-1][0][8]
+                if max(len(messages), len(broadcasts)) < self.batch_size and not self._again:
+                    return
+        finally:
+            self._polling = False
+
+
+class InboxPush:
+    """
+    The part of the push handlers shared by WebSocket and event-stream connections.
+
+    A client passes the ids of the newest message and course broadcast it has,
+    as `<message id>:<broadcast id>` (`after` or the Last-Event-ID header), and
+    first receives what it missed, then new messages as they arrive. Each is
+    sent as the JSON of a message row of InboxHandler.get, where a broadcast has
+    the negated broadcast id. With only a message id, broadcasts sent before
+    connecting are not caught up. A client that falls `inbox_hub.max_queue`
+    messages behind is disconnected and should reconnect the same way.
+    """
+    catch_up_limit = 100
+
+    async def catch_up(self, after):
+        self.last_message, self.last_broadcast = after
+        await inbox_feed.prime()
+        while True:
+            messages = await pool.run(messages_after, self.last_message, self.catch_up_limit, self.current_user)
+            for message in messages:
+                await self.send(message)
+            if len(messages) < self.catch_up_limit:
+                break
+        while self.last_broadcast is not None:
+            broadcasts = await pool.run(broadcasts_after, self.last_broadcast, self.catch_up_limit, self.current_user)
+            for broadcast in broadcasts:
+                await self.send(broadcast)
+            if len(broadcasts) < self.catch_up_limit:
+                break
+
+    async def deliver(self):
         """
-        Updates the read status of a message in the user's inbox.
+        Sends queued messages until the connection closes. Raises QueueOverflow.
         """
-        message_id = self.get_argument("id")
+        while not self.subscription.closed:
+            messages = await self.subscription.get(self.keepalive_interval)
+            for message in messages:
+                if self.is_new(message):  # not already sent by catch_up()
+                    await self.send(message)
+            if not messages:
+                await self.keepalive()
+
+    def is_new(self, message):
+        if message[8] > 0:
+            return message[8] > self.last_message
+        return self.last_broadcast is None or -message[8] > self.last_broadcast
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+    async def send(self, message):
+        if message[8] > 0:
+            self.last_message = message[8]
+        else:
+            self.last_broadcast = -message[8]
+        await self.send_message(message)
 
+    def position(self):
+        if self.last_broadcast is None:
+            return str(self.last_message)
+        return f"{self.last_message}:{self.last_broadcast}"
+
+    def after(self):
+        after = self.request.headers.get('Last-Event-ID') or self.get_argument('after', '0')
         try:
-            cursor.execute('''
-                UPDATE messages SET read = 1 WHERE id = ?
-            ''', (message_id,))
-            conn.commit()
-            self.write("Message read status updated successfully.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
+            message_id, _, broadcast_id = after.partition(':')
+            return int(message_id), int(broadcast_id) if broadcast_id else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Bad Request: after must be <message id>[:<broadcast id>].')
+
+
+class InboxSocketHandler(InboxPush, BaseHandler, tornado.websocket.WebSocketHandler):
+    """
+    Pushes new messages of the user's inbox over a WebSocket.
+    """
+    keepalive_interval = None  # the websocket_ping_interval setting keeps it alive
+
+    @tornado.web.authenticated
+    async def get(self, *args, **kwargs):
+        self.subscription = None
+        self.start_after = self.after()
+        await super().get(*args, **kwargs)
+
+    def check_origin(self, origin):
+        # The development frontend is served from its own origin (see set_default_headers).
+        return origin == "http://localhost:5173" or super().check_origin(origin)
+
+    def open(self):
+        self.subscription = inbox_hub.subscribe(self.current_user)
+        self._task = asyncio.ensure_future(self._push())
+
+    async def _push(self):
+        try:
+            await self.catch_up(self.start_after)
+            await self.deliver()
+        except QueueOverflow:
+            self.close(4000, "Too many undelivered messages; reconnect.")
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+    async def send_message(self, message):
+        await self.write_message(json.dumps(message))
+
+    async def keepalive(self):
+        pass
+
+    def on_close(self):
+        if self.subscription is not None:
+            self.subscription.close()
+
+
+class InboxEventsHandler(InboxPush, BaseHandler):
+    """
+    Pushes new messages of the user's inbox as server-sent events, for clients
+    that cannot open a WebSocket.
+    """
+    keepalive_interval = 30
+
+    @tornado.web.authenticated
+    async def get(self):
+        after = self.after()
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.subscription = inbox_hub.subscribe(self.current_user)
+        try:
+            await self.catch_up(after)
+            await self.keepalive()
+            await self.deliver()
+        except QueueOverflow:
+            pass  # EventSource reconnects, sending Last-Event-ID
+        except tornado.iostream.StreamClosedError:
+            pass
         finally:
-            conn.close()
\ No newline at end of file
+            self.subscription.close()
+
+    async def send_message(self, message):
+        self.write(f"id: {self.position()}\ndata: {json.dumps(message)}\n\n")
+        await self.flush()
+
+    async def keepalive(self):
+        self.write(": keepalive\n\n")
+        await self.flush()
+
+    def on_connection_close(self):
+        if hasattr(self, 'subscription'):
+            self.subscription.close()
+
+
+# New messages for the connections of this process, keyed by receiver.
+inbox_hub = Hub(max_queue=100)
+inbox_feed = InboxFeed(inbox_hub)
@@ -1,6 +1,12 @@
+import base64
+import binascii
+import json
 import tornado.web
 import sqlite3
-from database import DATABASE, add_post, get_post_comments, add_post_comment, get_post_by_tag
+from database import add_post, get_post_comments, add_post_comment, get_post_by_tag, get_posts_version, get_post_feed
+from asyncdb import pool
+from cache import post_feed_cache
+from search import search_posts, MAX_RESULTS
 
 class PostHandler(tornado.web.RequestHandler):
     """
@@ -17,56 +23,54 @@ class PostHandler(tornado.web.RequestHandler):
     """
 
     # @tornado.web.authenticated
-    def get(self):
-        """Retrieve all posts along with their comments."""
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+    async def get(self):
+        """Retrieve all posts along with their comments. /api/posts/feed returns them a page at a time."""
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
-            ''')
-            posts = cursor.fetchall()
-
-            post_list = []
-            for post in posts:
-                post_list.append({
-                    'id': post[0],
-                    'course_id': post[1],
-                    'title': post[2],
-                    'sender_name': post[3],
-                    'content': post[4],
-                    'likes': post[5],
-                    'tag': post[6],
-                    'date_submitted': post[7]
-                })
-            # for post in posts:
-            #     post_id = post[0]
-            #     # Fetch comments for the post
-            #     cursor.execute('''
-            #         SELECT commenter_name, comment_content FROM comments
-            #         WHERE post_id = ?
-            #     ''', (post_id,))
-            #     comments = cursor.fetchall()
-
-            #     post_list.append({
-            #         'id': post_id,
-            #         'sender_name': post[1],
-            #         'content': post[2],
-            #         'likes': post[3],
-            #         'tag': post[4],
-            #         'comments': [{'commenter_name': c[0], 'comment_content': c[1]} for c in comments]
-            #     })
-
-            self.write({'posts': post_list})
-        except sqlite3.Error:
-            self.set_status(500)
-            self.write({'error': 'Database error'})
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+                ''')
+                posts = cursor.fetchall()
+
+                post_list = []
+                for post in posts:
+                    post_list.append({
+                        'id': post[0],
+                        'course_id': post[1],
+                        'title': post[2],
+                        'sender_name': post[3],
+                        'content': post[4],
+                        'likes': post[5],
+                        'tag': post[6],
+                        'date_submitted': post[7]
+                    })
+                # for post in posts:
+                #     post_id = post[0]
+                #     # Fetch comments for the post
+                #     await cursor.execute('''
+                #         SELECT commenter_name, comment_content FROM comments
+                #         WHERE post_id = ?
+                #     ''', (post_id,))
+                #     comments = cursor.fetchall()
+
+                #     post_list.append({
+                #         'id': post_id,
+                #         'sender_name': post[1],
+                #         'content': post[2],
+                #         'likes': post[3],
+                #         'tag': post[4],
+                #         'comments': [{'commenter_name': c[0], 'comment_content': c[1]} for c in comments]
+                #     })
+
+                self.write({'posts': post_list})
+            except sqlite3.Error:
+                self.set_status(500)
+                self.write({'error': 'Database error'})
 
     # @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """Create a new post."""
         data = tornado.escape.json_decode(self.request.body)
         print(data)
@@ -77,13 +81,141 @@ class PostHandler(tornado.web.RequestHandler):
         likes = 0
         tag = data.get('tag', '')
 
-        if add_post(course_id, title, sender_name, content, likes, tag):
+        if await pool.run(add_post, course_id, title, sender_name, content, likes, tag):
             self.set_status(201)
             self.write({'message': 'Post created successfully'})
         else:
             self.set_status(500)
             self.write({'error': 'Database error'})
 
+def encode_feed_cursor(post):
+    return base64.urlsafe_b64encode(json.dumps([post['date_submitted'], post['id']]).encode()).decode()
+
+
+def decode_feed_cursor(cursor):
+    """
+    Returns the (date_submitted, id) position of a feed cursor. Raises ValueError if it is invalid.
+    """
+    try:
+        date_submitted, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError("Bad Request: invalid cursor.") from e
+    if not (isinstance(date_submitted, str) and isinstance(post_id, int)):
+        raise ValueError("Bad Request: invalid cursor.")
+    return date_submitted, post_id
+
+
+class PostFeedHandler(tornado.web.RequestHandler):
+    """
+    Handler for the paginated post feed.
+    """
+    MAX_LIMIT = 100
+    # Page sizes served from post_feed_cache; other sizes always read the database.
+    CACHED_LIMITS = (10, 20, 50, 100)
+
+    async def get(self):
+        """
+        Returns a page of posts, newest first: {'posts': [...], 'next_cursor': ...}.
+
+        Optional arguments:
+        - course_id: only posts of this course.
+        - tag: only posts with this tag.
+        - limit: the page size, 20 by default and at most 100.
+        - cursor: the `next_cursor` of the previous page.
+
+        Responses carry a weak ETag that changes with any post, so refreshing an
+        unchanged page is answered with 304 Not Modified.
+        """
+        course_id = self.get_argument("course_id", None)
+        tag = self.get_argument("tag", None) or None
+        limit = self.get_argument("limit", "20")
+        cursor = self.get_argument("cursor", None)
+        try:
+            course_id = int(course_id) if course_id else None
+            limit = int(limit)
+        except ValueError:
+            self.set_status(400)
+            self.write({'error': 'Bad Request: course_id and limit must be numbers.'})
+            return
+        if not 0 < limit <= self.MAX_LIMIT:
+            self.set_status(400)
+            self.write({'error': f'Bad Request: limit must be between 1 and {self.MAX_LIMIT}.'})
+            return
+        try:
+            after = decode_feed_cursor(cursor) if cursor else None
+        except ValueError as e:
+            self.set_status(400)
+            self.write({'error': str(e)})
+            return
+
+        try:
+            # Read before the page: a page cached under an older version is never served again.
+            version = await pool.run(get_posts_version)
+            self.set_header("Etag", f'W/"posts-{version}"')
+            self.set_header("Cache-Control", "no-cache")
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+
+            group, key = (version, course_id, tag), (after, limit)
+            cached = limit in self.CACHED_LIMITS
+            body = post_feed_cache.get(group, key) if cached else None
+            if body is None:
+                posts = await pool.run(get_post_feed, course_id, tag, after, limit)
+                next_cursor = encode_feed_cursor(posts[-1]) if len(posts) == limit else None
+                body = json.dumps({'posts': posts, 'next_cursor': next_cursor})
+                if cached:
+                    post_feed_cache.set(group, key, body)
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.write(body)
+        except sqlite3.Error:
+            self.set_status(500)
+            self.write({'error': 'Database error'})
+
+class PostSearchHandler(tornado.web.RequestHandler):
+    """
+    Handler for full-text search over posts and replies.
+    """
+    MAX_LIMIT = 50
+
+    async def get(self):
+        """
+        Returns the posts and replies matching `q`, best first:
+        {'results': [...], 'next_offset': ...}.
+
+        Words must all appear (in any form: "grading" finds "graded"); a word
+        ending in * matches as a prefix. Each result has the post's id and title
+        and a snippet of HTML with the matches in <mark>; replies also have
+        their comment_id and floor.
+
+        Optional arguments:
+        - limit: the page size, 20 by default and at most 50.
+        - offset: the `next_offset` of the previous page. Only the first 1000
+          results can be paged through.
+        """
+        q = self.get_argument("q", "")
+        try:
+            limit = int(self.get_argument("limit", "20"))
+            offset = int(self.get_argument("offset", "0"))
+        except ValueError:
+            self.set_status(400)
+            self.write({'error': 'Bad Request: limit and offset must be numbers.'})
+            return
+        if not 0 < limit <= self.MAX_LIMIT or not 0 <= offset < MAX_RESULTS:
+            self.set_status(400)
+            self.write({'error': f'Bad Request: limit must be between 1 and {self.MAX_LIMIT} '
+                                 f'and offset between 0 and {MAX_RESULTS - 1}.'})
+            return
+
+        try:
+            results = await pool.run(search_posts, q, limit, offset)
+        except sqlite3.Error:
+            self.set_status(500)
+            self.write({'error': 'Database error'})
+            return
+        next_offset = offset + limit if len(results) == limit and offset + limit < MAX_RESULTS else None
+        self.write({'results': results, 'next_offset': next_offset})
+
 class CoursePostHandler(tornado.web.RequestHandler):
     """
     Handler for creating and retrieving posts.
@@ -99,36 +231,34 @@ class CoursePostHandler(tornado.web.RequestHandler):
     """
 
     # @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """Retrieve all posts along with their comments."""
         id = self.get_argument("course_id")
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            cursor.execute('''
-                SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts Where course_id = ?
-            ''',(id,))
-            posts = cursor.fetchall()
-
-            post_list = []
-            for post in posts:
-                post_list.append({
-                    'id': post[0],
-                    'course_id': post[1],
-                    'title': post[2],
-                    'sender_name': post[3],
-                    'content': post[4],
-                    'likes': post[5],
-                    'tag': post[6],
-                    'date_submitted': post[7]
-                })
-            self.write({'posts': post_list})
-        except sqlite3.Error:
-            self.set_status(500)
-            self.write({'error': 'Database error'})
-        finally:
-            conn.close()
+            try:
+                await cursor.execute('''
+                    SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts Where course_id = ?
+                ''',(id,))
+                posts = cursor.fetchall()
+
+                post_list = []
+                for post in posts:
+                    post_list.append({
+                        'id': post[0],
+                        'course_id': post[1],
+                        'title': post[2],
+                        'sender_name': post[3],
+                        'content': post[4],
+                        'likes': post[5],
+                        'tag': post[6],
+                        'date_submitted': post[7]
+                    })
+                self.write({'posts': post_list})
+            except sqlite3.Error:
+                self.set_status(500)
+                self.write({'error': 'Database error'})
 
 class CommentHandler(tornado.web.RequestHandler):
     """
@@ -146,18 +276,18 @@ class CommentHandler(tornado.web.RequestHandler):
         )
     """
 
-    def get(self, post_id):
+    async def get(self, post_id):
         """Retrieve all comments for a specific post."""
 
         try:
-            comments = get_post_comments(post_id)
+            comments = await pool.run(get_post_comments, post_id)
             self.write({'comments': comments})
         except sqlite3.Error:
             self.set_status(500)
             self.write({'error': 'Database error'})
 
     # @tornado.web.authenticated
-    def post(self, post_id):
+    async def post(self, post_id):
         """Add a comment to a specific post."""
 
         data = tornado.escape.json_decode(self.request.body)
@@ -169,33 +299,33 @@ class CommentHandler(tornado.web.RequestHandler):
         else:
             likes = 0
 
-        if add_post_comment(post_id, floor, commenter_name, comment_content, likes):
+        if await pool.run(add_post_comment, post_id, floor, commenter_name, comment_content, likes):
             self.set_status(201)
             self.write({'message': 'Comment added successfully'})
         else:
             self.set_status(500)
             self.write({'error': 'Database error'})
 
-    def put(self, post_id):
+    async def put(self, post_id):
         """Update a comment."""
 
         data = tornado.escape.json_decode(self.request.body)
         floor = data.get('floor')
         likes = data.get('likes')
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE post_comments
-                SET likes = ?
-                WHERE post_id = ? AND floor = ?
-            ''', (floor, likes, post_id, floor))
-            conn.commit()
-            self.write({'message': 'Comment updated successfully'})
-        except sqlite3.Error:
-            self.set_status(500)
-            self.write({'error': 'Database error'})
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                await cursor.execute('''
+                    UPDATE post_comments
+                    SET likes = ?
+                    WHERE post_id = ? AND floor = ?
+                ''', (floor, likes, post_id, floor))
+                await conn.commit()
+                self.write({'message': 'Comment updated successfully'})
+            except sqlite3.Error:
+                self.set_status(500)
+                self.write({'error': 'Database error'})
 
 
 class PostTagHandler(tornado.web.RequestHandler):
@@ -203,10 +333,10 @@ class PostTagHandler(tornado.web.RequestHandler):
     Handler for retrieving posts by tag.
     """
 
-    def get(self, tag):
+    async def get(self, tag):
         """Retrieve all posts with a specific tag."""
         try:
-            posts = get_post_by_tag(tag)
+            posts = await pool.run(get_post_by_tag, tag)
             print(posts)
             self.write({'posts': posts})
         except sqlite3.Error:
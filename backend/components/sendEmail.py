@@ -1,25 +1,230 @@
+import logging
 import toml
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from dbpool import connection
 
 config = None
 with open('config.toml') as f:
     config = toml.load(f)
 
-def send_email(receiver, subject, body):
-    sender = config['email']['sender']
-    password = config['email']['password']
-    host = config['email']['host']
-    port = config['email']['port']
+logger = logging.getLogger(__name__)
 
+
+def queue_email(receiver, subject, body, commit=True):
+    queue_emails([(receiver, subject, body)], commit)
+
+
+def queue_emails(emails, commit=True):
+    """
+    Adds (receiver, subject, body) tuples to the email outbox. They are delivered
+    in the background by `outbox`; handlers never wait for the SMTP server.
+
+    Pass commit=False to make the emails part of the caller's transaction; call
+    outbox.wake() after committing it.
+    """
+    with connection() as conn:
+        conn.executemany('''
+            INSERT INTO email_outbox (receiver, subject, body, created_at, next_attempt_at) VALUES (?, ?, ?, ?, 0)
+        ''', [(receiver, subject, body, time.time()) for receiver, subject, body in emails])
+        if commit:
+            conn.commit()
+    if commit:
+        outbox.wake()
+
+
+def build_message(sender, receiver, subject, body):
     message = MIMEMultipart('alternative')
     message['From'] = sender
     message['To'] = receiver
     message['Subject'] = subject
     message.attach(MIMEText(body, 'plain'))
+    return message.as_string()
+
+
+class OutboxSender:
+    """
+    Delivers the email outbox from a background thread.
+
+    Pending emails are claimed in batches, so several server processes can run a
+    sender each without sending an email twice. A claim is a lease of `lease`
+    seconds: a sender stops sending a batch whose lease ran out, and records
+    results only for emails it still holds. A batch is sent over one
+    authenticated SMTP connection, which is kept open while there is work and
+    closed after `idle_timeout` seconds without any.
+
+    A temporary failure (connection problems, 4xx replies) is retried after
+    `backoff * 2 ** (attempts - 1)` seconds, up to `max_attempts` times; a
+    permanent rejection (5xx) fails the email at once. The status of each email
+    ('pending', 'sending', 'sent', 'failed') and its last error are kept in the
+    email_outbox table.
+    """
+    def __init__(self, settings, batch_size=50, poll_interval=5.0, idle_timeout=60.0,
+                 max_attempts=5, backoff=30.0, lease=300.0):
+        self.settings = settings
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self._smtp = None
+        self._last_used = 0.0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        self._close()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                sent = self.run_once()
+            except Exception:
+                logger.exception('Email outbox failed')
+                sent = 0
+            if sent < self.batch_size:
+                if self._smtp and time.monotonic() - self._last_used > self.idle_timeout:
+                    self._close()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self):
+        """
+        Claims and delivers one batch. Returns the number of emails claimed.
+        """
+        batch, lease = self._claim()
+        if batch:
+            self._deliver(batch, lease)
+        return len(batch)
+
+    def _claim(self):
+        """
+        Returns the claimed rows and the time their lease runs out.
+        """
+        now = time.time()
+        lease = now + self.lease
+        with connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # 'sending' rows whose lease ran out belong to a sender that died. Rows
+            # come in index order, i.e. longest due first within each status.
+            batch = conn.execute('''
+                SELECT id, receiver, subject, body, attempts FROM email_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? LIMIT ?
+            ''', (now, self.batch_size)).fetchall()
+            conn.executemany('''
+                UPDATE email_outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?
+            ''', [(lease, row[0]) for row in batch])
+            conn.commit()
+        return batch, lease
+
+    def _deliver(self, batch, lease):
+        results = []
+        self._check_connection()
+        for i, (email_id, receiver, subject, body, attempts) in enumerate(batch):
+            if time.time() >= lease:
+                # The rest may be claimed by another sender by now.
+                break
+            try:
+                smtp = self._connection()
+            except (smtplib.SMTPException, OSError) as e:
+                # Nothing else in the batch can be sent without a connection.
+                results.extend((row[0], row[4], repr(e), False) for row in batch[i:])
+                break
+            try:
+                smtp.sendmail(self.settings['sender'], receiver,
+                              build_message(self.settings['sender'], receiver, subject, body))
+                results.append((email_id, attempts, None, False))
+            except smtplib.SMTPRecipientsRefused as e:
+                code = min(code for code, _ in e.recipients.values())
+                results.append((email_id, attempts, str(e.recipients), code >= 500))
+            except smtplib.SMTPResponseException as e:
+                results.append((email_id, attempts, f'{e.smtp_code} {e.smtp_error!r}', e.smtp_code >= 500))
+                self._close()
+            except (smtplib.SMTPException, OSError) as e:
+                results.append((email_id, attempts, repr(e), False))
+                self._close()
+        self._last_used = time.monotonic()
+        self._record(results, lease)
+
+    def _record(self, results, lease):
+        # Rows whose lease another sender has taken over are theirs to record.
+        now = time.time()
+        with connection() as conn:
+            for email_id, attempts, error, permanent in results:
+                attempts += 1
+                if error is None:
+                    conn.execute('''
+                        UPDATE email_outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL
+                        WHERE id = ? AND status = 'sending' AND next_attempt_at = ?
+                    ''', (attempts, now, email_id, lease))
+                elif permanent or attempts >= self.max_attempts:
+                    conn.execute('''
+                        UPDATE email_outbox SET status = 'failed', attempts = ?, last_error = ?
+                        WHERE id = ? AND status = 'sending' AND next_attempt_at = ?
+                    ''', (attempts, error, email_id, lease))
+                else:
+                    conn.execute('''
+                        UPDATE email_outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?
+                        WHERE id = ? AND status = 'sending' AND next_attempt_at = ?
+                    ''', (attempts, error, now + self.backoff * 2 ** (attempts - 1), email_id, lease))
+            conn.commit()
+
+    def _check_connection(self):
+        # The server may have dropped a connection that sat idle between batches.
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+
+    def _connection(self):
+        if self._smtp is None:
+            host, port = self.settings['host'], self.settings['port']
+            if self.settings.get('ssl', True):
+                smtp = smtplib.SMTP_SSL(host, port, timeout=30)
+            else:
+                smtp = smtplib.SMTP(host, port, timeout=30)
+            if self.settings.get('password'):
+                smtp.login(self.settings['sender'], self.settings['password'])
+            self._smtp = smtp
+        return self._smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+def outbox_status():
+    """
+    Returns the number of emails in each status, and the oldest undelivered email's age in seconds.
+    """
+    with connection() as conn:
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status').fetchall())
+        oldest = conn.execute('''
+            SELECT MIN(created_at) FROM email_outbox WHERE status IN ('pending', 'sending')
+        ''').fetchone()[0]
+    counts['oldest_pending_age'] = time.time() - oldest if oldest else 0.0
+    return counts
+
 
-    with smtplib.SMTP_SSL(host, port) as server:
-        server.login(sender, password)
-        print(f'Sending email to {receiver}...')
-        server.sendmail(sender, receiver, message.as_string())
\ No newline at end of file
+outbox = OutboxSender(config['email'])
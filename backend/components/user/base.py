@@ -1,27 +1,39 @@
 import tornado.web
 from database import get_user_role
-
-active_sessions = {}
+from asyncdb import pool
+import sessions
 
 class BaseHandler(tornado.web.RequestHandler):
     def get_login_url(self) -> str:
         return "/login"
 
-    def get_current_user(self):
+    async def prepare(self):
+        """
+        Resolves the logged-in user once per request. A session the session cache
+        vouches for is accepted right away; otherwise the session backend (SQLite
+        or Redis) is asked on the database pool, never on the IOLoop.
+
+        Handlers that override prepare() must await super().prepare() first.
+        """
         session_id = self.get_secure_cookie("session_id")
         username = self.get_secure_cookie("user")
-
+        self.current_user = None
         if not session_id or not username:
-            return None
+            return
 
-        if active_sessions.get(username.decode('utf-8')) == session_id.decode('utf-8'):
-            return username.decode('utf-8')
-        return None
+        username, session_id = username.decode('utf-8'), session_id.decode('utf-8')
+        store = sessions.store
+        if store.cached(username, session_id) or await pool.run(store.validate, username, session_id):
+            self.current_user = username
+
+    def get_current_user(self):
+        # Set by prepare(); None until it has run.
+        return getattr(self, '_current_user', None)
 
-    def get_user_role(self):
+    async def get_user_role(self):
         username = self.get_current_user()
         if username:
-            role = get_user_role(username)
+            role = await pool.run(get_user_role, username)
             return role
         return None
 
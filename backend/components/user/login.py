@@ -1,12 +1,36 @@
-import hashlib
-import uuid
 import json
+import math
 import tornado.web
-from components.user.base import BaseHandler, active_sessions
-from database import validate_user, add_user, add_teacher_request, get_users_by_role, get_user_role, get_users_by_role_with_id
-from components.sendEmail import send_email
+import sessions
+from components.user.base import BaseHandler
+from database import (get_password_hash, create_user, create_teacher_request, validate_email_format,
+                      get_users_by_role, get_user_role, search_users)
+from asyncdb import pool
+from components.sendEmail import queue_emails
+from passwords import password_hasher, login_throttle, HasherBusy
 
-class LoginHandler(BaseHandler):
+class PasswordHandlerMixin:
+    """
+    Admission control for handlers that hash or check a password.
+    """
+    def throttled(self, username=None):
+        """
+        Counts an attempt from the client (for `username`, if given) and answers
+        429 Too Many Requests if it is over its rate. Returns True if so.
+        """
+        wait = login_throttle.check(self.request.remote_ip, username)
+        if wait:
+            self.set_status(429)
+            self.set_header("Retry-After", str(math.ceil(wait)))
+            self.write(json.dumps({'success': False, 'message': 'Too many attempts. Please try again later.'}))
+        return bool(wait)
+
+    def busy(self):
+        self.set_status(503)
+        self.set_header("Retry-After", "1")
+        self.write(json.dumps({'success': False, 'message': 'The server is busy. Please try again shortly.'}))
+
+class LoginHandler(PasswordHandlerMixin, BaseHandler):
     def get(self):
         self.write('<html><body>'
                    '<form action="/login" method="post">'
@@ -15,16 +39,23 @@ class LoginHandler(BaseHandler):
                    '<input type="submit" value="Login">'
                    '</form></body></html>')
 
-    def post(self):
+    async def post(self):
         username = self.get_argument("username")
         password = self.get_argument("password")
+        if self.throttled(username):
+            return
 
-        if validate_user(username, password):
-            session_id = hashlib.sha256(uuid.uuid4().hex.encode('utf-8')).hexdigest()
-            active_sessions[username] = session_id
-            self.set_secure_cookie("user", username)
-            self.set_secure_cookie("session_id", session_id)
-            role = get_user_role(username)
+        try:
+            valid = await password_hasher.verify(password, await pool.run(get_password_hash, username))
+        except HasherBusy:
+            self.busy()
+            return
+        if valid:
+            store = sessions.store
+            session_id = await pool.run(store.create, username)
+            self.set_secure_cookie("user", username, expires_days=store.ttl / 86400)
+            self.set_secure_cookie("session_id", session_id, expires_days=store.ttl / 86400)
+            role = await pool.run(get_user_role, username)
             self.write(json.dumps({
                 'success': True,
                 'role': role
@@ -36,7 +67,7 @@ class LoginHandler(BaseHandler):
             }))
 
 
-class RegisterHandler(BaseHandler):
+class RegisterHandler(PasswordHandlerMixin, BaseHandler):
     def get(self):
         self.write('<html><body>'
                    '<form action="/register" method="post">'
@@ -51,7 +82,7 @@ class RegisterHandler(BaseHandler):
                         '<input type="submit" value="Register">'
                         '</form></body></html>')
 
-    def post(self):
+    async def post(self):
         username = self.get_argument("username")
         password = self.get_argument("password")
         email = self.get_argument("email")
@@ -59,19 +90,34 @@ class RegisterHandler(BaseHandler):
 
         if role == 'admin':
             self.write("Registration failed. Admin registration is not allowed.")
-        elif role == 'student':
-            if add_user(username, password, email, role):
+            return
+        if role not in ('student', 'teacher'):
+            return
+        if not validate_email_format(email):
+            self.set_status(400)
+            self.write("Registration failed. Invalid email format.")
+            return
+        if self.throttled():
+            return
+        try:
+            password_hash = await password_hasher.hash(password)
+        except HasherBusy:
+            self.busy()
+            return
+
+        if role == 'student':
+            if await pool.run(create_user, username, password_hash, email, role):
                 self.write(f"User {username} registered successfully as {role}!")
             else:
                 self.set_status(400)
                 self.write("Registration failed. Possibly due to duplicate username/email or invalid email format.")
         elif role == 'teacher':
-            if add_teacher_request(username, password, email):
-                admins = get_users_by_role('admin')
-                for admin in admins:
-                    send_email(admin.email,
-                            'Course Teacher Registration Request',
-                            f'User {username} has requested to register as a course teacher. Please approve or deny the request on the admin panel.')
+            if await pool.run(create_teacher_request, username, password_hash, email):
+                admins = await pool.run(get_users_by_role, 'admin')
+                await pool.run(queue_emails, [(admin.email,
+                        'Course Teacher Registration Request',
+                        f'User {username} has requested to register as a course teacher. Please approve or deny the request on the admin panel.')
+                        for admin in admins])
                 self.write(f"Request sent to admin for approval.")
             else:
                 self.set_status(400)
@@ -80,17 +126,31 @@ class RegisterHandler(BaseHandler):
 
 class LogoutHandler(BaseHandler):
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
+        await pool.run(sessions.store.revoke, self.get_current_user())
         self.clear_cookie("user")
+        self.clear_cookie("session_id")
         self.redirect("/login")
 
 
 class UserSearchHandler(BaseHandler):
     """
-    /users/search?query=<search_query>
+    /users/search?query=<search_query>[&limit=<n>]
+
+    Typeahead over student usernames: up to `limit` (default 20, at most 50)
+    names containing the query, those starting with it first.
     """
-    def get(self):
+    MAX_LIMIT = 50
+
+    async def get(self):
         query = self.get_argument("query")
-        results = get_users_by_role_with_id('student')
-        results = [user for user in results if query.lower() in user['username'].lower()]
+        try:
+            limit = int(self.get_argument("limit", "20"))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= self.MAX_LIMIT:
+            self.set_status(400)
+            self.write(f"Bad Request: limit must be between 1 and {self.MAX_LIMIT}.")
+            return
+        results = await pool.run(search_users, query, 'student', limit)
         self.write(json.dumps(results))
\ No newline at end of file
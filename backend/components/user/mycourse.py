@@ -3,8 +3,12 @@ import sqlite3
 import time
 import tornado.web
 from components.user.base import BaseHandler
-from database import DATABASE, get_user_role
-from components.sendEmail import send_email
+from database import get_user_role
+from asyncdb import pool
+from cache import course_detail_cache
+from leaderboard import popularity, WEIGHTS
+from components.sendEmail import queue_email, outbox
+from components.inbox import inbox_feed
 import bcrypt
 
 class MyCourseHandler(BaseHandler):
@@ -12,7 +16,7 @@ class MyCourseHandler(BaseHandler):
     Handles the courses of students and teachers.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the courses of the user.
         """
@@ -21,39 +25,37 @@ class MyCourseHandler(BaseHandler):
         if username == None:
             username = self.get_current_user()
             
-        role = get_user_role(username)
+        role = await pool.run(get_user_role, username)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if role == 'teacher':
-                cursor.execute('''
-                    SELECT id, title, description FROM courses WHERE owner = ?
-                ''', (username,))
-                courses = cursor.fetchall()
-                courses = [{'id': c[0], 'title': c[1], 'description': c[2]} for c in courses]
-                self.write(json.dumps(courses))
-            elif role == 'student':
-                cursor.execute('''
-                    SELECT c.id, c.title, c.description FROM courses c
-                    JOIN course_students cs ON c.id = cs.course_id
-                    WHERE cs.student = ?
-                ''', (username,))
-                courses = cursor.fetchall()
-                courses = [{'id': c[0], 'title': c[1], 'description': c[2]} for c in courses]
-                self.write(json.dumps(courses))
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to access this page.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                if role == 'teacher':
+                    await cursor.execute('''
+                        SELECT id, title, description FROM courses WHERE owner = ?
+                    ''', (username,))
+                    courses = cursor.fetchall()
+                    courses = [{'id': c[0], 'title': c[1], 'description': c[2]} for c in courses]
+                    self.write(json.dumps(courses))
+                elif role == 'student':
+                    await cursor.execute('''
+                        SELECT c.id, c.title, c.description FROM courses c
+                        JOIN course_students cs ON c.id = cs.course_id
+                        WHERE cs.student = ?
+                    ''', (username,))
+                    courses = cursor.fetchall()
+                    courses = [{'id': c[0], 'title': c[1], 'description': c[2]} for c in courses]
+                    self.write(json.dumps(courses))
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to access this page.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         If the request is from the owner, adds the list of students to the course.
         If the request is from a student, sends a request to join the course to the teacher.
@@ -62,57 +64,63 @@ class MyCourseHandler(BaseHandler):
         course_id = self.get_argument("course_id")
         students = self.get_argument("students")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            role = get_user_role(username)
-            if role == 'teacher':
-                cursor.execute('''
-                    SELECT owner FROM courses WHERE id = ?
-                ''', (course_id,))
-                owner = cursor.fetchone()
-                if owner and owner[0] == username:
-                    for student in students:
-                        cursor.execute('''
-                            INSERT INTO course_students (course_id, student) VALUES (?, ?)
-                        ''', (course_id, student))
-                    conn.commit()
-                    self.write("Students added to the course successfully.")
+            try:
+                role = await conn.run(get_user_role, username)
+                if role == 'teacher':
+                    await cursor.execute('''
+                        SELECT owner FROM courses WHERE id = ?
+                    ''', (course_id,))
+                    owner = cursor.fetchone()
+                    if owner and owner[0] == username:
+                        for student in students:
+                            await cursor.execute('''
+                                INSERT INTO course_students (course_id, student) VALUES (?, ?)
+                            ''', (course_id, student))
+                        await conn.commit()
+                        course_detail_cache.invalidate(int(course_id))
+                        popularity.record(course_id, WEIGHTS['enroll'] * len(students))
+                        self.write("Students added to the course successfully.")
+                    else:
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to add students to this course.")
+                elif role == 'student':
+                    await cursor.execute('''
+                        SELECT c.owner, u.email FROM courses c
+                        LEFT JOIN users u ON u.username = c.owner
+                        WHERE c.id = ?
+                    ''', (course_id,))
+                    owner = cursor.fetchone()
+                    if owner:
+                        await cursor.execute('''
+                            INSERT INTO join_course_requests (course_id, student) VALUES (?, ?)
+                        ''', (course_id, username))
+                        await cursor.execute('''
+                            INSERT INTO messages (sender, receiver, subject, body, timestamp, priority, type) VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', (username, owner[0], 'Course Join Request', f'User {username} has requested to join the course with id {course_id}.', time.strftime('%Y-%m-%d %H:%M:%S'), 1, 'request'))
+                        if owner[1]:
+                            await conn.run(queue_email, owner[1],
+                                    'Course Join Request',
+                                    f'User {username} has requested to join the course with id {course_id}. Please approve or deny the request on the course page.',
+                                    False)
+                        await conn.commit()
+                        outbox.wake()
+                        inbox_feed.wake()
+                        self.write("Request sent to the course teacher.")
+                    else:
+                        self.set_status(404)
+                        self.write("Course not found.")
                 else:
                     self.set_status(403)
-                    self.write("Forbidden: You do not have permission to add students to this course.")
-            elif role == 'student':
-                cursor.execute('''
-                    SELECT owner FROM courses WHERE id = ?
-                ''', (course_id,))
-                owner = cursor.fetchone()
-                if owner:
-                    cursor.execute('''
-                        INSERT INTO join_course_requests (course_id, student) VALUES (?, ?)
-                    ''', (course_id, username))
-                    conn.commit()
-                    send_email(owner[0],
-                            'Course Join Request',
-                            f'User {username} has requested to join the course with id {course_id}. Please approve or deny the request on the course page.')
-                    cursor.execute('''
-                        INSERT INTO messages (sender, receiver, subject, body, timestamp, priority, type) VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (username, owner[0], 'Course Join Request', f'User {username} has requested to join the course with id {course_id}.', time.strftime('%Y-%m-%d %H:%M:%S'), 1, 'request'))
-                    self.write("Request sent to the course teacher.")
-                else:
-                    self.set_status(404)
-                    self.write("Course not found.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to perform this action.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    self.write("Forbidden: You do not have permission to perform this action.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def delete(self):
+    async def delete(self):
         """
         If the request is from the owner, deletes the list of students from the course.
         If the request is from a student, cancels the request to join the course.
@@ -121,75 +129,79 @@ class MyCourseHandler(BaseHandler):
         course_id = self.get_argument("course_id")
         students = self.get_argument("students")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            role = get_user_role(username)
-            if role == 'teacher':
-                cursor.execute('''
-                    SELECT owner FROM courses WHERE id = ?
-                ''', (course_id,))
-                owner = cursor.fetchone()
-                if owner and owner[0] == username:
-                    for student in students:
-                        cursor.execute('''
-                            DELETE FROM course_students WHERE course_id = ? AND student = ?
-                        ''', (course_id, student))
-                    conn.commit()
-                    self.write("Students removed from the course successfully.")
+            try:
+                role = await conn.run(get_user_role, username)
+                if role == 'teacher':
+                    await cursor.execute('''
+                        SELECT owner FROM courses WHERE id = ?
+                    ''', (course_id,))
+                    owner = cursor.fetchone()
+                    if owner and owner[0] == username:
+                        enrolments = []
+                        for student in students:
+                            await cursor.execute('''
+                                SELECT enrolled_at FROM course_students WHERE course_id = ? AND student = ?
+                            ''', (course_id, student))
+                            enrolments += cursor.fetchall()
+                            await cursor.execute('''
+                                DELETE FROM course_students WHERE course_id = ? AND student = ?
+                            ''', (course_id, student))
+                        await conn.commit()
+                        course_detail_cache.invalidate(int(course_id))
+                        for (enrolled_at,) in enrolments:
+                            popularity.record(course_id, -WEIGHTS['enroll'], at=enrolled_at)
+                        self.write("Students removed from the course successfully.")
+                    else:
+                        self.set_status(403)
+                        self.write("Forbidden: You do not have permission to remove students from this course.")
+                elif role == 'student':
+                    await cursor.execute('''
+                        DELETE FROM join_course_requests WHERE course_id = ? AND student = ?
+                    ''', (course_id, username))
+                    await conn.commit()
+                    self.write("Request cancelled successfully.")
                 else:
                     self.set_status(403)
-                    self.write("Forbidden: You do not have permission to remove students from this course.")
-            elif role == 'student':
-                cursor.execute('''
-                    DELETE FROM join_course_requests WHERE course_id = ? AND student = ?
-                ''', (course_id, username))
-                conn.commit()
-                self.write("Request cancelled successfully.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to perform this action.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    self.write("Forbidden: You do not have permission to perform this action.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class AddCourseRequestHandler(BaseHandler):
     """
     Handles the requests to add a course.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the requests to add a course.
         """
         username = self.get_current_user()
-        role = get_user_role(username)
+        role = await pool.run(get_user_role, username)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if role == 'admin':
-                cursor.execute('''
-                    SELECT id, title, description, owner, category FROM add_course_requests
-                ''')
-                requests = cursor.fetchall()
-                requests = [{'id': r[0], 'title': r[1], 'description': r[2], 'owner': r[3], 'category': r[4]} for r in requests]
-                self.write(json.dumps(requests))
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to access this page.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                if role == 'admin':
+                    await cursor.execute('''
+                        SELECT id, title, description, owner, category FROM add_course_requests
+                    ''')
+                    requests = cursor.fetchall()
+                    requests = [{'id': r[0], 'title': r[1], 'description': r[2], 'owner': r[3], 'category': r[4]} for r in requests]
+                    self.write(json.dumps(requests))
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to access this page.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Approves or denies the request to add a course.
         """
@@ -198,80 +210,76 @@ class AddCourseRequestHandler(BaseHandler):
         request_id = self.get_argument("request_id")
         action = self.get_argument("action")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if get_user_role(username) == 'admin':
-                cursor.execute('''
-                    SELECT owner, title, description, category FROM add_course_requests WHERE id = ?
-                ''', (request_id,))
-                request = cursor.fetchone()
-                if request:
-                    if action == 'approve':
-                        cursor.execute('''
-                            INSERT INTO courses (owner, title, description, category) VALUES (?, ?, ?, ?)
-                        ''', (request[0], request[1], request[2], request[3]))
-                        cursor.execute('''
-                            DELETE FROM add_course_requests WHERE id = ?
-                        ''', (request_id,))
-                        conn.commit()
-                        self.write("Course added successfully.")
-                    elif action == 'deny':
-                        cursor.execute('''
-                            DELETE FROM add_course_requests WHERE id = ?
-                        ''', (request_id,))
-                        conn.commit()
-                        self.write("Course request denied.")
+            try:
+                if await conn.run(get_user_role, username) == 'admin':
+                    await cursor.execute('''
+                        SELECT owner, title, description, category FROM add_course_requests WHERE id = ?
+                    ''', (request_id,))
+                    request = cursor.fetchone()
+                    if request:
+                        if action == 'approve':
+                            await cursor.execute('''
+                                INSERT INTO courses (owner, title, description, category) VALUES (?, ?, ?, ?)
+                            ''', (request[0], request[1], request[2], request[3]))
+                            await cursor.execute('''
+                                DELETE FROM add_course_requests WHERE id = ?
+                            ''', (request_id,))
+                            await conn.commit()
+                            self.write("Course added successfully.")
+                        elif action == 'deny':
+                            await cursor.execute('''
+                                DELETE FROM add_course_requests WHERE id = ?
+                            ''', (request_id,))
+                            await conn.commit()
+                            self.write("Course request denied.")
+                        else:
+                            self.set_status(400)
+                            self.write("Bad request: Invalid action.")
                     else:
-                        self.set_status(400)
-                        self.write("Bad request: Invalid action.")
+                        self.set_status(404)
+                        self.write("Course request not found.")
                 else:
-                    self.set_status(404)
-                    self.write("Course request not found.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to perform this action.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to perform this action.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class AddTeacherRequestHandler(BaseHandler):
     """
     Handles the requests to add a teacher.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the requests to add a teacher.
         """
         username = self.get_current_user()
-        role = get_user_role(username)
+        role = await pool.run(get_user_role, username)
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if role == 'admin':
-                cursor.execute('''
-                    SELECT id, username, email FROM add_teacher_requests
-                ''')
-                requests = cursor.fetchall()
-                requests = [{'id': r[0], 'username': r[1], 'email': r[2]} for r in requests]
-                self.write(json.dumps(requests))
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to access this page.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                if role == 'admin':
+                    await cursor.execute('''
+                        SELECT id, username, email FROM add_teacher_requests
+                    ''')
+                    requests = cursor.fetchall()
+                    requests = [{'id': r[0], 'username': r[1], 'email': r[2]} for r in requests]
+                    self.write(json.dumps(requests))
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to access this page.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Approves or denies the request to add a teacher.
         """
@@ -279,43 +287,41 @@ class AddTeacherRequestHandler(BaseHandler):
         request_id = self.get_argument("request_id")
         action = self.get_argument("action")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if get_user_role(username) == 'admin':
-                cursor.execute('''
-                    SELECT username, email, password_hash FROM add_teacher_requests WHERE id = ?
-                ''', (request_id,))
-                request = cursor.fetchone()
-                if request:
-                    if action == 'approve':
-                        cursor.execute('''
-                            INSERT INTO users (username, email, role, password_hash) VALUES (?, ?, ?, ?)
-                        ''', (request[0], request[1], 'teacher', request[2]))
-                        cursor.execute('''
-                            DELETE FROM add_teacher_requests WHERE id = ?
-                        ''', (request_id,))
-                        conn.commit()
-                        self.write("Teacher added successfully.")
-                    elif action == 'deny':
-                        cursor.execute('''
-                            DELETE FROM add_teacher_requests WHERE id = ?
-                        ''', (request_id,))
-                        conn.commit()
-                        self.write("Teacher request denied.")
+            try:
+                if await conn.run(get_user_role, username) == 'admin':
+                    await cursor.execute('''
+                        SELECT username, email, password_hash FROM add_teacher_requests WHERE id = ?
+                    ''', (request_id,))
+                    request = cursor.fetchone()
+                    if request:
+                        if action == 'approve':
+                            await cursor.execute('''
+                                INSERT INTO users (username, email, role, password_hash) VALUES (?, ?, ?, ?)
+                            ''', (request[0], request[1], 'teacher', request[2]))
+                            await cursor.execute('''
+                                DELETE FROM add_teacher_requests WHERE id = ?
+                            ''', (request_id,))
+                            await conn.commit()
+                            self.write("Teacher added successfully.")
+                        elif action == 'deny':
+                            await cursor.execute('''
+                                DELETE FROM add_teacher_requests WHERE id = ?
+                            ''', (request_id,))
+                            await conn.commit()
+                            self.write("Teacher request denied.")
+                        else:
+                            self.set_status(400)
+                            self.write("Bad request: Invalid action.")
                     else:
-                        self.set_status(400)
-                        self.write("Bad request: Invalid action.")
+                        self.set_status(404)
+                        self.write("Teacher request not found.")
                 else:
-                    self.set_status(404)
-                    self.write("Teacher request not found.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to perform this action.")
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to perform this action.")
 
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
\ No newline at end of file
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
\ No newline at end of file
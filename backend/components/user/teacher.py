@@ -2,40 +2,40 @@ import json
 import sqlite3
 import tornado.web
 from components.user.base import BaseHandler
-from database import DATABASE, get_user_role
+from database import get_user_role
+from asyncdb import pool
+from leaderboard import popularity
 
 class AddTeacherHandler(BaseHandler):
     """
     Handles the requests to add a teacher.
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Returns all the requests to add a teacher.
         """
         username = self.get_current_user()
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if get_user_role(username) == 'admin':
-                cursor.execute('''
-                    SELECT username, email FROM add_teacher_requests
-                ''')
-                requests = cursor.fetchall()
-                self.write(json.dumps(requests))
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to access this page.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+            try:
+                if await conn.run(get_user_role, username) == 'admin':
+                    await cursor.execute('''
+                        SELECT username, email FROM add_teacher_requests
+                    ''')
+                    requests = cursor.fetchall()
+                    self.write(json.dumps(requests))
+                else:
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to access this page.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         """
         Approves or denies a request to add a teacher.
         """
@@ -43,93 +43,131 @@ class AddTeacherHandler(BaseHandler):
         teacher = self.get_argument("teacher")
         action = self.get_argument("action")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
 
-        try:
-            if get_user_role(username) == 'admin':
-                if action == 'approve':
-                    cursor.execute('''
-                        SELECT username, password_hash, email FROM add_teacher_requests WHERE username = ?
-                    ''', (teacher,))
-                    request = cursor.fetchone()
-                    if request:
-                        cursor.execute('''
-                            INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)
-                        ''', (request[0], request[1], request[2], 'teacher'))
-                        cursor.execute('''
+            try:
+                if await conn.run(get_user_role, username) == 'admin':
+                    if action == 'approve':
+                        await cursor.execute('''
+                            SELECT username, password_hash, email FROM add_teacher_requests WHERE username = ?
+                        ''', (teacher,))
+                        request = cursor.fetchone()
+                        if request:
+                            await cursor.execute('''
+                                INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)
+                            ''', (request[0], request[1], request[2], 'teacher'))
+                            await cursor.execute('''
+                                DELETE FROM add_teacher_requests WHERE username = ?
+                            ''', (teacher,))
+                            await conn.commit()
+                            self.write("Request approved successfully.")
+                        else:
+                            self.set_status(404)
+                            self.write("Request not found.")
+                    elif action == 'deny':
+                        await cursor.execute('''
                             DELETE FROM add_teacher_requests WHERE username = ?
                         ''', (teacher,))
-                        conn.commit()
-                        self.write("Request approved successfully.")
+                        await conn.commit()
+                        self.write("Request denied successfully.")
                     else:
-                        self.set_status(404)
-                        self.write("Request not found.")
-                elif action == 'deny':
-                    cursor.execute('''
-                        DELETE FROM add_teacher_requests WHERE username = ?
-                    ''', (teacher,))
-                    conn.commit()
-                    self.write("Request denied successfully.")
+                        self.set_status(400)
+                        self.write("Invalid action.")
                 else:
-                    self.set_status(400)
-                    self.write("Invalid action.")
-            else:
-                self.set_status(403)
-                self.write("Forbidden: You do not have permission to perform this action.")
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+                    self.set_status(403)
+                    self.write("Forbidden: You do not have permission to perform this action.")
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class AllTeacherHandler(BaseHandler):
     """
     Return all teachers
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         Return all teachers
         """
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, username FROM users WHERE role = "teacher"
-            ''')
-            teachers = cursor.fetchall()
-            teachers = [{'id': teacher[0], 'username': teacher[1], 'thumbnail': "https://upload.wikimedia.org/wikipedia/commons/a/a9/Example.jpg",
-                          'rating': int(teacher[0])*11%31/10.0+2, 'description': "This is a sample descriptionduction"} for teacher in teachers]
-            self.write(json.dumps(teachers))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                await cursor.execute('''
+                    SELECT u.id, u.username, SUM(s.rating_sum) * 1.0 / SUM(s.rating_count) FROM users u
+                    LEFT JOIN courses c ON c.owner = u.username
+                    LEFT JOIN course_stats s ON s.course_id = c.id
+                    WHERE u.role = 'teacher'
+                    GROUP BY u.id
+                ''')
+                teachers = cursor.fetchall()
+                teachers = [{'id': teacher[0], 'username': teacher[1], 'thumbnail': "https://upload.wikimedia.org/wikipedia/commons/a/a9/Example.jpg",
+                              'rating': teacher[2] or 0, 'description': "This is a sample descriptionduction"} for teacher in teachers]
+                self.write(json.dumps(teachers))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
 
 class GetTeacherHandler(BaseHandler):
     """
     find a teacher
     """
     @tornado.web.authenticated
-    def get(self):
+    async def get(self):
         """
         find a teacher
         """
         id = self.get_argument("id")
 
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT username FROM users WHERE id = ?
-            ''',(id,))
-            teachers = cursor.fetchall()
-            teachers = [{'id': id, 'name': teacher[0], 'rating': int(id)*11%31/10.0+2} for teacher in teachers]
-            self.write(json.dumps(teachers))
-        except sqlite3.Error as e:
-            self.set_status(500)
-            self.write(str(e))
-        finally:
-            conn.close()
\ No newline at end of file
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                await cursor.execute('''
+                    SELECT u.username, SUM(s.rating_sum) * 1.0 / SUM(s.rating_count) FROM users u
+                    LEFT JOIN courses c ON c.owner = u.username
+                    LEFT JOIN course_stats s ON s.course_id = c.id
+                    WHERE u.id = ?
+                    GROUP BY u.id
+                ''',(id,))
+                teachers = cursor.fetchall()
+                teachers = [{'id': id, 'name': teacher[0], 'rating': teacher[1] or 0} for teacher in teachers]
+                self.write(json.dumps(teachers))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
+
+class PopularTeachersHandler(BaseHandler):
+    """
+    Return the most popular teachers
+    """
+    @tornado.web.authenticated
+    async def get(self):
+        """
+        Returns the teachers whose courses are the most popular, most popular first.
+
+        GET /api/teacher/popular?k=10
+        """
+        k = self.get_argument("k", "10")
+        if not k.isdigit():
+            self.set_status(400)
+            self.write("Bad Request: k must be a number.")
+            return
+        if not popularity.loaded:
+            await pool.run(popularity.load)
+        top = popularity.top_teachers(min(int(k), 100))
+        if not top:
+            self.write(json.dumps([]))
+            return
+
+        async with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                await cursor.execute(f'''
+                    SELECT username, id FROM users WHERE username IN ({','.join('?' * len(top))})
+                ''', tuple(username for username, _ in top))
+                ids = dict(cursor.fetchall())
+                self.write(json.dumps([{'id': ids.get(username), 'username': username, 'popularity': score}
+                                       for username, score in top]))
+            except sqlite3.Error as e:
+                self.set_status(500)
+                self.write(str(e))
@@ -1,10 +1,8 @@
 import sqlite3
 import bcrypt
 import re
-import os
 import random
-
-DATABASE = 'db.db'
+from dbpool import DATABASE, connection
 
 def validate_email_format(email):
     return re.match(r"[^@]+@[^@]+\.[^@]+", email) is not None
@@ -76,386 +74,254 @@ class Rating:
         return f"Rating(star={self.star}, difficulty={self.difficulty}, workload={self.workload}, grading={self.grading}, gain={self.gain}, comment='{self.comment}')"
 
 
-def create_user_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            email TEXT NOT NULL UNIQUE,
-            role TEXT NOT NULL DEFAULT 'student'
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def get_password_hash(username):
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT password_hash FROM users WHERE username=?', (username,))
+        row = cursor.fetchone()
 
-def validate_user(username, password):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT password_hash FROM users WHERE username=?', (username,))
-    row = cursor.fetchone()
-    conn.close()
+    return row[0] if row else None
 
-    if row:
-        stored_hash = row[0]
+def validate_user(username, password):
+    stored_hash = get_password_hash(username)
+    if stored_hash:
         return bcrypt.checkpw(password.encode('utf-8'), stored_hash)
     return False
 
 def add_user(username, password, email, role='student'):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
+    """
+    Hashes the password in the calling thread. Request handlers hash it with
+    passwords.password_hasher instead and call create_user.
+    """
     if not validate_email_format(email):
         return False
+    return create_user(username, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()), email, role)
 
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    try:
-        cursor.execute('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)', (username, password_hash, email, role))
-        conn.commit()
-    except sqlite3.IntegrityError:
+def create_user(username, password_hash, email, role='student'):
+    if not validate_email_format(email):
         return False
-    finally:
-        conn.close()
+
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)', (username, password_hash, email, role))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            return False
     return True
 
 def get_user_role(username):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM users WHERE username=?', (username,))
-    row = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE username=?', (username,))
+        row = cursor.fetchone()
 
     if row:
         return row[0]
     return None
 
 def get_users_by_role(role):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT username, email, role FROM users WHERE role="{role}"')
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT username, email, role FROM users WHERE role="{role}"')
+        rows = cursor.fetchall()
 
     return [User(*row) for row in rows]
 
 def get_users_by_role_with_id(role):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT id, username, email, role FROM users WHERE role="{role}"')
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT id, username, email, role FROM users WHERE role="{role}"')
+        rows = cursor.fetchall()
 
     return [{"id": row[0], "username": row[1]} for row in rows]
 
-def create_add_teacher_request_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS add_teacher_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            password_hash TEXT NOT NULL,
-            email TEXT NOT NULL,
-            UNIQUE(username, email),
-            FOREIGN KEY(username) REFERENCES users(username),
-            FOREIGN KEY(email) REFERENCES users(email)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def search_users(query, role='student', limit=20):
+    """
+    Typeahead search: returns up to `limit` users of `role` whose username contains
+    `query`, ignoring case, as {"id", "username"} dicts. Names starting with
+    `query` come first, alphabetically. Queries shorter than three characters
+    only match the start of names.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    prefix = re.sub(r'([\\%_])', r'\\\1', query) + '%'
+    with connection() as conn:
+        rows = conn.execute('''
+            SELECT id, username FROM users
+            WHERE role = ? AND username LIKE ? ESCAPE '\\'
+            ORDER BY username COLLATE NOCASE LIMIT ?
+        ''', (role, prefix, limit)).fetchall()
+        if len(rows) < limit and len(query) >= 3:
+            # The trigram index finds names containing every trigram of the query, in
+            # order; CROSS JOIN makes SQLite start from it rather than from all users of the role.
+            rows += conn.execute('''
+                SELECT u.id, u.username FROM users_fts f CROSS JOIN users u ON u.id = f.rowid
+                WHERE users_fts MATCH ? AND u.role = ? AND u.username NOT LIKE ? ESCAPE '\\'
+                LIMIT ?
+            ''', ('"' + query.replace('"', '""') + '"', role, prefix, limit - len(rows))).fetchall()
+    return [{"id": row[0], "username": row[1]} for row in rows]
 
 def add_teacher_request(username, password, email):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
     if not validate_email_format(email):
         return False
+    return create_teacher_request(username, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()), email)
 
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-    try:
-        cursor.execute('INSERT INTO add_teacher_requests (username, password_hash, email) VALUES (?, ?, ?)', (username, password_hash, email))
-        conn.commit()
-    except sqlite3.IntegrityError:
+def create_teacher_request(username, password_hash, email):
+    if not validate_email_format(email):
         return False
-    finally:
-        conn.close()
-    return True
 
-def create_inbox_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS inbox (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT NOT NULL,
-            receiver TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            body TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            read INTEGER NOT NULL DEFAULT 0,
-            type TEXT NOT NULL DEFAULT 'message', -- message, request
-            priority INTEGER NOT NULL DEFAULT 0, -- 0: normal, 1: high
-            FOREIGN KEY(sender) REFERENCES users(username),
-            FOREIGN KEY(receiver) REFERENCES users(username)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_course_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            owner TEXT NOT NULL,
-            category TEXT,
-            type TEXT NOT NULL DEFAULT 'open', -- open, ongoing, closed
-            FOREIGN KEY(owner) REFERENCES users(username)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS course_likes (
-            course_id INTEGER NOT NULL,
-            student TEXT NOT NULL,
-            FOREIGN KEY(course_id) REFERENCES courses(id),
-            FOREIGN KEY(student) REFERENCES users(username)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chapters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            type TEXT NOT NULL DEFAULT 'teaching', -- teaching, homework, project
-            course_id INTEGER NOT NULL,
-            published INTEGER NOT NULL DEFAULT 1,
-            FOREIGN KEY(course_id) REFERENCES courses(id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS course_students (
-            course_id INTEGER NOT NULL,
-            student TEXT NOT NULL,
-            FOREIGN KEY(course_id) REFERENCES courses(id),
-            FOREIGN KEY(student) REFERENCES users(username)
-        )
-    ''')
-
-    # courseware
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS courseware (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            chapter_id INTEGER NOT NULL,
-            FOREIGN KEY(chapter_id) REFERENCES chapters(id)
-        )
-    ''')
-
-    # course comments
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS course_comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            course_id INTEGER NOT NULL,
-            student TEXT NOT NULL,
-            comment TEXT NOT NULL,
-            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(course_id) REFERENCES courses(id),
-            FOREIGN KEY(student) REFERENCES users(username)
-        )
-    ''')
-
-    # course progress
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS course_progress (
-            chapter_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            PRIMARY KEY (chapter_id, username),
-            FOREIGN KEY(chapter_id) REFERENCES chapters(id),
-            FOREIGN KEY(username) REFERENCES users(username)
-        )
-    ''')
-
-    # INSERT INTO hwpj (chapter_id, filename) VALUES (?, ?)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS hwpj (
-            chapter_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            FOREIGN KEY(chapter_id) REFERENCES chapters(id)
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-def create_join_course_requests_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS join_course_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student TEXT NOT NULL,
-            course_id INTEGER NOT NULL,
-            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(student) REFERENCES users(username),
-            FOREIGN KEY(course_id) REFERENCES courses(id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_add_course_requests_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS add_course_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            owner TEXT NOT NULL,
-            description TEXT NOT NULL,
-            category TEXT,
-            FOREIGN KEY(owner) REFERENCES users(username)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_posts_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            course_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            sender_name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            likes INTEGER NOT NULL,
-            tag TEXT NOT NULL,
-            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(course_id) REFERENCES courses(id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('INSERT INTO add_teacher_requests (username, password_hash, email) VALUES (?, ?, ?)', (username, password_hash, email))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            return False
+    return True
 
 def get_posts(id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute(f'SELECT * FROM posts where id = {id}')
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT * FROM posts where id = {id}')
+        rows = cursor.fetchall()
 
     return [Post(*row) for row in rows]
 
 def add_post(course_id, title, sender_name, content, likes, tag):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    # try:
-    #     cursor.execute('INSERT INTO posts (course_id, title, sender_name, content, likes, tag) VALUES (?, ?, ?, ?, ?, ?)', (course_id, title, sender_name, content, likes, tag))
-    #     conn.commit()
-    # except sqlite3.IntegrityError:
-    #     return False
-    # finally:
-    #     conn.close()
-    cursor.execute('INSERT INTO posts (course_id, title, sender_name, content, likes, tag) VALUES (?, ?, ?, ?, ?, ?)', (course_id, title, sender_name, content, likes, tag))
-    cursor.execute('INSERT INTO post_comments (post_id, floor, commenter_name, comment_content, likes) VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, 1, sender_name, content, likes))
-    conn.commit()
-    return True
-
-def create_rating_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rating (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            course_id INTEGER NOT NULL,
-            sender_name TEXT NOT NULL,
-            star INTEGER NOT NULL CHECK (star >= 1 AND star <= 5),
-            difficulty TEXT NOT NULL,
-            workload TEXT NOT NULL,
-            grading TEXT NOT NULL,
-            gain TEXT NOT NULL,
-            comment TEXT NOT NULL,
-            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(course_id) REFERENCES courses(id),
-            FOREIGN KEY(sender_name) REFERENCES users(username)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        # try:
+        #     cursor.execute('INSERT INTO posts (course_id, title, sender_name, content, likes, tag) VALUES (?, ?, ?, ?, ?, ?)', (course_id, title, sender_name, content, likes, tag))
+        #     conn.commit()
+        # except sqlite3.IntegrityError:
+        #     return False
+        # finally:
+        #     conn.close()
+        cursor.execute('INSERT INTO posts (course_id, title, sender_name, content, likes, tag) VALUES (?, ?, ?, ?, ?, ?)', (course_id, title, sender_name, content, likes, tag))
+        cursor.execute('INSERT INTO post_comments (post_id, floor, commenter_name, comment_content, likes) VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, 1, sender_name, content, likes))
+        conn.commit()
+        return True
 
 def add_rating(sender_name, star, difficulty, workload, grading, gain, comment, course_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO rating (sender_name, star, difficulty, workload, grading, gain, comment, course_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                   (sender_name, star, difficulty, workload, grading, gain, comment, course_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO rating (sender_name, star, difficulty, workload, grading, gain, comment, course_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (sender_name, star, difficulty, workload, grading, gain, comment, course_id))
+        update_course_stats(course_id, star, 1)
+        conn.commit()
+
+def update_course_stats(course_id, star, delta):
+    """
+    Adds (delta=1) or removes (delta=-1) one rating of `star` stars to the course's statistics.
+
+    Must be called on the connection that inserts/deletes the rating row, before it commits,
+    so that the statistics and the ratings change in the same transaction.
+    """
+    star = int(star)
+    histogram = [delta if star == n else 0 for n in range(1, 6)]
+    with connection() as conn:
+        conn.execute('''
+            INSERT INTO course_stats (course_id, rating_count, rating_sum, rating_avg, star_1, star_2, star_3, star_4, star_5)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(course_id) DO UPDATE SET
+                rating_count = rating_count + excluded.rating_count,
+                rating_sum = rating_sum + excluded.rating_sum,
+                rating_avg = CASE WHEN rating_count + excluded.rating_count > 0
+                                  THEN (rating_sum + excluded.rating_sum) * 1.0 / (rating_count + excluded.rating_count)
+                                  ELSE 0 END,
+                star_1 = star_1 + excluded.star_1,
+                star_2 = star_2 + excluded.star_2,
+                star_3 = star_3 + excluded.star_3,
+                star_4 = star_4 + excluded.star_4,
+                star_5 = star_5 + excluded.star_5
+        ''', (course_id, delta, delta * star, float(star), *histogram))
+
+def rebuild_course_stats(commit=True):
+    """
+    Recomputes course_stats from the rating table. Returns the number of courses with ratings.
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM course_stats')
+        cursor.execute('''
+            INSERT INTO course_stats (course_id, rating_count, rating_sum, rating_avg, star_1, star_2, star_3, star_4, star_5)
+            SELECT course_id, COUNT(*), SUM(star), AVG(star),
+                   SUM(star = 1), SUM(star = 2), SUM(star = 3), SUM(star = 4), SUM(star = 5)
+            FROM rating
+            GROUP BY course_id
+        ''')
+        count = cursor.rowcount
+        if commit:
+            conn.commit()
+    return count
 
 def get_rating(course_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM rating WHERE course_id=?', (course_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM rating WHERE course_id=?', (course_id,))
+        rows = cursor.fetchall()
 
     return [Rating(*row[1:]) for row in rows]
 
-def create_post_comments_table():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS post_comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER NOT NULL,
-            floor INTEGER NOT NULL,
-            commenter_name TEXT NOT NULL,
-            comment_content TEXT NOT NULL,
-            likes INTEGER NOT NULL DEFAULT 0,
-            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(post_id) REFERENCES posts(id),
-            FOREIGN KEY(commenter_name) REFERENCES users(username)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
 def add_post_comment(post_id, floor, commenter_name, comment_content, likes=0):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO post_comments (post_id, floor, commenter_name, comment_content, likes) VALUES (?, ?, ?, ?, ?)',
-                   (post_id, floor, commenter_name, comment_content, likes))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO post_comments (post_id, floor, commenter_name, comment_content, likes) VALUES (?, ?, ?, ?, ?)',
+                       (post_id, floor, commenter_name, comment_content, likes))
+        conn.commit()
 
     return True
 
 def get_post_comments(post_id):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM post_comments WHERE post_id=?', (post_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM post_comments WHERE post_id=?', (post_id,))
+        rows = cursor.fetchall()
 
     return rows
 
 def get_post_by_tag(tag):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM posts WHERE tag=?', (tag,))
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM posts WHERE tag=?', (tag,))
+        rows = cursor.fetchall()
 
     return rows
 
+def get_posts_version():
+    """
+    Returns a number that changes whenever a post is added, changed or deleted.
+    """
+    with connection() as conn:
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = 'posts'").fetchone()
+    return row[0] if row else 0
+
+def get_post_feed(course_id=None, tag=None, after=None, limit=20):
+    """
+    Returns up to `limit` posts, newest first, optionally of one course and/or
+    with one tag, starting after the (date_submitted, id) position `after`.
+    """
+    conditions, params = [], []
+    if course_id is not None:
+        conditions.append('course_id = ?')
+        params.append(course_id)
+    if tag is not None:
+        conditions.append('tag = ?')
+        params.append(tag)
+    if after is not None:
+        conditions.append('(date_submitted, id) < (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with connection() as conn:
+        rows = conn.execute(f'''
+            SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+            {where} ORDER BY date_submitted DESC, id DESC LIMIT ?
+        ''', (*params, limit)).fetchall()
+    return [{'id': row[0], 'course_id': row[1], 'title': row[2], 'sender_name': row[3], 'content': row[4],
+             'likes': row[5], 'tag': row[6], 'date_submitted': row[7]} for row in rows]
+
 def add_fake_data():
     # Add some users with varied passwords and realistic emails
     add_user('admin', 'StrongAdminPass2024!', 'admin@schoolplatform.edu', 'admin')
@@ -468,315 +334,314 @@ def add_fake_data():
     # Add a teacher request
     add_teacher_request('mr.brown', 'NewTeach123!', 'brown.history@schoolplatform.edu')
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    # Add some courses by ms.smith and mr.johnson
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('CS201', 'Advanced Data Structures', 'ms.smith', 'Computer Science'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('CS101', 'Intro to Computer Science', 'ms.smith', 'Computer Science'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('MA101', 'Algebra Basics', 'ms.smith', 'Mathematics'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PH101', 'Introduction to Philosophy', 'mr.johnson', 'Philosophy'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PH201', 'Ethics and Morality', 'mr.johnson', 'Philosophy'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('MA201', 'Calculus I', 'ms.smith', 'Mathematics'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('MA202', 'Calculus II', 'ms.smith', 'Mathematics'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PH301', 'Philosophy of Mind', 'mr.johnson', 'Philosophy'))
-    # Add more detailed courses
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('BIO101', 'Introduction to Biology', 'mr.johnson', 'Biology'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('BIO201', 'Genetics and Evolution', 'mr.johnson', 'Biology'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('CHEM101', 'General Chemistry', 'ms.smith', 'Chemistry'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('CHEM201', 'Organic Chemistry', 'ms.smith', 'Chemistry'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PHY101', 'Physics I: Mechanics', 'mr.johnson', 'Physics'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PHY201', 'Physics II: Electromagnetism', 'mr.johnson', 'Physics'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('ENG101', 'English Literature', 'ms.smith', 'Literature'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('ENG201', 'Creative Writing', 'ms.smith', 'Literature'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('HIS101', 'World History', 'mr.johnson', 'History'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('HIS201', 'Modern History', 'mr.johnson', 'History'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('ART101', 'Introduction to Art', 'ms.smith', 'Art'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('ART201', 'Art History', 'ms.smith', 'Art'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('MUS101', 'Music Theory', 'mr.johnson', 'Music'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('MUS201', 'History of Music', 'mr.johnson', 'Music'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PSY101', 'Introduction to Psychology', 'ms.smith', 'Psychology'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('PSY201', 'Cognitive Psychology', 'ms.smith', 'Psychology'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('SOC101', 'Introduction to Sociology', 'mr.johnson', 'Sociology'))
-    cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
-                   ('SOC201', 'Social Psychology', 'mr.johnson', 'Sociology'))
-
-    # Fetch the course IDs to add chapters and students
-    cursor.execute('SELECT id FROM courses WHERE title = "CS101"')
-    cs101_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM courses WHERE title = "CS201"')
-    cs201_id = cursor.fetchone()[0]
-
-    # Add some chapters for CS101
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Getting Started', 'https://www.youtube.com/embed/6ARjrl74nc4', 'teaching', cs101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Intro to Programming', 'https://player.bilibili.com/player.html?isOutside=true&aid=113567458135663&bvid=BV16tz6YWEfz&cid=27099594855&p=1', 'teaching', cs101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Python Basics', 'https://www.youtube.com/embed/8DvywoWv6fI', 'homework', cs101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Python Functions', 'https://www.youtube.com/embed/9Os0o3wzS_I', 'homework', cs101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Python Project 1', 'https://www.youtube.com/embed/8DvywoWv6fI', 'project', cs101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Python Project 2', 'https://www.youtube.com/embed/9Os0o3wzS_I', 'project', cs101_id))
-    # Add some chapters for CS201
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Data Structures 101', 'https://www.youtube.com/embed/AWclMLWpTEs', 'teaching', cs201_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Tree Structures', 'https://www.youtube.com/embed/2f3gB3zSL08', 'teaching', cs201_id))
-
-    # Fetch the course IDs to add chapters for more courses
-    cursor.execute('SELECT id FROM courses WHERE title = "MA101"')
-    ma101_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM courses WHERE title = "PH101"')
-    ph101_id = cursor.fetchone()[0]
-
-    # Add some chapters for MA101
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Algebra Basics', 'https://www.youtube.com/embed/1', 'teaching', ma101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Linear Equations', 'https://www.youtube.com/embed/2', 'homework', ma101_id))
-
-    # Add some chapters for PH101
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Introduction to Philosophy', 'https://www.youtube.com/embed/3', 'teaching', ph101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Ethics and Morality', 'https://www.youtube.com/embed/4', 'project', ph101_id))
-
-    # Fetch the course IDs to add chapters for more courses
-    cursor.execute('SELECT id FROM courses WHERE title = "BIO101"')
-    bio101_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM courses WHERE title = "CHEM101"')
-    chem101_id = cursor.fetchone()[0]
-
-    # Add some chapters for BIO101
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Introduction to Biology', 'https://www.youtube.com/embed/5', 'teaching', bio101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Genetics Basics', 'https://www.youtube.com/embed/6', 'homework', bio101_id))
-
-    # Add some chapters for CHEM101
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('General Chemistry', 'https://www.youtube.com/embed/7', 'teaching', chem101_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Organic Chemistry Basics', 'https://www.youtube.com/embed/8', 'project', chem101_id))
-
-    # Fetch the course IDs to add chapters for additional courses (e.g., MA201)
-    cursor.execute('SELECT id FROM courses WHERE title = "MA201"')
-    ma201_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM courses WHERE title = "PH201"')
-    ph201_id = cursor.fetchone()[0]
-
-    # Add chapters for MA201
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Limits and Continuity', 'https://www.youtube.com/embed/9', 'teaching', ma201_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Derivatives', 'https://www.youtube.com/embed/10', 'homework', ma201_id))
-
-    # Add chapters for PH201
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Moral Philosophy', 'https://www.youtube.com/embed/11', 'teaching', ph201_id))
-    cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
-                   ('Applied Ethics', 'https://www.youtube.com/embed/12', 'project', ph201_id))
-
-    # Add course likes
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (cs101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (cs101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (cs201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (cs201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph101_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (bio101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (bio101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (chem101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (chem101_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-
-    # Add students to courses
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (cs101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (cs101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (cs201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (cs201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ma101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ma101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph101_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (bio101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (bio101_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (chem101_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (chem101_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
-    cursor.execute('INSERT INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
-
-    # Add courseware for additional chapters
-
-    # Fetch the chapter IDs for CS101 chapters
-    cursor.execute('SELECT id FROM chapters WHERE title = "Python Basics"')
-    python_basics_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Python Functions"')
-    python_functions_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Python Project 1"')
-    python_project1_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Python Project 2"')
-    python_project2_id = cursor.fetchone()[0]
-
-    # Add courseware for Python Basics
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('python_basics_notes.pdf', python_basics_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('python_basics_slides.pptx', python_basics_id))
-
-    # Add courseware for Python Functions
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('python_functions_notes.pdf', python_functions_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('python_functions_examples.zip', python_functions_id))
-
-    # Add courseware for Python Project 1
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('project1_description.pdf', python_project1_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('project1_sample_code.py', python_project1_id))
-
-    # Add courseware for Python Project 2
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('project2_description.pdf', python_project2_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('project2_sample_code.py', python_project2_id))
-
-    # Fetch the chapter IDs for CS201 chapters
-    cursor.execute('SELECT id FROM chapters WHERE title = "Data Structures 101"')
-    data_structures_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Tree Structures"')
-    tree_structures_id = cursor.fetchone()[0]
-
-    # Add courseware for Data Structures 101
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('data_structures_notes.pdf', data_structures_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('data_structures_slides.pptx', data_structures_id))
-
-    # Add courseware for Tree Structures
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('tree_structures_notes.pdf', tree_structures_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('tree_structures_examples.zip', tree_structures_id))
-
-    # Fetch the chapter IDs for MA101 chapters
-    cursor.execute('SELECT id FROM chapters WHERE title = "Algebra Basics"')
-    algebra_basics_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Linear Equations"')
-    linear_equations_id = cursor.fetchone()[0]
-
-    # Add courseware for Algebra Basics
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('algebra_basics_notes.pdf', algebra_basics_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('algebra_basics_practice_questions.pdf', algebra_basics_id))
-
-    # Add courseware for Linear Equations
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('linear_equations_notes.pdf', linear_equations_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('linear_equations_homework.pdf', linear_equations_id))
-
-    # Fetch the chapter IDs for PH101 chapters
-    cursor.execute('SELECT id FROM chapters WHERE title = "Introduction to Philosophy"')
-    intro_philosophy_id = cursor.fetchone()[0]
-    cursor.execute('SELECT id FROM chapters WHERE title = "Ethics and Morality"')
-    ethics_morality_id = cursor.fetchone()[0]
-
-    # Add courseware for Introduction to Philosophy
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('intro_philosophy_readings.pdf', intro_philosophy_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('intro_philosophy_slides.pptx', intro_philosophy_id))
-
-    # Add courseware for Ethics and Morality
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('ethics_morality_case_studies.pdf', ethics_morality_id))
-    cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
-                   ('ethics_morality_assignment.docx', ethics_morality_id))
-
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+
+        # Add some courses by ms.smith and mr.johnson
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('CS201', 'Advanced Data Structures', 'ms.smith', 'Computer Science'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('CS101', 'Intro to Computer Science', 'ms.smith', 'Computer Science'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('MA101', 'Algebra Basics', 'ms.smith', 'Mathematics'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PH101', 'Introduction to Philosophy', 'mr.johnson', 'Philosophy'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PH201', 'Ethics and Morality', 'mr.johnson', 'Philosophy'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('MA201', 'Calculus I', 'ms.smith', 'Mathematics'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('MA202', 'Calculus II', 'ms.smith', 'Mathematics'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PH301', 'Philosophy of Mind', 'mr.johnson', 'Philosophy'))
+        # Add more detailed courses
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('BIO101', 'Introduction to Biology', 'mr.johnson', 'Biology'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('BIO201', 'Genetics and Evolution', 'mr.johnson', 'Biology'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('CHEM101', 'General Chemistry', 'ms.smith', 'Chemistry'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('CHEM201', 'Organic Chemistry', 'ms.smith', 'Chemistry'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PHY101', 'Physics I: Mechanics', 'mr.johnson', 'Physics'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PHY201', 'Physics II: Electromagnetism', 'mr.johnson', 'Physics'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('ENG101', 'English Literature', 'ms.smith', 'Literature'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('ENG201', 'Creative Writing', 'ms.smith', 'Literature'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('HIS101', 'World History', 'mr.johnson', 'History'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('HIS201', 'Modern History', 'mr.johnson', 'History'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('ART101', 'Introduction to Art', 'ms.smith', 'Art'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('ART201', 'Art History', 'ms.smith', 'Art'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('MUS101', 'Music Theory', 'mr.johnson', 'Music'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('MUS201', 'History of Music', 'mr.johnson', 'Music'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PSY101', 'Introduction to Psychology', 'ms.smith', 'Psychology'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('PSY201', 'Cognitive Psychology', 'ms.smith', 'Psychology'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('SOC101', 'Introduction to Sociology', 'mr.johnson', 'Sociology'))
+        cursor.execute('INSERT INTO courses (title, description, owner, category) VALUES (?, ?, ?, ?)',
+                       ('SOC201', 'Social Psychology', 'mr.johnson', 'Sociology'))
+
+        # Fetch the course IDs to add chapters and students
+        cursor.execute('SELECT id FROM courses WHERE title = "CS101"')
+        cs101_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM courses WHERE title = "CS201"')
+        cs201_id = cursor.fetchone()[0]
+
+        # Add some chapters for CS101
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Getting Started', 'https://www.youtube.com/embed/6ARjrl74nc4', 'teaching', cs101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Intro to Programming', 'https://player.bilibili.com/player.html?isOutside=true&aid=113567458135663&bvid=BV16tz6YWEfz&cid=27099594855&p=1', 'teaching', cs101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Python Basics', 'https://www.youtube.com/embed/8DvywoWv6fI', 'homework', cs101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Python Functions', 'https://www.youtube.com/embed/9Os0o3wzS_I', 'homework', cs101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Python Project 1', 'https://www.youtube.com/embed/8DvywoWv6fI', 'project', cs101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Python Project 2', 'https://www.youtube.com/embed/9Os0o3wzS_I', 'project', cs101_id))
+        # Add some chapters for CS201
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Data Structures 101', 'https://www.youtube.com/embed/AWclMLWpTEs', 'teaching', cs201_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Tree Structures', 'https://www.youtube.com/embed/2f3gB3zSL08', 'teaching', cs201_id))
+
+        # Fetch the course IDs to add chapters for more courses
+        cursor.execute('SELECT id FROM courses WHERE title = "MA101"')
+        ma101_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM courses WHERE title = "PH101"')
+        ph101_id = cursor.fetchone()[0]
+
+        # Add some chapters for MA101
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Algebra Basics', 'https://www.youtube.com/embed/1', 'teaching', ma101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Linear Equations', 'https://www.youtube.com/embed/2', 'homework', ma101_id))
+
+        # Add some chapters for PH101
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Introduction to Philosophy', 'https://www.youtube.com/embed/3', 'teaching', ph101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Ethics and Morality', 'https://www.youtube.com/embed/4', 'project', ph101_id))
+
+        # Fetch the course IDs to add chapters for more courses
+        cursor.execute('SELECT id FROM courses WHERE title = "BIO101"')
+        bio101_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM courses WHERE title = "CHEM101"')
+        chem101_id = cursor.fetchone()[0]
+
+        # Add some chapters for BIO101
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Introduction to Biology', 'https://www.youtube.com/embed/5', 'teaching', bio101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Genetics Basics', 'https://www.youtube.com/embed/6', 'homework', bio101_id))
+
+        # Add some chapters for CHEM101
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('General Chemistry', 'https://www.youtube.com/embed/7', 'teaching', chem101_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Organic Chemistry Basics', 'https://www.youtube.com/embed/8', 'project', chem101_id))
+
+        # Fetch the course IDs to add chapters for additional courses (e.g., MA201)
+        cursor.execute('SELECT id FROM courses WHERE title = "MA201"')
+        ma201_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM courses WHERE title = "PH201"')
+        ph201_id = cursor.fetchone()[0]
+
+        # Add chapters for MA201
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Limits and Continuity', 'https://www.youtube.com/embed/9', 'teaching', ma201_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Derivatives', 'https://www.youtube.com/embed/10', 'homework', ma201_id))
+
+        # Add chapters for PH201
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Moral Philosophy', 'https://www.youtube.com/embed/11', 'teaching', ph201_id))
+        cursor.execute('INSERT INTO chapters (title, content, type, course_id) VALUES (?, ?, ?, ?)',
+                       ('Applied Ethics', 'https://www.youtube.com/embed/12', 'project', ph201_id))
+
+        # Add course likes
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (cs101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (cs101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (cs201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (cs201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph101_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (bio101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (bio101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (chem101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (chem101_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_likes (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+
+        # Add students to courses
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (cs101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (cs101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (cs201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (cs201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ma101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ma101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph101_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (bio101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (bio101_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (chem101_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (chem101_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ma201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ma201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'john.doe'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'alice.wong'))
+        cursor.execute('INSERT OR IGNORE INTO course_students (course_id, student) VALUES (?, ?)', (ph201_id, 'jane.doe'))
+
+        # Add courseware for additional chapters
+
+        # Fetch the chapter IDs for CS101 chapters
+        cursor.execute('SELECT id FROM chapters WHERE title = "Python Basics"')
+        python_basics_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Python Functions"')
+        python_functions_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Python Project 1"')
+        python_project1_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Python Project 2"')
+        python_project2_id = cursor.fetchone()[0]
+
+        # Add courseware for Python Basics
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('python_basics_notes.pdf', python_basics_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('python_basics_slides.pptx', python_basics_id))
+
+        # Add courseware for Python Functions
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('python_functions_notes.pdf', python_functions_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('python_functions_examples.zip', python_functions_id))
+
+        # Add courseware for Python Project 1
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('project1_description.pdf', python_project1_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('project1_sample_code.py', python_project1_id))
+
+        # Add courseware for Python Project 2
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('project2_description.pdf', python_project2_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('project2_sample_code.py', python_project2_id))
+
+        # Fetch the chapter IDs for CS201 chapters
+        cursor.execute('SELECT id FROM chapters WHERE title = "Data Structures 101"')
+        data_structures_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Tree Structures"')
+        tree_structures_id = cursor.fetchone()[0]
+
+        # Add courseware for Data Structures 101
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('data_structures_notes.pdf', data_structures_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('data_structures_slides.pptx', data_structures_id))
+
+        # Add courseware for Tree Structures
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('tree_structures_notes.pdf', tree_structures_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('tree_structures_examples.zip', tree_structures_id))
+
+        # Fetch the chapter IDs for MA101 chapters
+        cursor.execute('SELECT id FROM chapters WHERE title = "Algebra Basics"')
+        algebra_basics_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Linear Equations"')
+        linear_equations_id = cursor.fetchone()[0]
+
+        # Add courseware for Algebra Basics
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('algebra_basics_notes.pdf', algebra_basics_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('algebra_basics_practice_questions.pdf', algebra_basics_id))
+
+        # Add courseware for Linear Equations
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('linear_equations_notes.pdf', linear_equations_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('linear_equations_homework.pdf', linear_equations_id))
+
+        # Fetch the chapter IDs for PH101 chapters
+        cursor.execute('SELECT id FROM chapters WHERE title = "Introduction to Philosophy"')
+        intro_philosophy_id = cursor.fetchone()[0]
+        cursor.execute('SELECT id FROM chapters WHERE title = "Ethics and Morality"')
+        ethics_morality_id = cursor.fetchone()[0]
+
+        # Add courseware for Introduction to Philosophy
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('intro_philosophy_readings.pdf', intro_philosophy_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('intro_philosophy_slides.pptx', intro_philosophy_id))
+
+        # Add courseware for Ethics and Morality
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('ethics_morality_case_studies.pdf', ethics_morality_id))
+        cursor.execute('INSERT INTO courseware (filename, chapter_id) VALUES (?, ?)',
+                       ('ethics_morality_assignment.docx', ethics_morality_id))
+
+        conn.commit()
 
     # Add some detailed posts
 
@@ -869,80 +734,120 @@ def add_fake_data():
                     'and consider the reasoning behind different ethical decisions. I encourage you to bring real-world examples to enrich our discussion.',
                     35, 'Academic')
 
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    # Fetch all courses
-    cursor.execute('SELECT id, title FROM courses')
-    courses = cursor.fetchall()
-
-    # Fetch all students
-    cursor.execute('SELECT username FROM users WHERE role = "student"')
-    students = [row[0] for row in cursor.fetchall()]
-
-    # Possible options for difficulty, workload, grading, gain
-    difficulty_options = ['Easy', 'Medium', 'Hard', 'Very Hard']
-    workload_options = ['Light', 'Moderate', 'Heavy', 'Extremely Heavy']
-    grading_options = ['Easy Grading', 'Fair Grading', 'Hard Grading']
-    gain_options = ['High Gain', 'Moderate Gain', 'Low Gain']
-    comment_samples = [
-        'Great course overall. The content was engaging and well-structured.',
-        'The professor was very knowledgeable and approachable.',
-        'I found the assignments challenging but rewarding.',
-        'The course material was relevant and up-to-date.',
-        'I enjoyed the group projects and discussions.',
-        'The workload was manageable, but the exams were tough.',
-        'The course helped me develop new skills and perspectives.',
-        'I would recommend this course to others.',
-        'The course was well-organized and informative.',
-        'The lectures were clear and concise.',
-        'I struggled with the pace of the course.',
-        'The professor provided excellent feedback.',
-        'The course content was too advanced for beginners.',
-        'I appreciated the real-world applications discussed.',
-        'The exams were fair and covered the material well.',
-        'The course was too theoretical for my taste.',
-        'I enjoyed the interactive elements of the course.',
-        'The professor was very engaging and made the material interesting.',
-        'The course workload was heavier than expected.',
-        'I learned a lot from the group projects.',
-        'The course could use more practical examples.',
-        'The professor was always available for questions.',
-        'I wish there were more opportunities for hands-on learning.',
-        'The course readings were insightful and thought-provoking.',
-    ]
-
-    # For each course, add ratings from students
-    for course in courses:
-        course_id = course[0]
-        course_title = course[1]
-
-        # Decide how many ratings to add per course (e.g., between 5 and 20)
-        num_ratings = random.randint(5, 20)
-        # Randomly select students to rate the course
-        rating_students = random.sample(students, min(num_ratings, len(students)))
-
-        for student in rating_students:
-            star = random.randint(1, 5)
-            difficulty = random.choice(difficulty_options)
-            workload = random.choice(workload_options)
-            grading = random.choice(grading_options)
-            gain = random.choice(gain_options)
-            comment = random.choice(comment_samples)
-            add_rating(student, star, difficulty, workload, grading, gain, comment, course_id)
-
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+
+        # Fetch all courses
+        cursor.execute('SELECT id, title FROM courses')
+        courses = cursor.fetchall()
+
+        # Fetch all students
+        cursor.execute('SELECT username FROM users WHERE role = "student"')
+        students = [row[0] for row in cursor.fetchall()]
+
+        # Possible options for difficulty, workload, grading, gain
+        difficulty_options = ['Easy', 'Medium', 'Hard', 'Very Hard']
+        workload_options = ['Light', 'Moderate', 'Heavy', 'Extremely Heavy']
+        grading_options = ['Easy Grading', 'Fair Grading', 'Hard Grading']
+        gain_options = ['High Gain', 'Moderate Gain', 'Low Gain']
+        comment_samples = [
+            'Great course overall. The content was engaging and well-structured.',
+            'The professor was very knowledgeable and approachable.',
+            'I found the assignments challenging but rewarding.',
+            'The course material was relevant and up-to-date.',
+            'I enjoyed the group projects and discussions.',
+            'The workload was manageable, but the exams were tough.',
+            'The course helped me develop new skills and perspectives.',
+            'I would recommend this course to others.',
+            'The course was well-organized and informative.',
+            'The lectures were clear and concise.',
+            'I struggled with the pace of the course.',
+            'The professor provided excellent feedback.',
+            'The course content was too advanced for beginners.',
+            'I appreciated the real-world applications discussed.',
+            'The exams were fair and covered the material well.',
+            'The course was too theoretical for my taste.',
+            'I enjoyed the interactive elements of the course.',
+            'The professor was very engaging and made the material interesting.',
+            'The course workload was heavier than expected.',
+            'I learned a lot from the group projects.',
+            'The course could use more practical examples.',
+            'The professor was always available for questions.',
+            'I wish there were more opportunities for hands-on learning.',
+            'The course readings were insightful and thought-provoking.',
+        ]
+
+        # For each course, add ratings from students
+        for course in courses:
+            course_id = course[0]
+            course_title = course[1]
+
+            # Decide how many ratings to add per course (e.g., between 5 and 20)
+            num_ratings = random.randint(5, 20)
+            # Randomly select students to rate the course
+            rating_students = random.sample(students, min(num_ratings, len(students)))
+
+            for student in rating_students:
+                star = random.randint(1, 5)
+                difficulty = random.choice(difficulty_options)
+                workload = random.choice(workload_options)
+                grading = random.choice(grading_options)
+                gain = random.choice(gain_options)
+                comment = random.choice(comment_samples)
+                add_rating(student, star, difficulty, workload, grading, gain, comment, course_id)
 
 
 def init_db():
-    os.remove(DATABASE)
-    create_user_table()
-    create_add_teacher_request_table()
-    create_inbox_table()
-    create_course_table()
-    create_join_course_requests_table()
-    create_add_course_requests_table()
-    create_posts_table()
-    create_post_comments_table()
-    create_rating_table()
-    add_fake_data()
\ No newline at end of file
+    """
+    Brings the database schema up to date, seeding sample data into a new database.
+    """
+    from migrations import migrate
+    from leaderboard import rebuild_popularity
+    if migrate() == 0 and not get_users_by_role('admin'):
+        add_fake_data()
+        rebuild_popularity()
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Database maintenance commands.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate', help='Apply pending schema migrations.')
+    subparsers.add_parser('rebuild-course-stats', help='Recompute course_stats from the rating table.')
+    subparsers.add_parser('rebuild-popularity', help='Recompute course_popularity from enrolments, likes and ratings.')
+    subparsers.add_parser('rebuild-search', help='Rebuild the forum and course catalog search indexes.')
+    subparsers.add_parser('import-courseware', help='Move courseware files stored before the blob store into it.')
+    subparsers.add_parser('collect-blobs', help='Remove courseware blobs no longer used by any version.')
+    subparsers.add_parser('refresh-recommender', help='Encode new and changed course descriptions for recommendations.')
+    recommend_users = subparsers.add_parser('recommend-users', help='Precompute course recommendations for every active user.')
+    recommend_users.add_argument('--processes', type=int, default=None, help='Worker processes (default: one per CPU).')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        from migrations import migrate, get_version
+        migrate()
+        print(f'Schema version: {get_version()}')
+    elif args.command == 'rebuild-course-stats':
+        print(f'Rebuilt statistics for {rebuild_course_stats()} courses.')
+    elif args.command == 'rebuild-popularity':
+        from leaderboard import rebuild_popularity
+        print(f'Rebuilt popularity for {rebuild_popularity()} courses.')
+    elif args.command == 'rebuild-search':
+        from search import rebuild_search_index, rebuild_course_index
+        print(f'Indexed {rebuild_search_index()} posts and replies and {rebuild_course_index()} courses.')
+    elif args.command == 'import-courseware':
+        from blobstore import import_legacy_courseware
+        print(f'Imported {import_legacy_courseware()} courseware files.')
+    elif args.command == 'collect-blobs':
+        from blobstore import collect_blobs
+        print(f'Removed {collect_blobs()} unused blobs.')
+    elif args.command == 'refresh-recommender':
+        from recommender import recommender
+        print(f'Encoded {recommender.refresh()} course descriptions.')
+    elif args.command == 'recommend-users':
+        from recommender import compute_user_recommendations
+        print(f'Computed recommendations for {compute_user_recommendations(processes=args.processes)} users.')
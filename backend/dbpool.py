@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DATABASE = 'db.db'
+
+# PRAGMAs applied once per pooled connection.
+# - WAL lets readers proceed while a writer holds the lock.
+# - synchronous=NORMAL is durable enough under WAL and skips an fsync per commit.
+# - cache_size is negative, so it is in KiB (64 MiB page cache).
+# - mmap_size lets SQLite read pages straight from the mapped file (256 MiB).
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+# Size of the per-connection prepared statement cache.
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = set()
+_generation = 0
+
+
+def _open(path):
+    conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with _lock:
+        _connections.add(conn)
+    return conn
+
+
+class _PooledConnection:
+    """
+    A connection bound to one thread and one database file, with a nesting depth
+    so that helpers called from inside a handler reuse the handler's connection.
+    """
+    __slots__ = ('conn', 'path', 'depth', 'generation')
+
+    def __init__(self, path):
+        self.conn = _open(path)
+        self.path = path
+        self.depth = 0
+        self.generation = _generation
+
+
+@contextmanager
+def connection(path=None):
+    """
+    Yields the calling thread's connection to the database, opening it on first use.
+
+    Usage:
+        with connection() as conn:
+            cursor = conn.cursor()
+            ...
+            conn.commit()
+
+    The connection is not closed on exit. As with closing a connection, any work
+    that was not committed is rolled back when the outermost block exits.
+    """
+    path = path or DATABASE
+    pooled = getattr(_local, 'pooled', None)
+    if pooled is None or pooled.path != path or pooled.generation != _generation:
+        if pooled is not None and pooled.depth == 0:
+            _discard(pooled.conn)
+        pooled = _PooledConnection(path)
+        _local.pooled = pooled
+
+    pooled.depth += 1
+    try:
+        yield pooled.conn
+    finally:
+        pooled.depth -= 1
+        if pooled.depth == 0 and pooled.conn.in_transaction:
+            pooled.conn.rollback()
+
+
+def _discard(conn):
+    with _lock:
+        _connections.discard(conn)
+    try:
+        conn.close()
+    except sqlite3.ProgrammingError:
+        pass
+
+
+def close_all():
+    """
+    Closes every pooled connection, e.g. before the database file is replaced.
+    Threads reopen their connection lazily on next use.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # Connections owned by other threads can only be closed by them; they
+            # are dropped from the pool and reopened by their thread on next use.
+            pass
+    _local.pooled = None
@@ -0,0 +1,174 @@
+"""
+Popular courses and popular teachers.
+
+A course's popularity is the sum of its enrolments, likes and ratings, each
+weighted by WEIGHTS and decaying with a half-life of HALF_LIFE seconds. A
+teacher's popularity is the sum over the courses they own.
+
+Scores use forward decay: an event at time t adds weight * 2 ** ((t - EPOCH) /
+HALF_LIFE), and the current popularity is that sum scaled by 2 ** -((now -
+EPOCH) / HALF_LIFE). Scaling does not change the order, so the boards never
+need re-sorting as time passes, and the sums from several processes can simply
+be added. (With a two-week half-life, the stored sums stay within float range
+for about 40 years after EPOCH.)
+
+PopularityTracker keeps both boards in memory, sorted, so a top-K read is
+O(K). Handlers record events after committing them, and retract a removed
+enrolment, like or rating with `at=` the time it happened, so it takes away
+exactly what it still contributes; flush() adds them to the
+`course_popularity` table and reloads the boards from it, which picks up events
+recorded by other server processes.
+"""
+
+import bisect
+import threading
+import time
+
+from dbpool import connection
+
+EPOCH = 1704067200  # 2024-01-01 UTC
+HALF_LIFE = 14 * 24 * 3600
+
+WEIGHTS = {
+    'enroll': 3.0,
+    'like': 1.0,
+    'rating': 1.0,  # per star above 3, e.g. -2 for one star and +2 for five
+}
+
+
+def decay_factor(at):
+    return 2.0 ** ((at - EPOCH) / HALF_LIFE)
+
+
+class Leaderboard:
+    """
+    Members sorted by score, kept sorted as scores change.
+    """
+    def __init__(self, scores=None):
+        self._scores = dict(scores or {})
+        self._order = sorted((-score, member) for member, score in self._scores.items())
+
+    def __len__(self):
+        return len(self._scores)
+
+    def add(self, member, delta):
+        old = self._scores.get(member)
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, (-old, member))]
+        score = (old or 0.0) + delta
+        self._scores[member] = score
+        bisect.insort(self._order, (-score, member))
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def top(self, k):
+        """
+        Returns the `k` best (member, score) pairs.
+        """
+        return [(member, -score) for score, member in self._order[:k]]
+
+
+class PopularityTracker:
+    def __init__(self):
+        self.loaded = False
+        self._courses = Leaderboard()
+        self._teachers = Leaderboard()
+        self._owners = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def record(self, course_id, weight, at=None):
+        """
+        Adds an event of the given weight to a course. Call it once the event is committed.
+        Retractions pass a negative weight and the original event's time as `at`.
+        """
+        course_id = int(course_id)
+        delta = weight * decay_factor(time.time() if at is None else at)
+        with self._lock:
+            self._pending[course_id] = self._pending.get(course_id, 0.0) + delta
+            self._courses.add(course_id, delta)
+            owner = self._owners.get(course_id)
+            if owner is not None:
+                self._teachers.add(owner, delta)
+
+    def top_courses(self, k):
+        """
+        Returns [course_id, popularity] pairs for the `k` most popular courses.
+        """
+        scale = 1 / decay_factor(time.time())
+        with self._lock:
+            return [[course_id, score * scale] for course_id, score in self._courses.top(k)]
+
+    def top_teachers(self, k):
+        """
+        Returns [username, popularity] pairs for the `k` most popular teachers.
+        """
+        scale = 1 / decay_factor(time.time())
+        with self._lock:
+            return [[owner, score * scale] for owner, score in self._teachers.top(k)]
+
+    def flush(self):
+        """
+        Saves recorded events to the database and reloads the boards from it.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            with connection() as conn:
+                conn.executemany('''
+                    INSERT INTO course_popularity (course_id, score) VALUES (?, ?)
+                    ON CONFLICT(course_id) DO UPDATE SET score = score + excluded.score
+                ''', pending.items())
+                conn.commit()
+        except BaseException:
+            with self._lock:
+                for course_id, delta in pending.items():
+                    self._pending[course_id] = self._pending.get(course_id, 0.0) + delta
+            raise
+        self.load()
+
+    def load(self):
+        """
+        Replaces the boards with the saved scores plus events not saved yet.
+        """
+        with connection() as conn:
+            rows = conn.execute('''
+                SELECT c.id, c.owner, COALESCE(p.score, 0) FROM courses c
+                LEFT JOIN course_popularity p ON p.course_id = c.id
+            ''').fetchall()
+        with self._lock:
+            courses = {course_id: score + self._pending.get(course_id, 0.0) for course_id, _, score in rows}
+            owners = {course_id: owner for course_id, owner, _ in rows}
+            teachers = {}
+            for course_id, score in courses.items():
+                teachers[owners[course_id]] = teachers.get(owners[course_id], 0.0) + score
+            self._courses = Leaderboard(courses)
+            self._teachers = Leaderboard(teachers)
+            self._owners = owners
+            self.loaded = True
+
+
+def rebuild_popularity(commit=True):
+    """
+    Recomputes course_popularity from enrolments, likes and ratings, each at the
+    time it happened. Returns the number of courses.
+    """
+    now = time.time()
+    with connection() as conn:
+        scores = {}
+        for course_id, enrolled_at in conn.execute('SELECT course_id, enrolled_at FROM course_students'):
+            scores[course_id] = scores.get(course_id, 0.0) + WEIGHTS['enroll'] * decay_factor(enrolled_at or now)
+        for course_id, liked_at in conn.execute('SELECT course_id, liked_at FROM course_likes'):
+            scores[course_id] = scores.get(course_id, 0.0) + WEIGHTS['like'] * decay_factor(liked_at or now)
+        for course_id, star, submitted in conn.execute("SELECT course_id, star, strftime('%s', date_submitted) FROM rating"):
+            at = float(submitted) if submitted else now
+            scores[course_id] = scores.get(course_id, 0.0) + WEIGHTS['rating'] * (star - 3) * decay_factor(at)
+        conn.execute('DELETE FROM course_popularity')
+        conn.executemany('INSERT INTO course_popularity (course_id, score) VALUES (?, ?)', scores.items())
+        if commit:
+            conn.commit()
+    return len(scores)
+
+
+popularity = PopularityTracker()
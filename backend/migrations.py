@@ -0,0 +1,863 @@
+"""
+Forward-only schema migrations.
+
+The schema version is stored in `PRAGMA user_version`. Each migration runs in its
+own transaction and bumps the version when it commits, so a failed migration
+leaves the database at the previous version. Migrations are never edited or
+removed once shipped; add a new one at the end of MIGRATIONS instead.
+
+Migrations only use `cursor` and hold their own SQL and constants: a migration
+calling application code would change whenever that code changes, and helpers
+that commit would split its transaction.
+"""
+
+import logging
+import time
+
+from dbpool import connection
+
+logger = logging.getLogger(__name__)
+
+
+def baseline(cursor):
+    """
+    The tables as created by the original init_db. They use IF NOT EXISTS, so
+    databases created before migrations existed are adopted as-is.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            role TEXT NOT NULL DEFAULT 'student'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS add_teacher_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT NOT NULL,
+            UNIQUE(username, email),
+            FOREIGN KEY(username) REFERENCES users(username),
+            FOREIGN KEY(email) REFERENCES users(email)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            receiver TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            read INTEGER NOT NULL DEFAULT 0,
+            type TEXT NOT NULL DEFAULT 'message', -- message, request
+            priority INTEGER NOT NULL DEFAULT 0, -- 0: normal, 1: high
+            FOREIGN KEY(sender) REFERENCES users(username),
+            FOREIGN KEY(receiver) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            category TEXT,
+            type TEXT NOT NULL DEFAULT 'open', -- open, ongoing, closed
+            FOREIGN KEY(owner) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_likes (
+            course_id INTEGER NOT NULL,
+            student TEXT NOT NULL,
+            FOREIGN KEY(course_id) REFERENCES courses(id),
+            FOREIGN KEY(student) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chapters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            type TEXT NOT NULL DEFAULT 'teaching', -- teaching, homework, project
+            course_id INTEGER NOT NULL,
+            published INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY(course_id) REFERENCES courses(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_students (
+            course_id INTEGER NOT NULL,
+            student TEXT NOT NULL,
+            FOREIGN KEY(course_id) REFERENCES courses(id),
+            FOREIGN KEY(student) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courseware (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            chapter_id INTEGER NOT NULL,
+            FOREIGN KEY(chapter_id) REFERENCES chapters(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            student TEXT NOT NULL,
+            comment TEXT NOT NULL,
+            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(course_id) REFERENCES courses(id),
+            FOREIGN KEY(student) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_progress (
+            chapter_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (chapter_id, username),
+            FOREIGN KEY(chapter_id) REFERENCES chapters(id),
+            FOREIGN KEY(username) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS hwpj (
+            chapter_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            FOREIGN KEY(chapter_id) REFERENCES chapters(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS join_course_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(student) REFERENCES users(username),
+            FOREIGN KEY(course_id) REFERENCES courses(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS add_course_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            description TEXT NOT NULL,
+            category TEXT,
+            FOREIGN KEY(owner) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            sender_name TEXT NOT NULL,
+            content TEXT NOT NULL,
+            likes INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(course_id) REFERENCES courses(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id INTEGER NOT NULL,
+            floor INTEGER NOT NULL,
+            commenter_name TEXT NOT NULL,
+            comment_content TEXT NOT NULL,
+            likes INTEGER NOT NULL DEFAULT 0,
+            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(post_id) REFERENCES posts(id),
+            FOREIGN KEY(commenter_name) REFERENCES users(username)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rating (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            sender_name TEXT NOT NULL,
+            star INTEGER NOT NULL CHECK (star >= 1 AND star <= 5),
+            difficulty TEXT NOT NULL,
+            workload TEXT NOT NULL,
+            grading TEXT NOT NULL,
+            gain TEXT NOT NULL,
+            comment TEXT NOT NULL,
+            date_submitted TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(course_id) REFERENCES courses(id),
+            FOREIGN KEY(sender_name) REFERENCES users(username)
+        )
+    ''')
+
+
+def rename_inbox_to_messages(cursor):
+    """
+    Every handler reads and writes `messages`; the table was created as `inbox`.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'messages'")
+    if not cursor.fetchone():
+        cursor.execute('ALTER TABLE inbox RENAME TO messages')
+
+
+def index_pack(cursor):
+    """
+    Secondary indexes for the lookups the handlers issue on every request.
+
+    Enrollment and like rows are de-duplicated before their UNIQUE indexes are
+    created; the likes handler already treats a second like as an unlike.
+    """
+    for table in ('course_students', 'course_likes'):
+        cursor.execute(f'''
+            DELETE FROM {table} WHERE rowid NOT IN (
+                SELECT MIN(rowid) FROM {table} GROUP BY course_id, student
+            )
+        ''')
+
+    statements = [
+        # roster, enrollment checks, likes count/check (course_id, student)
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_course_students_course_student ON course_students(course_id, student)',
+        # "my courses" for a student: JOIN course_students ON ... WHERE student = ?
+        'CREATE INDEX IF NOT EXISTS idx_course_students_student_course ON course_students(student, course_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_course_likes_course_student ON course_likes(course_id, student)',
+        # "my courses" for a teacher
+        'CREATE INDEX IF NOT EXISTS idx_courses_owner ON courses(owner)',
+        # chapter list of a course and the progress sub-select
+        'CREATE INDEX IF NOT EXISTS idx_chapters_course ON chapters(course_id)',
+        # courseware/submission listing by chapter, delete/update by (chapter_id, filename)
+        'CREATE INDEX IF NOT EXISTS idx_courseware_chapter_filename ON courseware(chapter_id, filename)',
+        'CREATE INDEX IF NOT EXISTS idx_hwpj_chapter_filename ON hwpj(chapter_id, filename)',
+        # per-course average rating is answered from the index alone
+        'CREATE INDEX IF NOT EXISTS idx_rating_course_star ON rating(course_id, star)',
+        'CREATE INDEX IF NOT EXISTS idx_course_comments_course ON course_comments(course_id)',
+        'CREATE INDEX IF NOT EXISTS idx_post_comments_post_floor ON post_comments(post_id, floor)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_tag ON posts(tag)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_course ON posts(course_id)',
+        # inbox listing: WHERE receiver = ? ORDER BY priority DESC, timestamp DESC
+        'CREATE INDEX IF NOT EXISTS idx_messages_receiver_priority_timestamp ON messages(receiver, priority DESC, timestamp DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_join_course_requests_course_student ON join_course_requests(course_id, student)',
+        'CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)',
+    ]
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def course_stats(cursor):
+    """
+    Per-course rating count, sum, average and star histogram, kept up to date by
+    the rating write paths so the catalog never aggregates the rating table.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_stats (
+            course_id INTEGER PRIMARY KEY,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_avg REAL NOT NULL DEFAULT 0,
+            star_1 INTEGER NOT NULL DEFAULT 0,
+            star_2 INTEGER NOT NULL DEFAULT 0,
+            star_3 INTEGER NOT NULL DEFAULT 0,
+            star_4 INTEGER NOT NULL DEFAULT 0,
+            star_5 INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(course_id) REFERENCES courses(id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO course_stats (course_id, rating_count, rating_sum, rating_avg,
+                                             star_1, star_2, star_3, star_4, star_5)
+        SELECT course_id, COUNT(*), SUM(star), AVG(star),
+               SUM(star = 1), SUM(star = 2), SUM(star = 3), SUM(star = 4), SUM(star = 5)
+        FROM rating
+        GROUP BY course_id
+    ''')
+
+
+def sessions(cursor):
+    """
+    Login sessions shared by every server process (see sessions.SQLiteSessionBackend).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            username TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            expires REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires)')
+
+
+def courseware_versions(cursor):
+    """
+    Content-addressed courseware storage (see blobstore.py): one row per stored
+    blob with its reference count, and one row per uploaded courseware version.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courseware_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chapter_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            content_type TEXT,
+            uploaded_by TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(chapter_id, filename, version),
+            FOREIGN KEY(chapter_id) REFERENCES chapters(id),
+            FOREIGN KEY(sha256) REFERENCES blobs(sha256)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_courseware_versions_sha256 ON courseware_versions(sha256)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_blobs_refcount ON blobs(refcount)')
+
+
+def courseware_visibility(cursor):
+    """
+    The visibility flags the courseware handlers already read and write. Files
+    stay visible by default, which is how they behaved while the columns were
+    missing.
+    """
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(courseware)')]
+    for column in ('is_visible', 'is_downloadable'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE courseware ADD COLUMN {column} INTEGER NOT NULL DEFAULT 1')
+
+
+def email_outbox(cursor):
+    """
+    Emails waiting to be delivered by the background sender (components/sendEmail.py).
+    Times are Unix timestamps.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receiver TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            sent_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_status_next ON email_outbox(status, next_attempt_at)')
+
+
+def user_recommendations(cursor):
+    """
+    Recommendations precomputed for every user with enrolments or likes by
+    `database.py recommend-users` (see recommender.compute_user_recommendations).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_recommendations (
+            username TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            computed_at REAL NOT NULL,
+            PRIMARY KEY(username, rank)
+        ) WITHOUT ROWID
+    ''')
+
+
+def course_popularity(cursor):
+    """
+    Decayed popularity sums per course (see leaderboard.py), seeded from the
+    existing enrolments, likes and ratings. Enrolments and likes carry no date
+    and count as of now.
+    """
+    # leaderboard.EPOCH, HALF_LIFE and WEIGHTS when this migration was written.
+    epoch, half_life = 1704067200, 14 * 24 * 3600
+    enroll, like, rating = 3.0, 1.0, 1.0
+    now = time.time()
+
+    def decay_factor(at):
+        return 2.0 ** ((at - epoch) / half_life)
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_popularity (
+            course_id INTEGER PRIMARY KEY,
+            score REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(course_id) REFERENCES courses(id)
+        )
+    ''')
+    scores = {}
+    for course_id, count in cursor.execute('SELECT course_id, COUNT(*) FROM course_students GROUP BY course_id').fetchall():
+        scores[course_id] = scores.get(course_id, 0.0) + enroll * count * decay_factor(now)
+    for course_id, count in cursor.execute('SELECT course_id, COUNT(*) FROM course_likes GROUP BY course_id').fetchall():
+        scores[course_id] = scores.get(course_id, 0.0) + like * count * decay_factor(now)
+    for course_id, star, submitted in cursor.execute(
+            "SELECT course_id, star, strftime('%s', date_submitted) FROM rating").fetchall():
+        at = float(submitted) if submitted else now
+        scores[course_id] = scores.get(course_id, 0.0) + rating * (star - 3) * decay_factor(at)
+    cursor.executemany('INSERT OR REPLACE INTO course_popularity (course_id, score) VALUES (?, ?)', scores.items())
+
+
+def inbox_unread(cursor):
+    """
+    Keyset pagination and unread counts for the inbox.
+
+    The inbox index gains `id` as the final sort key, so a page can start right
+    after the (priority, timestamp, id) of the previous page's last message.
+    `inbox_unread` holds each user's number of unread messages; triggers keep it
+    in step with every insert, read-status change and delete on `messages`.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_receiver_priority_timestamp')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_receiver_order
+        ON messages(receiver, priority DESC, timestamp DESC, id DESC)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inbox_unread (
+            username TEXT PRIMARY KEY,
+            unread INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO inbox_unread (username, unread)
+        SELECT receiver, COUNT(*) FROM messages WHERE read = 0 GROUP BY receiver
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_unread_insert AFTER INSERT ON messages WHEN NEW.read = 0
+        BEGIN
+            INSERT INTO inbox_unread (username, unread) VALUES (NEW.receiver, 1)
+            ON CONFLICT(username) DO UPDATE SET unread = unread + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_unread_update AFTER UPDATE OF read, receiver ON messages
+        WHEN (OLD.read = 0) != (NEW.read = 0) OR OLD.receiver != NEW.receiver
+        BEGIN
+            UPDATE inbox_unread SET unread = unread - 1 WHERE username = OLD.receiver AND OLD.read = 0;
+            INSERT INTO inbox_unread (username, unread) SELECT NEW.receiver, 1 WHERE NEW.read = 0
+            ON CONFLICT(username) DO UPDATE SET unread = unread + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_unread_delete AFTER DELETE ON messages WHEN OLD.read = 0
+        BEGIN
+            UPDATE inbox_unread SET unread = unread - 1 WHERE username = OLD.receiver;
+        END
+    ''')
+
+
+def course_broadcasts(cursor):
+    """
+    Course notifications stored once per course instead of once per student.
+    Students see the broadcasts of the courses they are enrolled in, and
+    `course_broadcast_reads` records which ones each of them has read.
+
+    Existing per-student course notifications are converted when their
+    receivers are exactly the current students of one course of the sender.
+    The others stay in `messages`, so nobody gains or loses a notification.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            sender TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            type TEXT NOT NULL DEFAULT 'course',
+            priority INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(course_id) REFERENCES courses(id),
+            FOREIGN KEY(sender) REFERENCES users(username)
+        )
+    ''')
+    # The inbox order within a course; -id is the inbox id of a broadcast.
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_course_broadcasts_course_order
+        ON course_broadcasts(course_id, priority DESC, timestamp DESC, id)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_broadcast_reads (
+            username TEXT NOT NULL,
+            broadcast_id INTEGER NOT NULL,
+            PRIMARY KEY(username, broadcast_id)
+        ) WITHOUT ROWID
+    ''')
+
+    rosters = {}
+    for course_id, owner, student in cursor.execute('''
+        SELECT c.id, c.owner, cs.student FROM courses c JOIN course_students cs ON cs.course_id = c.id
+    ''').fetchall():
+        rosters.setdefault(owner, {}).setdefault(course_id, set()).add(student)
+    notifications = {}
+    for message_id, sender, receiver, subject, body, timestamp, read, priority in cursor.execute('''
+        SELECT id, sender, receiver, subject, body, timestamp, read, priority FROM messages
+        WHERE type = 'course' ORDER BY id
+    ''').fetchall():
+        notifications.setdefault((sender, subject, body, timestamp, priority), []).append((message_id, receiver, read))
+    for (sender, subject, body, timestamp, priority), copies in notifications.items():
+        receivers = {receiver for _, receiver, _ in copies}
+        courses = [course_id for course_id, students in rosters.get(sender, {}).items() if students == receivers]
+        if len(receivers) != len(copies) or len(courses) != 1:
+            continue
+        cursor.execute('''
+            INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp, type, priority)
+            VALUES (?, ?, ?, ?, ?, 'course', ?)
+        ''', (courses[0], sender, subject, body, timestamp, priority))
+        broadcast_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO course_broadcast_reads (username, broadcast_id) VALUES (?, ?)
+        ''', [(receiver, broadcast_id) for _, receiver, read in copies if read])
+        # The inbox_unread triggers discount the deleted unread copies.
+        cursor.executemany('DELETE FROM messages WHERE id = ?', [(message_id,) for message_id, _, _ in copies])
+
+
+def post_feed(cursor):
+    """
+    Keyset pagination of the post feed, newest first, with or without course and
+    tag filters: one index per combination, each ending in (date_submitted, id).
+    They replace the single-column course and tag indexes.
+
+    `cache_versions` holds a counter per cached data set, bumped by triggers on
+    every change, so all server processes can tell whether a cached page or an
+    ETag is still current with one primary-key lookup.
+    """
+    cursor.execute('DROP INDEX IF EXISTS idx_posts_tag')
+    cursor.execute('DROP INDEX IF EXISTS idx_posts_course')
+    for name, columns in [('idx_posts_date', 'date_submitted, id'),
+                          ('idx_posts_course_date', 'course_id, date_submitted, id'),
+                          ('idx_posts_tag_date', 'tag, date_submitted, id'),
+                          ('idx_posts_course_tag_date', 'course_id, tag, date_submitted, id')]:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON posts({columns})')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('posts', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS posts_version_{event.lower()} AFTER {event} ON posts
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'posts';
+            END
+        ''')
+
+
+def post_search(cursor):
+    """
+    Full-text indexes over posts and replies (see search.py), built from the
+    existing rows. Replies are the comments past floor 1; the `post_replies` view
+    is the content table of their index.
+
+    Each index is kept in step by triggers on its base table: an external-content
+    FTS5 table must be told the old text of a row to remove it from the index.
+    """
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS post_replies AS
+        SELECT id, post_id, floor, comment_content FROM post_comments WHERE floor > 1
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            title, content, content='posts', content_rowid='id', tokenize='porter unicode61', prefix='2 3 4'
+        )
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS post_replies_fts USING fts5(
+            comment_content, content='post_replies', content_rowid='id', tokenize='porter unicode61', prefix='2 3 4'
+        )
+    ''')
+    # bm25 weights per column: a match in a post's title counts five times one in its body.
+    cursor.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(5.0, 1.0)')")
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts
+        BEGIN
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts
+        BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_replies_fts_insert AFTER INSERT ON post_comments
+        WHEN new.floor > 1
+        BEGIN
+            INSERT INTO post_replies_fts (rowid, comment_content) VALUES (new.id, new.comment_content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_replies_fts_delete AFTER DELETE ON post_comments
+        WHEN old.floor > 1
+        BEGIN
+            INSERT INTO post_replies_fts (post_replies_fts, rowid, comment_content)
+            VALUES ('delete', old.id, old.comment_content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS post_replies_fts_update AFTER UPDATE OF floor, comment_content ON post_comments
+        BEGIN
+            INSERT INTO post_replies_fts (post_replies_fts, rowid, comment_content)
+            SELECT 'delete', old.id, old.comment_content WHERE old.floor > 1;
+            INSERT INTO post_replies_fts (rowid, comment_content)
+            SELECT new.id, new.comment_content WHERE new.floor > 1;
+        END
+    ''')
+    cursor.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO post_replies_fts (post_replies_fts) VALUES ('rebuild')")
+
+
+def user_search(cursor):
+    """
+    Typeahead search over usernames (see database.search_users): a case-insensitive
+    index per role for prefix matches, and an FTS5 trigram index for matches
+    anywhere in the name, built from the existing users and kept in step by triggers.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role_username ON users(role, username COLLATE NOCASE)')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, content='users', content_rowid='id', tokenize='trigram'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+            INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+        END
+    ''')
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def course_search(cursor):
+    """
+    Full-text index over the course catalog (see search.py), built from the
+    existing courses and kept in step by triggers, and an index on (category,
+    type) for the facet counts of the whole catalog.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_courses_category_type ON courses(category, type)')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+            title, description, category, content='courses', content_rowid='id',
+            tokenize='porter unicode61', prefix='2 3'
+        )
+    ''')
+    # bm25 weights per column: title, description, category.
+    cursor.execute("INSERT INTO courses_fts (courses_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 3.0)')")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS courses_fts_insert AFTER INSERT ON courses
+        BEGIN
+            INSERT INTO courses_fts (rowid, title, description, category)
+            VALUES (new.id, new.title, new.description, new.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS courses_fts_delete AFTER DELETE ON courses
+        BEGIN
+            INSERT INTO courses_fts (courses_fts, rowid, title, description, category)
+            VALUES ('delete', old.id, old.title, old.description, old.category);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS courses_fts_update AFTER UPDATE OF title, description, category ON courses
+        BEGIN
+            INSERT INTO courses_fts (courses_fts, rowid, title, description, category)
+            VALUES ('delete', old.id, old.title, old.description, old.category);
+            INSERT INTO courses_fts (rowid, title, description, category)
+            VALUES (new.id, new.title, new.description, new.category);
+        END
+    ''')
+    cursor.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+
+
+def watch_sessions(cursor):
+    """
+    Seconds each user has watched of each chapter's video, written behind by the
+    anti-cheat tracker (see watchtracker.py).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watch_sessions (
+            username TEXT NOT NULL,
+            chapter_id INTEGER NOT NULL,
+            watched REAL NOT NULL DEFAULT 0,
+            last_watched TIMESTAMP,
+            PRIMARY KEY(username, chapter_id),
+            FOREIGN KEY(chapter_id) REFERENCES chapters(id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def popularity_event_times(cursor):
+    """
+    When each enrolment and like happened, so removing one retracts the weight it
+    was counted with (see leaderboard.py). Triggers stamp new rows with the
+    current Unix time; existing rows count as of now, as course_popularity did.
+    """
+    now = time.time()
+    for table, column in (('course_students', 'enrolled_at'), ('course_likes', 'liked_at')):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} REAL')
+        cursor.execute(f'UPDATE {table} SET {column} = ?', (now,))
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_{column} AFTER INSERT ON {table} WHEN NEW.{column} IS NULL
+            BEGIN
+                UPDATE {table} SET {column} = (julianday('now') - 2440587.5) * 86400.0 WHERE rowid = NEW.rowid;
+            END
+        ''')
+
+
+def broadcast_counts(cursor):
+    """
+    Counters for the unread course broadcasts, so neither sending nor counting
+    them touches a row per student.
+
+    `course_broadcast_counts` holds each course's number of broadcasts and
+    `course_broadcast_read_counts` how many of them each user has read. A
+    user's unread broadcasts are the sum over their courses of the difference,
+    one lookup per enrolled course. Triggers keep both in step with inserts and
+    deletes; deleting a broadcast deletes its reads first.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_broadcast_counts (
+            course_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_broadcast_read_counts (
+            username TEXT NOT NULL,
+            course_id INTEGER NOT NULL,
+            reads INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(username, course_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_course_broadcast_reads_broadcast ON course_broadcast_reads(broadcast_id)
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO course_broadcast_counts (course_id, total)
+        SELECT course_id, COUNT(*) FROM course_broadcasts GROUP BY course_id
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO course_broadcast_read_counts (username, course_id, reads)
+        SELECT r.username, b.course_id, COUNT(*) FROM course_broadcast_reads r
+        JOIN course_broadcasts b ON b.id = r.broadcast_id
+        GROUP BY r.username, b.course_id
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS course_broadcasts_count_insert AFTER INSERT ON course_broadcasts
+        BEGIN
+            INSERT INTO course_broadcast_counts (course_id, total) VALUES (NEW.course_id, 1)
+            ON CONFLICT(course_id) DO UPDATE SET total = total + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS course_broadcasts_count_delete BEFORE DELETE ON course_broadcasts
+        BEGIN
+            DELETE FROM course_broadcast_reads WHERE broadcast_id = OLD.id;
+            UPDATE course_broadcast_counts SET total = total - 1 WHERE course_id = OLD.course_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS course_broadcast_reads_count_insert AFTER INSERT ON course_broadcast_reads
+        BEGIN
+            INSERT INTO course_broadcast_read_counts (username, course_id, reads)
+            SELECT NEW.username, course_id, 1 FROM course_broadcasts WHERE id = NEW.broadcast_id
+            ON CONFLICT(username, course_id) DO UPDATE SET reads = reads + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS course_broadcast_reads_count_delete AFTER DELETE ON course_broadcast_reads
+        BEGIN
+            UPDATE course_broadcast_read_counts SET reads = reads - 1
+            WHERE username = OLD.username AND course_id = (SELECT course_id FROM course_broadcasts WHERE id = OLD.broadcast_id);
+        END
+    ''')
+
+
+# (version, name, function) in application order.
+MIGRATIONS = [
+    (1, 'baseline', baseline),
+    (2, 'rename_inbox_to_messages', rename_inbox_to_messages),
+    (3, 'index_pack', index_pack),
+    (4, 'course_stats', course_stats),
+    (5, 'sessions', sessions),
+    (6, 'courseware_versions', courseware_versions),
+    (7, 'courseware_visibility', courseware_visibility),
+    (8, 'email_outbox', email_outbox),
+    (9, 'user_recommendations', user_recommendations),
+    (10, 'course_popularity', course_popularity),
+    (11, 'inbox_unread', inbox_unread),
+    (12, 'course_broadcasts', course_broadcasts),
+    (13, 'post_feed', post_feed),
+    (14, 'post_search', post_search),
+    (15, 'user_search', user_search),
+    (16, 'course_search', course_search),
+    (17, 'watch_sessions', watch_sessions),
+    (18, 'popularity_event_times', popularity_event_times),
+    (19, 'broadcast_counts', broadcast_counts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version():
+    with connection() as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate():
+    """
+    Applies every migration newer than the database's version.
+
+    Returns the version the database was at before migrating (0 for a new database).
+    """
+    start = get_version()
+    if start > LATEST_VERSION:
+        raise RuntimeError(f'Database schema version {start} is newer than this server ({LATEST_VERSION}).')
+
+    with connection() as conn:
+        for version, name, apply in MIGRATIONS:
+            if version <= get_version():
+                continue
+            logger.info('Applying migration %d: %s', version, name)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                apply(cursor)
+                cursor.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    return start
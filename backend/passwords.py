@@ -0,0 +1,212 @@
+"""
+Password hashing and login admission control.
+
+bcrypt is slow on purpose (a few hundred milliseconds per hash), so hashing
+and checking passwords run in a small pool of worker processes, at a lower
+CPU priority than the server. At most `workers` run at once; the others wait
+in a queue, and once `max_queue` are waiting new ones are turned away
+(HasherBusy) rather than queued for ever. A burst of logins thus takes
+longer, but neither the IOLoop nor the database threads wait for it.
+
+Login attempts are throttled by token buckets: one per client IP, which
+bounds how much hashing one host can ask for, and one per username, which
+slows down password guessing. Both are configured in the [login] section of
+config.toml (see configure()).
+
+PasswordHasher and LoginThrottle are not thread-safe; use them from the
+IOLoop thread.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+import tornado.locks
+
+_dummy_hash = None
+
+
+def _lower_priority(increment):
+    os.nice(increment)
+
+
+def _hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+
+def _check_password(password, password_hash):
+    global _dummy_hash
+    if password_hash is None:
+        # Unknown user: spend the same time, so response times do not tell which usernames exist.
+        if _dummy_hash is None:
+            _dummy_hash = bcrypt.hashpw(b'', bcrypt.gensalt())
+        bcrypt.checkpw(password.encode('utf-8'), _dummy_hash)
+        return False
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+
+
+class HasherBusy(Exception):
+    """
+    Raised when `max_queue` password operations are already waiting.
+    """
+
+
+class PasswordHasher:
+    def __init__(self, workers=1, max_queue=200, nice=5):
+        self._executor = None
+        self.configure({'workers': workers, 'max_queue': max_queue, 'nice': nice})
+
+    def configure(self, settings):
+        """
+        Applies the hashing settings of the [login] section:
+
+            workers = 1       # worker processes
+            max_queue = 200   # operations allowed to wait for a worker
+            nice = 5          # how much lower the workers' CPU priority is
+        """
+        self.shutdown()
+        self.workers = settings.get('workers', 1)
+        self.max_queue = settings.get('max_queue', 200)
+        self.nice = settings.get('nice', 5)
+        self._slots = tornado.locks.Semaphore(self.workers)
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+
+    def start(self):
+        """
+        Starts the worker processes, so the first logins do not wait for them.
+        """
+        if self._executor is None:
+            # Spawned, not forked: the server has threads by the time it hashes.
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_lower_priority, initargs=(self.nice,))
+            for _ in range(self.workers):
+                self._executor.submit(os.getpid)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusy()
+        self.queued += 1
+        queued_at = time.monotonic()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.wait_time += time.monotonic() - queued_at
+        self.running += 1
+        try:
+            return await asyncio.wrap_future(self.start().submit(fn, *args))
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+
+    async def hash(self, password):
+        return await self._run(_hash_password, password)
+
+    async def verify(self, password, password_hash):
+        """
+        Checks `password` against a stored hash. A missing hash (unknown user)
+        takes as long and returns False.
+        """
+        return await self._run(_check_password, password, password_hash)
+
+    def metrics(self):
+        return {'workers': self.workers, 'running': self.running, 'queued': self.queued,
+                'max_queue': self.max_queue, 'completed': self.completed, 'rejected': self.rejected,
+                'mean_wait_ms': self.wait_time / self.completed * 1000 if self.completed else 0.0}
+
+
+class TokenBuckets:
+    """
+    A token bucket per key: `burst` tokens at most, refilled at `rate` per second.
+    Only the `max_keys` most recently used keys are kept; a forgotten key starts
+    again with a full bucket.
+    """
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        """
+        Takes a token from `key`'s bucket. Returns 0 if there was one, or else
+        the number of seconds until there will be.
+        """
+        now = self.clock()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class LoginThrottle:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.configure({})
+
+    def configure(self, settings):
+        """
+        Applies the throttling settings of the [login] section:
+
+            ip_rate = 5.0      # attempts per second per client IP...
+            ip_burst = 100     # ...after a burst of this many (a classroom may share one IP)
+            user_rate = 0.1    # attempts per second per username...
+            user_burst = 5     # ...after a burst of this many
+        """
+        self.by_ip = TokenBuckets(settings.get('ip_rate', 5.0), settings.get('ip_burst', 100), clock=self.clock)
+        self.by_username = TokenBuckets(settings.get('user_rate', 0.1), settings.get('user_burst', 5), clock=self.clock)
+        self.throttled = 0
+
+    def check(self, ip, username=None):
+        """
+        Counts an attempt from `ip` (for `username`, if given). Returns 0 if it may
+        go ahead, or else the number of seconds to wait.
+        """
+        wait = self.by_ip.take(ip)
+        if not wait and username is not None:
+            wait = self.by_username.take(username)
+        if wait:
+            self.throttled += 1
+        return wait
+
+    def metrics(self):
+        return {'ips': len(self.by_ip), 'usernames': len(self.by_username), 'throttled': self.throttled}
+
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+
+
+def configure(settings):
+    """
+    Applies the [login] section of config.toml.
+    """
+    password_hasher.configure(settings)
+    login_throttle.configure(settings)
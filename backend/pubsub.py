@@ -0,0 +1,109 @@
+"""
+In-process publish/subscribe for pushing events to open connections.
+
+A Hub maps keys (e.g. usernames) to subscriptions; each open WebSocket or
+event-stream connection holds one. Publishing never waits for a consumer: an
+event is appended to each subscriber's queue, and a subscriber that lets its
+queue fill up is cut off, so one stalled client cannot make the server buffer
+without bound. A cut-off client reconnects and catches up from the database.
+
+Hubs and subscriptions are not thread-safe; use them from the IOLoop thread.
+"""
+
+import datetime
+from collections import deque
+
+import tornado.locks
+import tornado.util
+
+
+class QueueOverflow(Exception):
+    """
+    Raised by Subscription.get() once the consumer fell `max_queue` events behind.
+    """
+
+
+class Subscription:
+    def __init__(self, hub, key, max_queue):
+        self.hub = hub
+        self.key = key
+        self.max_queue = max_queue
+        self.overflowed = False
+        self.closed = False
+        self._events = deque()
+        self._ready = tornado.locks.Event()
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        if len(self._events) >= self.max_queue:
+            self.overflowed = True
+            self._events.clear()
+            self.hub.overflows += 1
+        else:
+            self._events.append(event)
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """
+        Waits for events and returns all of those queued, oldest first. Returns an
+        empty list if `timeout` seconds pass first, or once the subscription is closed.
+        """
+        try:
+            await self._ready.wait(None if timeout is None else datetime.timedelta(seconds=timeout))
+        except tornado.util.TimeoutError:
+            return []
+        self._ready.clear()
+        if self.overflowed:
+            raise QueueOverflow()
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+        self._ready.set()
+
+
+class Hub:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscriptions = {}
+        self.published = 0
+        self.overflows = 0
+
+    def __len__(self):
+        """
+        Returns the number of subscriptions.
+        """
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, key):
+        subscription = Subscription(self, key, self.max_queue)
+        self._subscriptions.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.key]
+
+    def has_subscribers(self, key=None):
+        return bool(self._subscriptions) if key is None else key in self._subscriptions
+
+    def publish(self, key, event):
+        """
+        Queues `event` for every subscriber of `key`. Returns the number of subscribers.
+        """
+        subscriptions = self._subscriptions.get(key, ())
+        for subscription in subscriptions:
+            subscription.put(event)
+        self.published += 1
+        return len(subscriptions)
+
+    def metrics(self):
+        return {'subscriptions': len(self), 'keys': len(self._subscriptions),
+                'published': self.published, 'overflows': self.overflows}
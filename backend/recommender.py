@@ -1,50 +1,426 @@
-import sqlite3
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-from database import DATABASE
-
-model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-connct = sqlite3.connect(DATABASE)
-query = "SELECT id, title, description FROM courses"
-courses_df = pd.read_sql(query, connct)
-descriptions = courses_df['description'].tolist()
-course_embeddings = model.encode(descriptions)
-courses_df['embedding'] = list(course_embeddings)
-interaction_query = """
-    SELECT course_students.course_id, course_students.student, 1 AS enrolled, 0 AS liked
-    FROM course_students
-    UNION
-    SELECT course_likes.course_id, course_likes.student, 0 AS enrolled, 1 AS liked
-    FROM course_likes;
 """
-user_course_data = pd.read_sql(interaction_query, connct)
-connct.close()
+Course recommendations.
 
+A course is scored for a user by its similarity to the courses the user is
+enrolled in or liked, mixing two similarities:
 
-user_course_matrix = user_course_data.pivot_table(index='student', columns='course_id', values=['enrolled', 'liked'], fill_value=0)
-user_course_matrix.columns = ['_'.join(map(str, col)) for col in user_course_matrix.columns]
-course_similarity_collab = cosine_similarity(user_course_matrix.T)
-course_similarity_content = cosine_similarity(course_embeddings)
+- content: cosine similarity of sentence embeddings of the course descriptions;
+- collaborative: cosine similarity of the courses' enrolments and likes, kept
+  as a sparse matrix of each course's nearest neighbours.
+
+Nothing is loaded at import time. RecommenderService loads its data on first
+use; after that, requests only read the last snapshot, and the server reloads
+it in the background every `refresh_interval` seconds (see start()).
+
+Embeddings are persisted in files/recommender: embeddings.npy holds one row per
+course and is memory-mapped, so loading costs next to nothing; embeddings.json
+maps each course id to its row and the SHA-256 of the description it was
+computed from. A refresh only encodes courses that are new or whose description
+changed, and the model is only loaded when there is something to encode. The two
+files are read and written under a lock on the directory (see EmbeddingStore).
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+
+from dbpool import connection
+
+MODEL_NAME = 'paraphrase-MiniLM-L6-v2'
+EMBEDDING_DIR = 'files/recommender'
+
+
+def description_hash(description):
+    return hashlib.sha256((description or '').encode('utf-8')).hexdigest()
+
+
+def _write_atomically(path, write):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class EmbeddingStore:
+    """
+    Course embeddings on disk. Several processes may share the directory: update()
+    reads and replaces both files under an exclusive flock on `.lock` in the
+    directory, and load() holds a shared one, so nobody pairs the index of one
+    refresh with the matrix of another. Every refresh starts from what is on disk.
+    """
+    def __init__(self, directory=EMBEDDING_DIR, model_name=MODEL_NAME):
+        self.directory = directory
+        self.model_name = model_name
+        self._model = None
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'embeddings.json')
+
+    @property
+    def matrix_path(self):
+        return os.path.join(self.directory, 'embeddings.npy')
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self):
+        """
+        Returns ({course_id: (row, description hash)}, memory-mapped matrix), or
+        ({}, None) if nothing is stored for the current model.
+        """
+        with self._locked(fcntl.LOCK_SH):
+            return self._load()
+
+    def _load(self):
+        import numpy as np
+
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return {}, None
+        if index.get('model') != self.model_name:
+            return {}, None
+        return {int(course_id): tuple(entry) for course_id, entry in index['courses'].items()}, matrix
+
+    def update(self, descriptions):
+        """
+        Brings the stored embeddings in line with {course_id: description}, encoding
+        only new and changed descriptions. Returns (course ids, matrix with one
+        normalized row per id, ids of the courses encoded).
+
+        Holds the directory lock throughout, so a second process waits and then
+        finds the embeddings this one wrote instead of encoding them again.
+        """
+        with self._locked(fcntl.LOCK_EX):
+            return self._update(descriptions)
+
+    def _update(self, descriptions):
+        import numpy as np
+
+        index, matrix = self._load()
+        hashes = {course_id: description_hash(text) for course_id, text in descriptions.items()}
+        course_ids = sorted(descriptions)
+        stale = [course_id for course_id in course_ids
+                 if course_id not in index or index[course_id][1] != hashes[course_id]]
+        if not stale and len(index) == len(course_ids):
+            rows = [index[course_id][0] for course_id in course_ids]
+            if rows == list(range(len(rows))):
+                return course_ids, matrix, []
+
+        encoded = self._encode([descriptions[course_id] or '' for course_id in stale]) if stale else None
+        dim = encoded.shape[1] if encoded is not None else matrix.shape[1]
+        updated = np.empty((len(course_ids), dim), dtype=np.float32)
+        fresh = {course_id: i for i, course_id in enumerate(stale)}
+        for row, course_id in enumerate(course_ids):
+            if course_id in fresh:
+                updated[row] = encoded[fresh[course_id]]
+            else:
+                updated[row] = matrix[index[course_id][0]]
+
+        _write_atomically(self.matrix_path, lambda f: np.save(f, updated))
+        _write_atomically(self.index_path, lambda f: f.write(json.dumps({
+            'model': self.model_name,
+            'courses': {course_id: [row, hashes[course_id]] for row, course_id in enumerate(course_ids)},
+        }).encode('utf-8')))
+        return course_ids, np.load(self.matrix_path, mmap_mode='r'), stale
+
+    def _encode(self, texts):
+        import numpy as np
+
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return np.asarray(self._model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+
+def load_interactions(conn, course_ids):
+    """
+    Reads enrolments and likes into a CSR matrix with one row per course in
+    `course_ids` and one column per student (an enrolment and a like count 1
+    each). Returns (matrix, {student: column}).
+    """
+    import numpy as np
+    from scipy import sparse
+
+    positions = {course_id: i for i, course_id in enumerate(course_ids)}
+    students = {}
+    rows, columns = array('i'), array('i')
+    for course_id, student in conn.execute('''
+        SELECT course_id, student FROM course_students
+        UNION ALL
+        SELECT course_id, student FROM course_likes
+    '''):
+        row = positions.get(course_id)
+        if row is not None:
+            rows.append(row)
+            columns.append(students.setdefault(student, len(students)))
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32),
+                                (np.frombuffer(rows, dtype=np.int32), np.frombuffer(columns, dtype=np.int32))),
+                               shape=(len(course_ids), len(students)))
+    matrix.sum_duplicates()
+    return matrix, students
+
+
+def top_k_neighbours(matrix, k=50, block_size=1024):
+    """
+    Cosine similarity between the rows of a sparse matrix, keeping only the `k`
+    most similar other rows of each row. Returns a square CSR matrix.
+
+    Rows are multiplied in blocks, so memory stays proportional to the result
+    instead of to the square of the number of rows.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    normalized = (sparse.diags(1 / np.where(norms == 0, 1, norms)) @ matrix).astype(np.float32).tocsr()
+    transposed = normalized.T.tocsr()
+
+    count = matrix.shape[0]
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    indices, data = [], []
+    for start in range(0, count, block_size):
+        block = (normalized[start:start + block_size] @ transposed).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            begin, end = block.indptr[offset], block.indptr[offset + 1]
+            columns, values = block.indices[begin:end], block.data[begin:end]
+            keep = columns != row
+            columns, values = columns[keep], values[keep]
+            if len(values) > k:
+                best = np.argpartition(-values, k)[:k]
+                columns, values = columns[best], values[best]
+            indices.append(columns)
+            data.append(values)
+            indptr[row + 1] = indptr[row] + len(columns)
+    return sparse.csr_matrix((np.concatenate(data) if data else np.empty(0, dtype=np.float32),
+                              np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                              indptr), shape=(count, count))
+
+
+class RecommenderService:
+    """
+    Weighs collaborative similarity (to the `neighbours` most similar courses by
+    enrolments and likes) by `alpha` and content similarity by `1 - alpha`.
+
+    Similar courses are looked up in a vector index of the embeddings (see
+    vectorindex.py), which a refresh updates with only the courses that were
+    added, changed or deleted.
+    """
+    def __init__(self, store=None, alpha=0.5, neighbours=50, refresh_interval=600, index='ivf'):
+        self.store = store or EmbeddingStore()
+        self.alpha = alpha
+        self.neighbours = neighbours
+        self.refresh_interval = refresh_interval
+        self.index_name = index
+        self._state = None
+        # Held while refreshing or reconfiguring, so refreshes never overlap.
+        self._lock = threading.Lock()
+        self._index = None
+        self._indexed = set()
+        self._index_lock = threading.Lock()
+
+    def configure(self, settings):
+        """
+        Applies the optional [recommender] section of config.toml:
+
+            [recommender]
+            alpha = 0.5               # weight of collaborative vs. content similarity
+            neighbours = 50           # similar courses kept per course for collaborative filtering
+            refresh_interval = 600    # seconds between background reloads of courses and interactions (0: never)
+            index = "ivf"             # flat | ivf | hnsw (needs the hnswlib package)
+            batch_interval = 3600     # seconds between runs of `database.py recommend-users` by the server (0: never)
+        """
+        with self._lock:
+            self.alpha = settings.get('alpha', self.alpha)
+            self.neighbours = settings.get('neighbours', self.neighbours)
+            self.refresh_interval = settings.get('refresh_interval', self.refresh_interval)
+            if settings.get('index', self.index_name) != self.index_name:
+                self.index_name = settings['index']
+                self._state = None
+                with self._index_lock:
+                    self._index = None
+                    self._indexed = set()
+
+    def refresh(self):
+        """
+        Reloads courses and interactions from the database. Returns the number of
+        course descriptions that had to be encoded.
+        """
+        with self._lock:
+            return self._refresh()
+
+    def refresh_if_idle(self):
+        """
+        Refreshes unless a refresh is already running. Returns the number of
+        descriptions encoded, or None if it skipped.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """
+        Refreshes every `refresh_interval` seconds on the bulk database pool.
+        Requests keep reading the previous snapshot until the new one replaces it.
+        """
+        import tornado.ioloop
+        from asyncdb import bulk_pool
+
+        if self.refresh_interval:
+            tornado.ioloop.PeriodicCallback(lambda: bulk_pool.run(self.refresh_if_idle),
+                                            self.refresh_interval * 1000).start()
+
+    def _refresh(self):
+        with connection() as conn:
+            descriptions = dict(conn.execute('SELECT id, description FROM courses').fetchall())
+            course_ids, embeddings, encoded = self.store.update(descriptions)
+            interactions, students = load_interactions(conn, course_ids)
+        state = (course_ids, embeddings, top_k_neighbours(interactions, self.neighbours),
+                 interactions.T.tocsr(), students)
+        self._update_index(course_ids, embeddings, encoded)
+        self._state = state  # one assignment: readers see the old or the new snapshot
+        return len(encoded)
+
+    def similar(self, course_id, count=10):
+        """
+        Returns up to `count` [course_id, score] pairs for the courses whose
+        descriptions are most similar to the course's, or None for an unknown course.
+        """
+        self._ensure_loaded()
+        with self._index_lock:
+            if self._index is None or course_id not in self._index:
+                return None
+            return [[other, score] for other, score in
+                    self._index.search(self._index.get(course_id), count, exclude={course_id})]
+
+    def _ensure_loaded(self):
+        # Only the first use (or the first after configure() changed the index)
+        # loads in the request path; concurrent first requests share that load.
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self._refresh()
+
+    def _update_index(self, course_ids, embeddings, encoded):
+        from vectorindex import make_index
+
+        with self._index_lock:
+            if embeddings is None or not len(course_ids):
+                self._index = None
+                self._indexed = set()
+                return
+            if self._index is None or self._index.dim != embeddings.shape[1]:
+                self._index = make_index(self.index_name, embeddings.shape[1])
+                self._indexed = set()
+            current = set(course_ids)
+            self._index.remove(self._indexed - current)
+            changed = set(encoded) | (current - self._indexed)
+            rows = [row for row, course_id in enumerate(course_ids) if course_id in changed]
+            if rows:
+                self._index.add([course_ids[row] for row in rows], embeddings[rows])
+            self._indexed = current
+
+    def recommend(self, username, count=5):
+        """
+        Returns up to `count` [course_id, score] pairs for courses the user has not
+        enrolled in or liked, best first.
+        """
+        self._ensure_loaded()
+        return self._recommend(self._state, username, count)
+
+    def _recommend(self, state, username, count):
+        import numpy as np
+
+        course_ids, embeddings, neighbours, courses_by_student, students = state
+        student = students.get(username)
+        if student is None:
+            return []
+        interacted = courses_by_student.indices[courses_by_student.indptr[student]:courses_by_student.indptr[student + 1]]
+
+        # Summing similarities to each interacted course equals one product with
+        # the sum of their embeddings, so no N x N content matrix is needed.
+        content = embeddings @ np.asarray(embeddings[interacted]).sum(axis=0)
+        collaborative = np.asarray(neighbours[interacted].sum(axis=0)).ravel()
+        scores = self.alpha * collaborative + (1 - self.alpha) * content
+        scores[interacted] = -np.inf
+        best = np.argpartition(-scores, count)[:count] if len(scores) > count else np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [[course_ids[i], float(scores[i])] for i in best if np.isfinite(scores[i])]
+
+
+recommender = RecommenderService()
+
+# The service used by compute_user_recommendations() while its workers run.
+_job_service = None
 
-alpha = 0.5  
-combined_similarity = (alpha * course_similarity_collab) + ((1 - alpha) * course_similarity_content)
-combined_similarity_df = pd.DataFrame(combined_similarity, index=courses_df['id'], columns=courses_df['id'])
 
 def recommend_courses_with_content(user, num_recommendations=5):
-    user_interactions = user_course_matrix.loc[user]
-    interacted_courses = user_interactions[user_interactions > 0].index
-    
-    similarity_scores = combined_similarity_df[interacted_courses].sum(axis=1)
-    
-    similarity_scores = similarity_scores.drop([int(course.split('_')[1]) for course in interacted_courses])
-    
-    recommended_courses = similarity_scores.sort_values(ascending=False).head(num_recommendations)
-    return recommended_courses
-
-if __name__ == '__main__':
-    user = 'student_username'
-    recommendations = recommend_courses_with_content(user, num_recommendations=5)
-
-    print("Recommended courses for user:", user)
-    print(recommendations)
+    return recommender.recommend(user, num_recommendations)
+
+
+def _recommend_users(usernames, count):
+    state = _job_service._state
+    return [(username, rank, course_id, score) for username in usernames
+            for rank, (course_id, score) in enumerate(_job_service._recommend(state, username, count))]
+
+
+def compute_user_recommendations(service=None, processes=None, count=10, chunk_size=1000):
+    """
+    Replaces the user_recommendations table with the top `count` courses for
+    every user with enrolments or likes. Users are split over `processes`
+    forked workers (one per CPU by default), which share the refreshed
+    matrices with this process. Returns the number of users.
+    """
+    import multiprocessing
+
+    global _job_service
+    service = service or recommender
+    service.refresh()
+    usernames = list(service._state[4])
+    chunks = [(usernames[i:i + chunk_size], count) for i in range(0, len(usernames), chunk_size)]
+    processes = min(processes or os.cpu_count() or 1, len(chunks))
+    _job_service = service
+    try:
+        if processes > 1:
+            with multiprocessing.get_context('fork').Pool(processes) as workers:
+                results = workers.starmap(_recommend_users, chunks)
+        else:
+            results = [_recommend_users(*chunk) for chunk in chunks]
+    finally:
+        _job_service = None
+
+    # Readers see either the previous or the new recommendations, never a mix.
+    computed_at = time.time()
+    with connection() as conn:
+        conn.execute('DELETE FROM user_recommendations')
+        for rows in results:
+            conn.executemany('''
+                INSERT INTO user_recommendations (username, rank, course_id, score, computed_at) VALUES (?, ?, ?, ?, ?)
+            ''', [(*row, computed_at) for row in rows])
+        conn.commit()
+    return len(usernames)
+
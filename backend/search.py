@@ -0,0 +1,186 @@
+"""
+Full-text search over the forum and the course catalog with SQLite FTS5.
+
+Forum: `posts_fts` indexes posts(title, content) and `post_replies_fts` indexes the
+comment_content of replies, i.e. post_comments past floor 1 (add_post stores a
+copy of the post itself as floor 1). Both are external-content tables: they
+hold only the index and read the text from `posts` and the `post_replies`
+view, and triggers on the base tables keep them in step.
+
+Results are ranked by bm25, title matches counting five times as much as body
+matches. Only the MAX_CANDIDATES newest matches of each index are ranked, which
+bounds the cost of words found in a large part of the forum; rarer queries are
+ranked over all their matches. rebuild_search_index() rebuilds both indexes
+from the base tables.
+
+Catalog: `courses_fts` indexes courses(title, description, category), also as
+an external-content table kept in step by triggers, so courses are searchable
+as soon as an approved request is inserted. A catalog fits in one pass, so
+search_courses() ranks every match and counts the categories and types of the
+matches in the same pass. rebuild_course_index() rebuilds it.
+"""
+
+import html
+import re
+
+from dbpool import connection
+
+# Snippets are HTML-escaped after FTS5 marks the matches with these.
+MARK_START, MARK_END = '\x02', '\x03'
+
+MAX_CANDIDATES = 2000
+MAX_RESULTS = 1000
+
+
+def fts_query(text):
+    """
+    Turns what a user typed into an FTS5 query for documents with all its words.
+    A word ending in * matches as a prefix. Returns None if there are no words.
+    """
+    terms = []
+    for word in re.findall(r'\w+\*?', text):
+        terms.append(f'"{word.rstrip("*")}"*' if word.endswith('*') else f'"{word}"')
+    return ' '.join(terms) or None
+
+
+def render_snippet(snippet):
+    return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def rebuild_search_index(commit=True):
+    """
+    Rebuilds the forum search indexes from posts and post_comments. Returns the
+    number of posts and replies indexed.
+    """
+    with connection() as conn:
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO post_replies_fts (post_replies_fts) VALUES ('rebuild')")
+        count = conn.execute('SELECT (SELECT COUNT(*) FROM posts) + (SELECT COUNT(*) FROM post_replies)').fetchone()[0]
+        if commit:
+            conn.commit()
+    return count
+
+
+def rebuild_course_index(commit=True):
+    """
+    Rebuilds the catalog search index from courses. Returns the number of courses indexed.
+    """
+    with connection() as conn:
+        conn.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+        count = conn.execute('SELECT COUNT(*) FROM courses').fetchone()[0]
+        if commit:
+            conn.commit()
+    return count
+
+
+def search_posts(text, limit=20, offset=0):
+    """
+    Returns the posts and replies matching `text`, best first, skipping the
+    first `offset`. Each result is a dict with the type ('post' or 'reply'),
+    post_id, title (of the post), an HTML snippet with the matches in <mark>,
+    and for replies comment_id and floor.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+    with connection() as conn:
+        # Reading matches in rowid order stops after MAX_CANDIDATES; ordering by
+        # rank would score every match first.
+        candidates = [(rank, 'post', rowid) for rowid, rank in conn.execute(
+            'SELECT rowid, rank FROM posts_fts WHERE posts_fts MATCH ? ORDER BY rowid DESC LIMIT ?',
+            (query, MAX_CANDIDATES))]
+        candidates += [(rank, 'reply', rowid) for rowid, rank in conn.execute(
+            'SELECT rowid, rank FROM post_replies_fts WHERE post_replies_fts MATCH ? ORDER BY rowid DESC LIMIT ?',
+            (query, MAX_CANDIDATES))]
+        candidates.sort()  # bm25: lower is better
+
+        page = candidates[offset:min(offset + limit, MAX_RESULTS)]
+        post_ids = [rowid for _, kind, rowid in page if kind == 'post']
+        reply_ids = [rowid for _, kind, rowid in page if kind == 'reply']
+        post_rows = conn.execute(f'''
+            SELECT p.id, p.title, snippet(posts_fts, -1, ?, ?, '…', 24)
+            FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid
+            WHERE posts_fts MATCH ? AND posts_fts.rowid IN ({', '.join('?' * len(post_ids))})
+        ''', (MARK_START, MARK_END, query, *post_ids)).fetchall()
+        reply_rows = conn.execute(f'''
+            SELECT c.id, c.post_id, c.floor, p.title, snippet(post_replies_fts, 0, ?, ?, '…', 24)
+            FROM post_replies_fts JOIN post_comments c ON c.id = post_replies_fts.rowid
+            JOIN posts p ON p.id = c.post_id
+            WHERE post_replies_fts MATCH ? AND post_replies_fts.rowid IN ({', '.join('?' * len(reply_ids))})
+        ''', (MARK_START, MARK_END, query, *reply_ids)).fetchall()
+
+    results = {}
+    for post_id, title, snippet in post_rows:
+        results['post', post_id] = {'type': 'post', 'post_id': post_id, 'title': title,
+                                    'snippet': render_snippet(snippet)}
+    for comment_id, post_id, floor, title, snippet in reply_rows:
+        results['reply', comment_id] = {'type': 'reply', 'post_id': post_id, 'comment_id': comment_id, 'floor': floor,
+                                        'title': title, 'snippet': render_snippet(snippet)}
+    return [results[kind, rowid] for _, kind, rowid in page]
+
+
+def _facets(groups, category, type):
+    """
+    Turns {(category, type): count} into the total number of courses in the
+    chosen category and type, and the counts per category and per type.
+    """
+    categories, types, total = {}, {}, 0
+    for (group_category, group_type), count in groups.items():
+        in_category = category is None or group_category == category
+        in_type = type is None or group_type == type
+        if in_type:
+            categories[group_category] = categories.get(group_category, 0) + count
+        if in_category:
+            types[group_type] = types.get(group_type, 0) + count
+        if in_category and in_type:
+            total += count
+    return total, {'category': sorted(categories.items(), key=lambda item: (-item[1], item[0] or '')),
+                   'type': sorted(types.items(), key=lambda item: (-item[1], item[0]))}
+
+
+def search_courses(text, category=None, type=None, limit=20, offset=0):
+    """
+    Searches the catalog. Without words in `text`, every course matches, in
+    catalog order; otherwise matches are ranked by bm25. `category` and `type`
+    narrow the matches down.
+
+    Returns (total, facets, courses): the number of matches, the number of
+    matches per category and per type as {'category': [[name, count], ...],
+    'type': [...]}, most common first, and the page of courses after `offset`.
+    Each facet counts the matches as narrowed by the other facet only, so it
+    shows what choosing one of its values would return.
+    """
+    query = fts_query(text)
+    with connection() as conn:
+        if query is None:
+            # Browsing: the counts come from the (category, type) index alone.
+            groups = {(group_category, group_type): count for group_category, group_type, count in conn.execute(
+                'SELECT category, type, COUNT(*) FROM courses GROUP BY category, type')}
+            course_ids = [course_id for course_id, in conn.execute('''
+                SELECT id FROM courses WHERE (?1 IS NULL OR category = ?1) AND (?2 IS NULL OR type = ?2)
+                ORDER BY id LIMIT ?3 OFFSET ?4
+            ''', (category, type, limit, offset))]
+        else:
+            groups, ranked = {}, []
+            for course_id, course_category, course_type, rank in conn.execute('''
+                SELECT c.id, c.category, c.type, m.rank FROM (
+                    SELECT rowid, rank FROM courses_fts WHERE courses_fts MATCH ?
+                ) m JOIN courses c ON c.id = m.rowid
+            ''', (query,)):
+                groups[course_category, course_type] = groups.get((course_category, course_type), 0) + 1
+                if (category is None or course_category == category) and (type is None or course_type == type):
+                    ranked.append((rank, course_id))
+            ranked.sort()
+            course_ids = [course_id for _, course_id in ranked[offset:offset + limit]]
+
+        rows = conn.execute(f'''
+            SELECT c.id, c.title, c.description, c.owner, c.category, c.type, s.rating_avg, s.rating_count
+            FROM courses c LEFT JOIN course_stats s ON s.course_id = c.id
+            WHERE c.id IN ({', '.join('?' * len(course_ids))})
+        ''', course_ids).fetchall()
+
+    courses = {row[0]: {'id': row[0], 'title': row[1], 'instructor': row[3], 'description': row[2],
+                        'category': row[4], 'type': row[5], 'rating': row[6] or 0, 'rating_count': row[7] or 0}
+               for row in rows}
+    total, facets = _facets(groups, category, type)
+    return total, facets, [courses[course_id] for course_id in course_ids]
@@ -37,10 +37,18 @@ Pretty UI.
 from tornado.web import RequestHandler, StaticFileHandler
 from database import DATABASE, validate_user, add_user, get_user_role, get_users_by_role, User, add_teacher_request
 from database import init_db
+from asyncdb import pool, POOLS
+from cache import course_detail_cache, post_feed_cache
+from leaderboard import popularity
+from recommender import recommender
+from watchtracker import watch_tracker
+from passwords import password_hasher, login_throttle
+import passwords
 import argparse
+import logging
 import os
+import sys
 import json
-# from recommender import recommend_courses_with_content
 from functools import wraps
 
 def verified(cls):
@@ -58,40 +66,45 @@ def verified(cls):
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--port', type=int, default=9265)
-args = parser.parse_args()
+parser.add_argument('--processes', type=int, default=1,
+                    help='number of server processes sharing the port (0: one per CPU core); '
+                         'only 1 is supported while anti-cheat sessions live in memory')
 
 import tornado
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
+import dbpool
+import sessions
 
-init_db()
-
-from components.sendEmail import config
-from components.inbox import InboxHandler
+from components.sendEmail import config, outbox, outbox_status
+from components.inbox import InboxHandler, UnreadCountHandler, InboxSocketHandler, InboxEventsHandler, inbox_hub, inbox_feed
 from components.user.base import BaseHandler
 from components.user.login import LoginHandler, LogoutHandler, RegisterHandler, UserSearchHandler
-from components.user.teacher import AddTeacherHandler, AllTeacherHandler, GetTeacherHandler
+from components.user.teacher import AddTeacherHandler, AllTeacherHandler, GetTeacherHandler, PopularTeachersHandler
 from components.user.mycourse import MyCourseHandler, AddCourseRequestHandler, AddTeacherRequestHandler
 from components.course.anticheat import VideoAnticheatHandler
 from components.course.courseware import CourseWareHandler, CourseWareFileHandlerWithAuth, HomeworkProjectHandler
-from components.course.mainCourse import AllCoursesHandler, DetailedCourseHandler, AddCourseHandler, CourseProgressHandler, AddCourseStudentHandler
-from components.course.derived import CourseCommentsHandler, CourseNotifHandler, CourseLikeHandler, CourseRecommendHandler, CourseRatingHandler, CourseSendNotificationHandler, CheckLikeHandler
-from components.post.post import PostHandler, CommentHandler, PostTagHandler, CoursePostHandler
+from components.course.mainCourse import AllCoursesHandler, CourseSearchHandler, PopularCoursesHandler, DetailedCourseHandler, AddCourseHandler, CourseProgressHandler, AddCourseStudentHandler
+from components.course.derived import CourseCommentsHandler, CourseNotifHandler, CourseLikeHandler, CourseRecommendHandler, SimilarCoursesHandler, CourseRatingHandler, CourseSendNotificationHandler, CheckLikeHandler
+from components.post.post import PostHandler, PostFeedHandler, PostSearchHandler, CommentHandler, PostTagHandler, CoursePostHandler
 
 class MainHandler(BaseHandler):
-    def get(self):
+    async def get(self):
         """
         Returns username and role of the current user in JSON format.
         """
         username = self.get_current_user()
-        role = get_user_role(username)
+        role = await pool.run(get_user_role, username)
         self.write(json.dumps({"username": username, "role": role}))
 
 
 class AdminHandler(BaseHandler):
     @tornado.web.authenticated
-    def get(self):
-        role = self.get_user_role()
+    async def get(self):
+        role = await self.get_user_role()
         if role == 'admin':
             self.write("Welcome, Admin! You have access to this page.")
         else:
@@ -99,6 +112,27 @@ class AdminHandler(BaseHandler):
             self.write("Forbidden: You do not have permission to access this page.")
 
 
+class MetricsHandler(BaseHandler):
+    @tornado.web.authenticated
+    async def get(self):
+        """
+        Returns runtime metrics of the server, e.g. the database pools.
+        """
+        role = await self.get_user_role()
+        if role == 'admin':
+            self.write(json.dumps({"db_pools": [p.metrics() for p in POOLS],
+                                    "course_detail_cache": course_detail_cache.metrics(),
+                                    "post_feed_cache": post_feed_cache.metrics(),
+                                    "email_outbox": await pool.run(outbox_status),
+                                    "inbox_push": inbox_hub.metrics(),
+                                    "anticheat": watch_tracker.metrics(),
+                                    "login": {"hasher": password_hasher.metrics(),
+                                              "throttle": login_throttle.metrics()}}))
+        else:
+            self.set_status(403)
+            self.write("Forbidden: You do not have permission to access this page.")
+
+
 SECRET_KEY = config['secret']
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # Path to `backend/`
@@ -111,11 +145,16 @@ def make_app():
         (r"/api/login", LoginHandler),
         (r"/api/register", RegisterHandler),
         (r"/api/admin", AdminHandler),
+        (r"/api/admin/metrics", MetricsHandler),
         (r"/api/logout", LogoutHandler),
         (r"/api/inbox", InboxHandler),
+        (r"/api/inbox/unread-count", UnreadCountHandler),
+        (r"/api/inbox/ws", InboxSocketHandler),
+        (r"/api/inbox/events", InboxEventsHandler),
         (r"/api/courses/\d+/comments", CourseCommentsHandler),
         (r"/api/courses/\d+/notifications", CourseSendNotificationHandler),
         (r"/api/courses/\d+/students", AddCourseStudentHandler),
+        (r"/api/courses/\d+/similar", SimilarCoursesHandler),
         (r"/api/my/course", MyCourseHandler),
         (r"/api/add/teacher", AddTeacherHandler),
         (r"/api/add/course", AddCourseHandler),
@@ -124,15 +163,19 @@ def make_app():
         (r"/api/courses/like/\d+", CourseLikeHandler),
         (r"/api/courses/checklike/\d+", CheckLikeHandler),
         (r"/api/courses/recommend", CourseRecommendHandler),
+        (r"/api/courses/popular", PopularCoursesHandler),
         (r"/api/anticheat", VideoAnticheatHandler),
         (r"/api/courseware", CourseWareHandler),
         (r"/api/hwpj", HomeworkProjectHandler),
         (r"/api/files/courseware/(.*)", CourseWareFileHandlerWithAuth, {"path": "files/courseware"}),
         # (r"/api/static/(.*)", tornado.web.StaticFileHandler, {"path": "static"}),
         (r"/api/course/all", AllCoursesHandler),
+        (r"/api/course/search", CourseSearchHandler),
         (r"/api/course/progress/\d+", CourseProgressHandler),
         (r"/api/course/post", CoursePostHandler),
         (r"/api/posts", PostHandler),
+        (r"/api/posts/feed", PostFeedHandler),
+        (r"/api/search/posts", PostSearchHandler),
         (r"/api/post/(\d+)/comments", CommentHandler),
         (r"/api/post/tag/(.+)", PostTagHandler),
         (r"/api/add-course-requests", AddCourseRequestHandler),
@@ -142,14 +185,51 @@ def make_app():
         (r"/api/users/search", UserSearchHandler),
         (r"/api/teacher/all", AllTeacherHandler),
         (r"/api/teacher/getname", GetTeacherHandler),
+        (r"/api/teacher/popular", PopularTeachersHandler),
         (r"/static/(.*)", StaticFileHandler, {"path": FRONTEND_DIST_PATH}), # serve static files
         (r"/(.*)", StaticFileHandler, {"path": FRONTEND_DIST_PATH, "default_filename": "index.html"}), # Serve PWA (SPA fallback)
-    ], cookie_secret=SECRET_KEY, login_url="/api/login")
+    ], cookie_secret=SECRET_KEY, login_url="/api/login", websocket_ping_interval=30)
+
+async def recommend_users():
+    """
+    Recomputes the precomputed course recommendations. The job runs in its own
+    process (`database.py recommend-users`), so it can use every CPU without
+    blocking this server.
+    """
+    process = tornado.process.Subprocess([sys.executable, os.path.join(BASE_DIR, 'database.py'), 'recommend-users'])
+    await process.wait_for_exit(raise_error=False)
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.processes != 1:
+        parser.error('the anti-cheat watch tracker keeps its sessions in memory and cannot be shared by several processes')
+    logging.basicConfig()
+    logging.getLogger('migrations').setLevel(logging.INFO)
+    init_db()
+    session_store = sessions.configure(config.get('session', {}))
+    recommender.configure(config.get('recommender', {}))
+    watch_tracker.configure(config.get('anticheat', {}))
+    passwords.configure(config.get('login', {}))
+    if args.processes != 1 and isinstance(session_store.backend, sessions.MemorySessionBackend):
+        parser.error('the memory session backend cannot be shared by several processes')
+    sockets = tornado.netutil.bind_sockets(args.port)
+    if args.processes != 1:
+        # Connections opened by init_db must not be shared with the children.
+        dbpool.close_all()
+        tornado.process.fork_processes(args.processes)
+    outbox.start()
+    inbox_feed.start()
+    watch_tracker.start()
+    recommender.start()
+    password_hasher.start()
+    popularity.load()
+    tornado.ioloop.PeriodicCallback(lambda: pool.run(popularity.flush), 60000).start()
+    batch_interval = config.get('recommender', {}).get('batch_interval', 3600)
+    if batch_interval and tornado.process.task_id() in (None, 0):
+        tornado.ioloop.PeriodicCallback(recommend_users, batch_interval * 1000).start()
     app = make_app()
-    app.listen(args.port)
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
     print(f"Server started at http://localhost:{args.port}")
-    # tornado.ioloop.PeriodicCallback(VideoAnticheatHandler.check_inactivity, 60000).start()
     tornado.ioloop.IOLoop.current().start()
 
@@ -0,0 +1,260 @@
+"""
+Login sessions.
+
+Every user has at most one live session: logging in again replaces the session
+id, which logs out the other browser. The session id is kept in a backend that
+can be shared by several server processes:
+
+- MemorySessionBackend: a dict in this process (single-process setups, tests).
+- SQLiteSessionBackend: the `sessions` table, shared by every process on the host.
+- RedisSessionBackend: any server speaking the Redis protocol, shared across hosts.
+
+The backend is chosen by the optional [session] section of config.toml:
+
+    [session]
+    backend = "sqlite"          # memory | sqlite | redis
+    ttl = 604800                # seconds a session stays valid after login
+    cache_ttl = 5               # seconds a validated session is trusted without asking the backend
+    redis_url = "redis://127.0.0.1:6379/0"
+
+SessionStore puts a small read-through cache in front of the backend, so most
+requests validate their cookie without touching it. A session replaced by a
+login on another process stays valid here for at most `cache_ttl` seconds.
+"""
+
+import secrets
+import socket
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from dbpool import connection
+
+
+class RedisError(Exception):
+    pass
+
+
+class MemorySessionBackend:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._sessions.get(username)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._sessions[username]
+                return None
+            return entry[0]
+
+    def set(self, username, session_id, ttl):
+        with self._lock:
+            self._sessions[username] = (session_id, time.time() + ttl)
+
+    def delete(self, username):
+        with self._lock:
+            self._sessions.pop(username, None)
+
+
+class SQLiteSessionBackend:
+    def __init__(self, path=None):
+        self.path = path
+
+    def get(self, username):
+        with connection(self.path) as conn:
+            row = conn.execute('''
+                SELECT session_id FROM sessions WHERE username = ? AND expires > ?
+            ''', (username, time.time())).fetchone()
+            return row[0] if row else None
+
+    def set(self, username, session_id, ttl):
+        now = time.time()
+        with connection(self.path) as conn:
+            conn.execute('DELETE FROM sessions WHERE expires <= ?', (now,))
+            conn.execute('''
+                INSERT INTO sessions (username, session_id, expires) VALUES (?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET session_id = excluded.session_id, expires = excluded.expires
+            ''', (username, session_id, now + ttl))
+            conn.commit()
+
+    def delete(self, username):
+        with connection(self.path) as conn:
+            conn.execute('DELETE FROM sessions WHERE username = ?', (username,))
+            conn.commit()
+
+
+class RedisSessionBackend:
+    """
+    Sessions stored as `<prefix><username>` keys with an expiry, over a minimal
+    RESP client (one connection, reconnected once on failure).
+    """
+    def __init__(self, url='redis://127.0.0.1:6379/0', prefix='manthano:session:', timeout=1.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        return self.command('GET', self.prefix + username)
+
+    def set(self, username, session_id, ttl):
+        self.command('SET', self.prefix + username, session_id, 'EX', int(ttl))
+
+    def delete(self, username):
+        self.command('DEL', self.prefix + username)
+
+    def command(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                if self._sock is None:
+                    self._connect()
+                try:
+                    return self._send(*args)
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def _send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            data = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._sock.sendall(b''.join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by the Redis server.')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self._reader.read(length + 2)[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+
+class SessionStore:
+    def __init__(self, backend, ttl=7 * 24 * 3600, cache_ttl=5, cache_size=10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, username):
+        """
+        Starts a new session for `username`, replacing any existing one, and returns its id.
+        """
+        session_id = secrets.token_hex(32)
+        self.backend.set(username, session_id, self.ttl)
+        self._remember(username, session_id)
+        return session_id
+
+    def cached(self, username, session_id):
+        """
+        Returns True if the cache vouches for the session. False means only that
+        the backend must be asked (see validate()).
+        """
+        with self._lock:
+            cached = self._cache.get(username)
+            if cached and cached[0] == session_id and cached[1] > time.monotonic():
+                self._cache.move_to_end(username)
+                return True
+        return False
+
+    def validate(self, username, session_id):
+        """
+        Checks a session, asking the backend unless the cache vouches for it.
+        This may block on the backend; handlers run it on the database pool.
+        """
+        if self.cached(username, session_id):
+            return True
+        # Not cached, expired from the cache, or a different id: another process
+        # may have issued a newer session, so ask the backend.
+        current = self.backend.get(username)
+        if current is None:
+            self.forget(username)
+            return False
+        self._remember(username, current)
+        return current == session_id
+
+    def revoke(self, username):
+        self.backend.delete(username)
+        self.forget(username)
+
+    def forget(self, username):
+        with self._lock:
+            self._cache.pop(username, None)
+
+    def _remember(self, username, session_id):
+        with self._lock:
+            self._cache[username] = (session_id, time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(username)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+BACKENDS = {
+    'memory': lambda settings: MemorySessionBackend(),
+    'sqlite': lambda settings: SQLiteSessionBackend(),
+    'redis': lambda settings: RedisSessionBackend(settings.get('redis_url', 'redis://127.0.0.1:6379/0')),
+}
+
+store = SessionStore(SQLiteSessionBackend())
+
+
+def configure(settings):
+    """
+    Replaces the session store according to the [session] section of config.toml.
+    """
+    global store
+    name = settings.get('backend', 'sqlite')
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown session backend: {name}')
+    store = SessionStore(BACKENDS[name](settings),
+                         ttl=settings.get('ttl', 7 * 24 * 3600),
+                         cache_ttl=settings.get('cache_ttl', 5))
+    return store
@@ -1,7 +1,41 @@
+import base64
+import importlib.util
+import json
+import os
+import random
+import bcrypt
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
 import tornado.gen
-from tornado.testing import AsyncTestCase, gen_test
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httputil import parse_multipart_form_data
+from tornado.testing import AsyncTestCase, AsyncHTTPTestCase, gen_test
+from tornado.web import create_signed_value
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.tcpclient import TCPClient
+from tornado.websocket import websocket_connect
 from server import make_app
+import dbpool
+import migrations
+from migrations import migrate, get_version, LATEST_VERSION, course_broadcasts
+from database import add_rating, update_course_stats, rebuild_course_stats
+from cache import GroupCache, courseware_access_cache, post_feed_cache
+from recommender import EmbeddingStore, RecommenderService, top_k_neighbours, compute_user_recommendations
+from vectorindex import FlatIndex, IVFIndex, HNSWIndex, make_index
+from search import rebuild_search_index
+from leaderboard import Leaderboard, PopularityTracker, popularity, rebuild_popularity, WEIGHTS, HALF_LIFE
+import sessions
+from uploads import MultipartParser
+from sessions import SessionStore, MemorySessionBackend, SQLiteSessionBackend, RedisSessionBackend
+from components.sendEmail import OutboxSender, queue_emails, outbox_status
+from components.inbox import inbox_hub, inbox_feed
+from pubsub import Hub, QueueOverflow
+from watchtracker import TimerWheel, WatchTracker, watch_tracker
+from passwords import PasswordHasher, HasherBusy, TokenBuckets, LoginThrottle, password_hasher, login_throttle
 
 class TestServer(AsyncTestCase):
     def setUp(self):
@@ -36,4 +70,1550 @@ class TestServer(AsyncTestCase):
             raise_error=False
         )
         self.assertEqual(response.code, 200)
-        self.assertIn('Login failed', response.body.decode())
\ No newline at end of file
+        self.assertIn('Login failed', response.body.decode())
+
+
+def use_temp_database():
+    """
+    Points the connection pool at a new, fully migrated database file.
+    """
+    dbpool.close_all()
+    dbpool.DATABASE = os.path.join(tempfile.mkdtemp(), 'test.db')
+    migrate()
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        use_temp_database()
+
+    def test_migrate_is_idempotent(self):
+        self.assertEqual(get_version(), LATEST_VERSION)
+        self.assertEqual(migrate(), LATEST_VERSION)
+        self.assertEqual(get_version(), LATEST_VERSION)
+
+    def test_failed_migration_leaves_nothing_behind(self):
+        dbpool.close_all()
+        dbpool.DATABASE = os.path.join(tempfile.mkdtemp(), 'test.db')
+
+        def baseline_then_fail(cursor):
+            migrations.baseline(cursor)
+            raise RuntimeError('crash')
+
+        with unittest.mock.patch.object(migrations, 'MIGRATIONS', [(1, 'baseline', baseline_then_fail)]):
+            with self.assertRaises(RuntimeError):
+                migrate()
+        self.assertEqual(get_version(), 0)
+        with dbpool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0], 0)
+
+    def test_duplicate_enrollment_is_rejected(self):
+        with dbpool.connection() as conn:
+            conn.execute('INSERT INTO course_students (course_id, student) VALUES (1, ?)', ('jane.doe',))
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute('INSERT INTO course_students (course_id, student) VALUES (1, ?)', ('jane.doe',))
+
+
+class TestCourseStats(unittest.TestCase):
+    def setUp(self):
+        use_temp_database()
+
+    def stats(self):
+        with dbpool.connection() as conn:
+            return conn.execute('SELECT * FROM course_stats ORDER BY course_id').fetchall()
+
+    def test_incremental_stats_match_rebuild(self):
+        for course_id, star in [(1, 5), (1, 4), (2, 1), (1, 3), (2, 2)]:
+            add_rating('jane.doe', star, 'Easy', 'Light', 'Fair Grading', 'High Gain', '', course_id)
+        with dbpool.connection() as conn:
+            conn.execute('DELETE FROM rating WHERE course_id = 1 AND star = 4')
+            update_course_stats(1, 4, -1)
+            conn.commit()
+        incremental = self.stats()
+        self.assertEqual(incremental[0][:4], (1, 2, 8, 4.0))
+        self.assertEqual(incremental[0][4:], (0, 0, 1, 0, 1))
+        rebuild_course_stats()
+        self.assertEqual(self.stats(), incremental)
+
+
+class TestGroupCache(unittest.TestCase):
+    def test_invalidate_drops_group(self):
+        cache = GroupCache()
+        cache.set(1, True, 'student view')
+        cache.set(1, False, 'owner view')
+        cache.set(2, True, 'other course')
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1, True))
+        self.assertIsNone(cache.get(1, False))
+        self.assertEqual(cache.get(2, True), 'other course')
+
+    def test_stale_fill_is_dropped(self):
+        cache = GroupCache()
+        epoch = cache.epoch()
+        cache.invalidate(1)  # data changed while the response was being built
+        cache.set(1, True, 'stale', epoch)
+        self.assertIsNone(cache.get(1, True))
+        cache.set(1, True, 'fresh', cache.epoch())
+        self.assertEqual(cache.get(1, True), 'fresh')
+
+    def test_lru_and_ttl(self):
+        cache = GroupCache(max_groups=2, ttl=0)
+        cache.set(1, True, 'a')
+        cache.set(2, True, 'b')
+        cache.set(3, True, 'c')
+        self.assertEqual(cache.metrics()['groups'], 2)
+        time.sleep(0.01)
+        self.assertIsNone(cache.get(3, True))
+
+    def test_entries_per_group_are_capped(self):
+        cache = GroupCache(max_entries=2)
+        cache.set(1, 'a', 'a')
+        cache.set(1, 'b', 'b')
+        cache.get(1, 'a')
+        cache.set(1, 'c', 'c')
+        self.assertEqual((cache.get(1, 'a'), cache.get(1, 'b'), cache.get(1, 'c')), ('a', None, 'c'))
+
+
+class CountingEmbeddingStore(EmbeddingStore):
+    """
+    Embeds a description as its normalized letter counts instead of loading a model.
+    """
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.encoded = []
+
+    def _encode(self, texts):
+        import numpy as np
+
+        self.encoded.extend(texts)
+        vectors = np.array([[text.count(letter) for letter in 'abcdefghijklmnopqrstuvwxyz'] for text in texts],
+                           dtype=np.float32) + 1e-3
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestRecommender(unittest.TestCase):
+    def setUp(self):
+        use_temp_database()
+        self.directory = tempfile.mkdtemp()
+        with dbpool.connection() as conn:
+            conn.executemany('INSERT INTO courses (id, title, description, owner) VALUES (?, ?, ?, ?)', [
+                (1, 'Algebra', 'matrices and vectors', 'prof'),
+                (2, 'Linear algebra', 'vectors, matrices and more matrices', 'prof'),
+                (3, 'Poetry', 'sonnets', 'prof'),
+                (4, 'Painting', 'oil on canvas', 'prof'),
+            ])
+            conn.executemany('INSERT INTO course_students (course_id, student) VALUES (?, ?)',
+                             [(1, 'jane.doe'), (1, 'john.doe'), (2, 'john.doe'), (3, 'john.doe')])
+            conn.commit()
+
+    def test_only_changed_descriptions_are_encoded(self):
+        store = CountingEmbeddingStore(self.directory)
+        self.assertEqual(RecommenderService(store).refresh(), 4)
+
+        # A new process finds every embedding on disk.
+        store = CountingEmbeddingStore(self.directory)
+        self.assertEqual(RecommenderService(store).refresh(), 0)
+        self.assertEqual(store.encoded, [])
+
+        with dbpool.connection() as conn:
+            conn.execute("UPDATE courses SET description = 'haiku' WHERE id = 3")
+            conn.execute('DELETE FROM courses WHERE id = 4')
+            conn.commit()
+        self.assertEqual(RecommenderService(store).refresh(), 1)
+        self.assertEqual(store.encoded, ['haiku'])
+        index, matrix = store.load()
+        self.assertEqual(sorted(index), [1, 2, 3])
+        self.assertEqual(matrix.shape[0], 3)
+
+    def test_overlapping_updates_keep_rows_with_their_courses(self):
+        descriptions = {1: 'matrices', 2: 'sonnets', 3: 'canvas'}
+        CountingEmbeddingStore(self.directory).update({1: 'matrices', 3: 'canvas'})
+        second = CountingEmbeddingStore(self.directory)
+        results = []
+
+        class SlowStore(CountingEmbeddingStore):
+            def _encode(self, texts):
+                # A second process refreshes while this one is between reading and writing.
+                thread.start()
+                time.sleep(0.2)
+                return super()._encode(texts)
+
+        thread = threading.Thread(target=lambda: results.append(second.update(descriptions)))
+        first = SlowStore(self.directory)
+        course_ids, matrix, _ = first.update(descriptions)
+        thread.join()
+        self.assertEqual(second.encoded, [])
+        self.assertEqual(results[0][0], course_ids)
+        index, stored = second.load()
+        reference = CountingEmbeddingStore(self.directory)._encode(['matrices', 'sonnets', 'canvas'])
+        for course_id, expected in zip([1, 2, 3], reference):
+            self.assertTrue((stored[index[course_id][0]] == expected).all())
+
+    def test_recommend(self):
+        service = RecommenderService(CountingEmbeddingStore(self.directory))
+        recommended = [course_id for course_id, _ in service.recommend('jane.doe')]
+        self.assertEqual(recommended[0], 2)
+        self.assertNotIn(1, recommended)
+        self.assertEqual(service.recommend('nobody'), [])
+
+    def test_similar_courses_follow_changes(self):
+        store = CountingEmbeddingStore(self.directory)
+        service = RecommenderService(store, index='flat')
+        self.assertEqual(service.similar(1, 1)[0][0], 2)
+        self.assertIsNone(service.similar(99))
+
+        with dbpool.connection() as conn:
+            conn.execute('DELETE FROM courses WHERE id = 2')
+            conn.execute("UPDATE courses SET description = 'matrices, vectors' WHERE id = 4")
+            conn.commit()
+        store.encoded.clear()
+        service.refresh()
+        self.assertEqual(store.encoded, ['matrices, vectors'])
+        self.assertIsNone(service.similar(2))
+        self.assertEqual(service.similar(1, 1)[0][0], 4)
+
+    def test_requests_serve_the_last_snapshot(self):
+        store = CountingEmbeddingStore(self.directory)
+        service = RecommenderService(store, index='flat')
+        self.assertEqual(service.similar(1, 1)[0][0], 2)
+        with dbpool.connection() as conn:
+            conn.execute('DELETE FROM courses WHERE id = 2')
+            conn.commit()
+        self.assertEqual(service.similar(1, 1)[0][0], 2)
+
+        with service._lock:
+            self.assertIsNone(service.refresh_if_idle())
+        self.assertEqual(service.similar(1, 1)[0][0], 2)
+        self.assertIsNotNone(service.refresh_if_idle())
+        self.assertIsNone(service.similar(2))
+
+    def test_compute_user_recommendations(self):
+        service = RecommenderService(CountingEmbeddingStore(self.directory))
+        for _ in range(2):
+            self.assertEqual(compute_user_recommendations(service, processes=2, count=2, chunk_size=1), 2)
+        with dbpool.connection() as conn:
+            rows = conn.execute('SELECT username, rank, course_id FROM user_recommendations ORDER BY username, rank').fetchall()
+        self.assertEqual(rows, [('jane.doe', 0, 2), ('jane.doe', 1, 3), ('john.doe', 0, 4)])
+
+    def test_top_k_neighbours_match_dense_similarity(self):
+        import numpy as np
+        from scipy import sparse
+
+        rng = np.random.default_rng(42)
+        dense = (rng.random((40, 300)) < 0.05).astype(np.float32)
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        similarity = (dense / np.where(norms == 0, 1, norms)) @ (dense / np.where(norms == 0, 1, norms)).T
+        np.fill_diagonal(similarity, 0)
+
+        neighbours = top_k_neighbours(sparse.csr_matrix(dense), k=40, block_size=7).toarray()
+        np.testing.assert_allclose(neighbours, similarity, atol=1e-6)
+
+        nearest = top_k_neighbours(sparse.csr_matrix(dense), k=3, block_size=7)
+        for row in range(40):
+            values = np.sort(nearest[row].data)[::-1]
+            np.testing.assert_allclose(values, np.sort(similarity[row][similarity[row] > 0])[::-1][:3], atol=1e-6)
+
+
+class TestRecommendHandler(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.executemany('INSERT INTO courses (id, title, description, owner) VALUES (?, ?, ?, ?)',
+                             [(1, 'Algebra', '', 'prof'), (2, 'Poetry', '', 'prof'), (3, 'Painting', '', 'prof')])
+            conn.executemany('INSERT INTO course_students (course_id, student) VALUES (?, ?)',
+                             [(2, 'jane.doe'), (2, 'john.doe'), (3, 'john.doe')])
+            conn.execute("INSERT INTO course_likes (course_id, student) VALUES (2, 'jane.doe')")
+            conn.execute("INSERT INTO user_recommendations VALUES ('jane.doe', 0, 3, 0.9, 0), ('jane.doe', 1, 1, 0.1, 0)")
+            conn.commit()
+        rebuild_popularity()
+        popularity.loaded = False
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def recommendations(self, username):
+        secret = self._app.settings['cookie_secret']
+        cookie = (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                  f"session_id={create_signed_value(secret, 'session_id', sessions.store.create(username)).decode()}")
+        response = self.fetch('/api/courses/recommend', headers={'Cookie': cookie})
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_precomputed_recommendations(self):
+        self.assertEqual(self.recommendations('jane.doe'), [[3, 0.9], [1, 0.1]])
+
+    def test_new_user_gets_popular_courses(self):
+        recommended = self.recommendations('newbie')
+        self.assertEqual([course_id for course_id, _ in recommended], [2, 3])
+        for (_, score), expected in zip(recommended, [2 * WEIGHTS['enroll'] + WEIGHTS['like'], WEIGHTS['enroll']]):
+            self.assertAlmostEqual(score, expected, places=3)
+
+
+class TestPopularity(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.executemany('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+                             [('ms.smith', '', 'smith@example.com', 'teacher'), ('mr.jones', '', 'jones@example.com', 'teacher')])
+            conn.executemany('INSERT INTO courses (id, title, description, owner) VALUES (?, ?, ?, ?)',
+                             [(1, 'Algebra', '', 'ms.smith'), (2, 'Poetry', '', 'mr.jones'), (3, 'Painting', '', 'mr.jones')])
+            conn.executemany('INSERT INTO course_students (course_id, student) VALUES (?, ?)',
+                             [(1, 'jane.doe'), (1, 'john.doe'), (2, 'john.doe'), (3, 'jane.doe')])
+            conn.commit()
+        rebuild_popularity()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def cookie(self, username='jane.doe'):
+        secret = self._app.settings['cookie_secret']
+        return (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                f"session_id={create_signed_value(secret, 'session_id', sessions.store.create(username)).decode()}")
+
+    def fetch_json(self, path):
+        response = self.fetch(path, headers={'Cookie': self.cookie()})
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_leaderboard_order(self):
+        board = Leaderboard({'a': 1.0, 'b': 2.0})
+        board.add('c', 1.5)
+        board.add('a', 3.0)
+        self.assertEqual(board.top(2), [('a', 4.0), ('b', 2.0)])
+        board.add('a', -3.5)
+        self.assertEqual([member for member, _ in board.top(3)], ['b', 'c', 'a'])
+
+    def test_trackers_share_scores_and_decay(self):
+        # Two trackers stand in for two server processes.
+        first, second = PopularityTracker(), PopularityTracker()
+        first.load()
+        second.load()
+        self.assertEqual(first.top_courses(1)[0][0], 1)
+        for (teacher, score), expected in zip(first.top_teachers(2), ['mr.jones', 'ms.smith']):
+            self.assertEqual(teacher, expected)
+            self.assertAlmostEqual(score, 6.0, places=3)
+
+        second.record(2, 4 * WEIGHTS['enroll'], at=time.time() - HALF_LIFE)
+        self.assertEqual(second.top_courses(1)[0][0], 2)
+        self.assertAlmostEqual(second.top_courses(1)[0][1], 9.0, places=3)
+        self.assertEqual(first.top_courses(1)[0][0], 1)
+        second.flush()
+        first.flush()
+        for mine, theirs in zip(first.top_courses(3), second.top_courses(3)):
+            self.assertEqual(mine[0], theirs[0])
+            self.assertAlmostEqual(mine[1], theirs[1], places=3)
+        self.assertEqual(first.top_teachers(1)[0][0], 'mr.jones')
+
+    def test_endpoints(self):
+        popularity.loaded = False
+        self.assertEqual([course['id'] for course in self.fetch_json('/api/courses/popular?k=2')][0], 1)
+        self.assertEqual(len(self.fetch_json('/api/courses/popular?k=2')), 2)
+        teachers = self.fetch_json('/api/teacher/popular')
+        self.assertEqual({teacher['username'] for teacher in teachers}, {'ms.smith', 'mr.jones'})
+
+    def test_deleted_rating_is_retracted(self):
+        popularity.loaded = False
+        self.fetch_json('/api/courses/popular?k=1')
+        cookie = self.cookie()
+        body = 'course_id=2&star=5&difficulty=&workload=&grading=&gain=&comment='
+        self.assertEqual(self.fetch('/api/rating', method='POST', body=body, headers={'Cookie': cookie}).code, 200)
+        self.assertAlmostEqual(dict(popularity.top_courses(3))[2], WEIGHTS['enroll'] + 2 * WEIGHTS['rating'], places=3)
+        with dbpool.connection() as conn:
+            (feedback_id,) = conn.execute('SELECT id FROM rating').fetchone()
+        response = self.fetch(f'/api/rating?feedback_id={feedback_id}', method='DELETE', headers={'Cookie': cookie})
+        self.assertEqual(response.code, 200)
+        self.assertAlmostEqual(dict(popularity.top_courses(3))[2], WEIGHTS['enroll'], places=3)
+
+    def test_unenrol_retracts_what_the_enrolment_still_adds(self):
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO course_students (course_id, student, enrolled_at) VALUES (2, 'jane.doe', ?)",
+                         (time.time() - HALF_LIFE,))
+            conn.commit()
+        rebuild_popularity()
+        popularity.loaded = False
+        self.fetch_json('/api/courses/popular?k=1')
+        self.assertAlmostEqual(dict(popularity.top_courses(3))[2], 1.5 * WEIGHTS['enroll'], places=3)
+
+        response = self.fetch('/api/courses/2/students?student=jane.doe', method='DELETE', headers={'Cookie': self.cookie('mr.jones')})
+        self.assertEqual(response.code, 200)
+        self.assertAlmostEqual(dict(popularity.top_courses(3))[2], WEIGHTS['enroll'], places=3)
+
+    def test_teacher_rating_comes_from_ratings(self):
+        for course_id, star in [(2, 5), (3, 2), (3, 3)]:
+            add_rating('jane.doe', star, 'Easy', 'Light', 'Fair Grading', 'High Gain', '', course_id)
+        teachers = {teacher['username']: teacher['rating'] for teacher in self.fetch_json('/api/teacher/all')}
+        self.assertEqual(teachers, {'ms.smith': 0, 'mr.jones': 10 / 3})
+
+
+class TestInbox(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            # Equal priorities and timestamps, so only the id tells some messages apart.
+            conn.executemany('''
+                INSERT INTO messages (sender, receiver, subject, body, timestamp, priority, type)
+                VALUES ('prof', 'jane.doe', ?, '', ?, ?, 'message')
+            ''', [(f'Message {i}', f'2024-01-0{1 + i % 3} 00:00:00', i % 2) for i in range(25)])
+            conn.execute("INSERT INTO messages (sender, receiver, subject, body, timestamp) VALUES ('prof', 'john.doe', 'Hi', '', '2024-01-01 00:00:00')")
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def request(self, path, username='jane.doe', **kwargs):
+        secret = self._app.settings['cookie_secret']
+        cookie = (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                  f"session_id={create_signed_value(secret, 'session_id', sessions.store.create(username)).decode()}")
+        return self.fetch(path, headers={'Cookie': cookie}, **kwargs)
+
+    def unread(self, username='jane.doe'):
+        return json.loads(self.request('/api/inbox/unread-count', username).body)['unread']
+
+    def test_cursor_pages_cover_inbox(self):
+        everything = json.loads(self.request('/api/inbox').body)
+        pages, path = [], '/api/inbox?limit=10'
+        while path:
+            response = self.request(path)
+            self.assertEqual(response.code, 200)
+            pages.append(json.loads(response.body))
+            cursor = response.headers.get('X-Next-Cursor')
+            path = f'/api/inbox?limit=10&cursor={cursor}' if cursor else None
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([message for page in pages for message in page], everything)
+        self.assertEqual(self.request('/api/inbox?cursor=not-a-cursor').code, 400)
+
+    def test_unread_count(self):
+        self.assertEqual(self.unread(), 25)
+        self.assertEqual(self.unread('newbie'), 0)
+        message_id = json.loads(self.request('/api/inbox').body)[0][8]
+
+        # Only the receiver can mark a message read, and marking it twice counts once.
+        self.assertEqual(self.request(f'/api/inbox?id={message_id}', 'john.doe', method='PUT', body='').code, 404)
+        for _ in range(2):
+            self.assertEqual(self.request(f'/api/inbox?id={message_id}', method='PUT', body='').code, 200)
+        self.assertEqual(self.unread(), 24)
+
+        self.request('/api/inbox?receiver=jane.doe&subject=Hello&body=Hi', 'john.doe', method='POST', body='')
+        self.assertEqual(self.unread(), 25)
+        with dbpool.connection() as conn:
+            conn.execute("DELETE FROM messages WHERE receiver = 'jane.doe' AND read = 0 AND subject = 'Hello'")
+            conn.execute("UPDATE messages SET receiver = 'john.doe' WHERE id = ?", (message_id,))
+            conn.commit()
+        self.assertEqual(self.unread(), 24)
+        self.assertEqual(self.unread('john.doe'), 1)
+
+
+class TestCourseBroadcasts(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.executemany('INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+                             [(name, '', f'{name}@example.com', 'student') for name in ('jane.doe', 'john.doe', 'newbie')])
+            conn.execute("INSERT INTO courses (id, title, description, owner) VALUES (1, 'Algebra', '', 'prof')")
+            conn.executemany('INSERT INTO course_students (course_id, student) VALUES (1, ?)', [('jane.doe',), ('john.doe',)])
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def request(self, path, username='jane.doe', **kwargs):
+        secret = self._app.settings['cookie_secret']
+        cookie = (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                  f"session_id={create_signed_value(secret, 'session_id', sessions.store.create(username)).decode()}")
+        return self.fetch(path, headers={'Cookie': cookie}, **kwargs)
+
+    def inbox(self, username='jane.doe', query=''):
+        return json.loads(self.request(f'/api/inbox?{query}', username).body)
+
+    def unread(self, username='jane.doe'):
+        return json.loads(self.request('/api/inbox/unread-count', username).body)['unread']
+
+    def test_notification_is_one_row(self):
+        response = self.request('/api/courses/notif?course_id=1&subject=Exam&body=Monday', 'prof', method='POST', body='')
+        self.assertEqual(response.code, 200)
+        with dbpool.connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM course_broadcasts').fetchone()[0], 1)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0], 0)
+
+        [notification] = self.inbox()
+        self.assertEqual(notification[:3], ['prof', 'jane.doe', 'Exam'])
+        self.assertEqual(notification[5:], [0, 'course', 0, -1])
+        self.assertEqual(self.inbox('newbie'), [])
+        self.assertEqual(json.loads(self.request('/api/inbox?id=-1', 'john.doe').body)[1], 'john.doe')
+        self.assertEqual(self.request('/api/inbox?id=-1', 'newbie').code, 404)
+
+        self.assertEqual(self.request('/api/inbox?id=-1', 'newbie', method='PUT', body='').code, 404)
+        self.assertEqual((self.unread(), self.unread('john.doe')), (1, 1))
+        self.assertEqual(self.request('/api/inbox?id=-1', method='PUT', body='').code, 200)
+        self.assertEqual((self.unread(), self.unread('john.doe')), (0, 1))
+        self.assertEqual(self.inbox(query='read=1')[0][5], 1)
+        self.assertEqual(self.inbox('john.doe', 'read=1'), [])
+
+    def test_broadcast_writes_do_not_grow_with_the_course(self):
+        changes = []
+        with dbpool.connection() as conn:
+            for course_id, size in [(2, 10), (3, 5000)]:
+                conn.execute("INSERT INTO courses (id, title, description, owner) VALUES (?, 'Big', '', 'prof')", (course_id,))
+                conn.executemany('INSERT INTO course_students (course_id, student) VALUES (?, ?)',
+                                 [(course_id, f'student{i}') for i in range(size)])
+                conn.commit()
+                before = conn.total_changes
+                broadcast_id = conn.execute('''
+                    INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp) VALUES (?, 'prof', 'Exam', '', '2024-01-01 00:00:00')
+                ''', (course_id,)).lastrowid
+                conn.execute("INSERT INTO course_broadcast_reads (username, broadcast_id) VALUES ('student0', ?)", (broadcast_id,))
+                conn.commit()
+                changes.append(conn.total_changes - before)
+        self.assertEqual(changes[0], changes[1])
+        self.assertEqual((self.unread('student0'), self.unread('student1')), (0, 2))
+
+    def test_unread_count_follows_enrolment(self):
+        self.request('/api/courses/notif?course_id=1&subject=Exam&body=Monday', 'prof', method='POST', body='')
+        self.request('/api/courses/notif?course_id=1&subject=Quiz&body=Friday', 'prof', method='POST', body='')
+        self.assertEqual(self.request('/api/inbox?id=-1', 'john.doe', method='PUT', body='').code, 200)
+        self.assertEqual((self.unread(), self.unread('john.doe'), self.unread('newbie')), (2, 1, 0))
+
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO course_students (course_id, student) VALUES (1, 'newbie')")
+            conn.execute("DELETE FROM course_students WHERE student = 'john.doe'")
+            conn.commit()
+        self.assertEqual((self.unread('john.doe'), self.unread('newbie')), (0, 2))
+        self.assertEqual(self.request('/api/inbox?id=-1', 'john.doe', method='PUT', body='').code, 404)
+
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO course_students (course_id, student) VALUES (1, 'john.doe')")
+            conn.execute('DELETE FROM course_broadcasts WHERE id = 2')
+            conn.commit()
+        self.assertEqual((self.unread(), self.unread('john.doe'), self.unread('newbie')), (1, 0, 1))
+
+    def test_pages_merge_messages_and_broadcasts(self):
+        with dbpool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO messages (sender, receiver, subject, body, timestamp, priority) VALUES ('prof', 'jane.doe', ?, '', ?, ?)
+            ''', [(f'Message {i}', f'2024-01-0{1 + i % 4} 00:00:00', i % 2) for i in range(12)])
+            conn.executemany('''
+                INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp, priority) VALUES (?, 'prof', ?, '', ?, ?)
+            ''', [(1 + i % 2, f'Broadcast {i}', f'2024-01-0{1 + i % 3} 00:00:00', i % 2) for i in range(12)])
+            conn.commit()
+        everything = self.inbox()
+        self.assertEqual(len(everything), 18)  # course 2 is not one of hers
+        self.assertEqual(everything, sorted(everything, key=lambda m: (m[7], m[4], m[8]), reverse=True))
+
+        pages, path = [], '/api/inbox?limit=5'
+        while path:
+            response = self.request(path)
+            pages.append(json.loads(response.body))
+            cursor = response.headers.get('X-Next-Cursor')
+            path = f'/api/inbox?limit=5&cursor={cursor}' if cursor else None
+        self.assertEqual([message for page in pages for message in page], everything)
+        self.assertEqual(self.inbox(query='limit=5&offset=5'), everything[5:10])
+        self.assertEqual(self.inbox(query='priority=1&type=course'),
+                         [message for message in everything if message[7] == 1 and message[6] == 'course'])
+
+    def test_migration_converts_course_notifications(self):
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO courses (id, title, description, owner) VALUES (2, 'Poetry', '', 'prof')")
+            conn.execute("INSERT INTO course_students (course_id, student) VALUES (2, 'jane.doe')")
+            conn.executemany('''
+                INSERT INTO messages (sender, receiver, subject, body, timestamp, read, type) VALUES ('prof', ?, ?, '', '2024-01-01 00:00:00', ?, 'course')
+            ''', [('jane.doe', 'Exam', 1), ('john.doe', 'Exam', 0),  # all of course 1
+                  ('jane.doe', 'Poem', 0),  # all of course 2
+                  ('john.doe', 'Makeup exam', 0)])  # a subset of course 1: kept as is
+            conn.commit()
+            self.assertEqual(self.unread('john.doe'), 2)
+            course_broadcasts(conn.cursor())
+            conn.commit()
+            self.assertEqual(conn.execute('SELECT course_id, subject FROM course_broadcasts ORDER BY id').fetchall(),
+                             [(1, 'Exam'), (2, 'Poem')])
+            self.assertEqual(conn.execute('SELECT subject FROM messages').fetchall(), [('Makeup exam',)])
+        self.assertEqual([(message[2], message[5]) for message in self.inbox()], [('Exam', 1), ('Poem', 0)])
+        self.assertEqual((self.unread(), self.unread('john.doe')), (1, 2))
+
+
+class TestWatchTracker(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        self.now = 1000.0
+        self.tracker = WatchTracker(idle_timeout=60, hang_up=300, clock=lambda: self.now)
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def test_timer_wheel(self):
+        wheel = TimerWheel(horizon=10, tick=1.0, now=100.0)
+        wheel.schedule('a', 103.5)
+        slot = wheel.schedule('b', 105)
+        wheel.schedule('c', 99)  # already due: the next tick
+        self.assertEqual(wheel.advance(103.9), ['c'])
+        self.assertEqual(wheel.advance(104), ['a'])
+        wheel.cancel('b', slot)
+        self.assertEqual(wheel.advance(200), [])
+        wheel.schedule('d', 215)  # beyond reach: comes due early
+        self.assertEqual(wheel.advance(211), ['d'])
+
+    def test_one_video_and_hang_up(self):
+        self.assertIsNone(self.tracker.heartbeat('jane.doe', 1))
+        self.assertEqual(self.tracker.heartbeat('jane.doe', 2), 'another_video')
+        self.tracker.stop('jane.doe', 1)
+        self.assertIsNone(self.tracker.heartbeat('jane.doe', 2))
+
+        for _ in range(60):
+            self.now += 5
+            reason = self.tracker.heartbeat('jane.doe', 2)
+        self.assertIsNone(reason)
+        self.now += 5
+        self.assertEqual(self.tracker.heartbeat('jane.doe', 2), 'hang_up')
+        self.assertIsNone(self.tracker.heartbeat('jane.doe', 2, interacted=True))
+        self.assertEqual(self.tracker.metrics()['violations'], 2)
+
+    def test_idle_sessions_end(self):
+        for user in range(100):
+            self.tracker.heartbeat(f'user{user}', 1)
+        self.now += 30
+        for user in range(50):
+            self.tracker.heartbeat(f'user{user}', 1)
+        self.now += 31
+        self.assertEqual(self.tracker.sweep(), 50)
+        self.assertEqual(len(self.tracker), 50)
+        # The live sessions were filed again under their new deadline, and nothing else is kept.
+        self.assertEqual(len(self.tracker._wheel), 50)
+        self.assertIsNone(self.tracker.heartbeat('user99', 2))
+
+        self.now += 30
+        self.assertEqual(self.tracker.sweep(), 50)
+        self.assertEqual((len(self.tracker), len(self.tracker._wheel)), (1, 1))
+        for _ in range(1000):
+            self.tracker.stop('user99', 2)
+            self.tracker.heartbeat('user99', 2)
+        self.assertEqual(len(self.tracker._wheel), 1)
+
+    @gen_test
+    async def test_watch_time_written_behind(self):
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO chapters (id, title, content, course_id) VALUES (7, 'Intro', '', 1)")
+            conn.commit()
+        self.tracker.configure({'complete_after': 100, 'max_gap': 15})
+        for _ in range(10):
+            self.now += 5
+            self.tracker.heartbeat('jane.doe', 7, interacted=True)
+            self.tracker.heartbeat('john.doe', 8, interacted=True)  # no such chapter
+        self.now += 40  # a gap only counts up to max_gap
+        self.tracker.heartbeat('jane.doe', 7)
+        self.assertEqual(await self.tracker.flush(), 2)
+        self.assertEqual(await self.tracker.flush(), 0)
+
+        def saved():
+            with dbpool.connection() as conn:
+                return (conn.execute('SELECT username, chapter_id, watched FROM watch_sessions').fetchall(),
+                        conn.execute('SELECT chapter_id, username FROM course_progress').fetchall())
+        self.assertEqual(saved(), ([('jane.doe', 7, 60.0)], []))
+
+        for _ in range(8):
+            self.now += 5
+            self.tracker.heartbeat('jane.doe', 7)
+        await self.tracker.flush()
+        self.assertEqual(saved(), ([('jane.doe', 7, 100.0)], [(7, 'jane.doe')]))
+        self.assertEqual(self.tracker.metrics()['completed'], 1)
+
+    def test_handler(self):
+        secret = self._app.settings['cookie_secret']
+        cookie = (f"user={create_signed_value(secret, 'user', 'jane.doe').decode()}; "
+                  f"session_id={create_signed_value(secret, 'session_id', sessions.store.create('jane.doe')).decode()}")
+
+        def post(body):
+            response = self.fetch('/api/anticheat', method='POST', body=json.dumps(body), headers={'Cookie': cookie})
+            return response.code, json.loads(response.body) if response.code == 200 else None
+
+        watch_tracker.configure({})
+        self.assertEqual(post({'chapter_id': 1}), (200, {'violation': False}))
+        self.assertEqual(post({'chapter_id': 2}), (200, {'violation': True, 'reason': 'another_video'}))
+        self.assertEqual(post({'chapter_id': 1, 'playing': False}), (200, {'violation': False}))
+        self.assertEqual(post({'chapter_id': 2, 'interacted': True}), (200, {'violation': False}))
+        self.assertEqual(post({'watch_time': 10})[0], 400)
+        watch_tracker.configure({})
+
+
+class TestInboxPush(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        inbox_feed._last_ids = None
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO messages (sender, receiver, subject, body, timestamp) VALUES ('prof', 'jane.doe', 'Old', '', '2024-01-01 00:00:00')")
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def cookie(self, username):
+        secret = self._app.settings['cookie_secret']
+        return (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                f"session_id={create_signed_value(secret, 'session_id', sessions.store.create(username)).decode()}")
+
+    def send(self, receiver, subject):
+        return self.http_client.fetch(self.get_url(f'/api/inbox?receiver={receiver}&subject={subject}&body=Hi'),
+                                      method='POST', body='', headers={'Cookie': self.cookie('prof')})
+
+    @gen_test
+    async def test_hub_cuts_off_slow_subscribers(self):
+        hub = Hub(max_queue=2)
+        fast, slow = hub.subscribe('jane.doe'), hub.subscribe('jane.doe')
+        self.assertEqual(hub.publish('jane.doe', 1), 2)
+        self.assertEqual(hub.publish('john.doe', 1), 0)
+        self.assertEqual(await fast.get(), [1])
+        hub.publish('jane.doe', 2)
+        hub.publish('jane.doe', 3)
+        self.assertEqual(await fast.get(), [2, 3])
+        with self.assertRaises(QueueOverflow):
+            await slow.get()
+        self.assertEqual(await fast.get(timeout=0.01), [])
+        fast.close()
+        slow.close()
+        self.assertEqual(hub.metrics(), {'subscriptions': 0, 'keys': 0, 'published': 4, 'overflows': 1})
+
+    @gen_test
+    async def test_websocket(self):
+        url = self.get_url('/api/inbox/ws?after=0').replace('http', 'ws', 1)
+        socket = await websocket_connect(HTTPRequest(url, headers={'Cookie': self.cookie('jane.doe')}))
+        self.assertEqual(json.loads(await socket.read_message())[2], 'Old')
+        await self.send('john.doe', 'Other')
+        await self.send('jane.doe', 'New')
+        message = json.loads(await socket.read_message())
+        self.assertEqual(message[:3], ['prof', 'jane.doe', 'New'])
+        socket.close()
+
+        with self.assertRaises(Exception):
+            await websocket_connect(url)
+
+    @gen_test
+    async def test_websocket_broadcasts(self):
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO courses (id, title, description, owner) VALUES (1, 'Algebra', '', 'prof')")
+            conn.execute("INSERT INTO course_students (course_id, student) VALUES (1, 'jane.doe')")
+            conn.execute("INSERT INTO course_broadcasts (course_id, sender, subject, body, timestamp) VALUES (1, 'prof', 'Before', '', '2024-01-01 00:00:00')")
+            conn.commit()
+        url = self.get_url('/api/inbox/ws?after=1:0').replace('http', 'ws', 1)
+        socket = await websocket_connect(HTTPRequest(url, headers={'Cookie': self.cookie('jane.doe')}))
+        self.assertEqual(json.loads(await socket.read_message())[2:], ['Before', '', '2024-01-01 00:00:00', 0, 'course', 0, -1])
+        await self.http_client.fetch(self.get_url('/api/courses/notif?course_id=1&subject=After&body=Hi'),
+                                     method='POST', body='', headers={'Cookie': self.cookie('prof')})
+        message = json.loads(await socket.read_message())
+        self.assertEqual((message[1], message[2], message[8]), ('jane.doe', 'After', -2))
+        socket.close()
+
+    @gen_test
+    async def test_event_stream(self):
+        stream = await TCPClient().connect('127.0.0.1', self.get_http_port())
+        await stream.write(f"GET /api/inbox/events HTTP/1.1\r\nHost: localhost\r\n"
+                           f"Cookie: {self.cookie('jane.doe')}\r\nLast-Event-ID: 1\r\n\r\n".encode())
+        headers = (await stream.read_until(b'\r\n\r\n')).decode()
+        self.assertIn('text/event-stream', headers)
+        await self.send('jane.doe', 'New')
+        events = (await stream.read_until(b'New')).decode()
+        self.assertNotIn('Old', events)
+        self.assertIn('id: 2\n', events)
+
+        stream.close()
+        while inbox_hub.has_subscribers():
+            await tornado.gen.sleep(0.01)
+
+
+class TestPostFeed(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        post_feed_cache.clear()
+        with dbpool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO posts (course_id, title, sender_name, content, likes, tag, date_submitted) VALUES (?, ?, 'jane.doe', '', 0, ?, ?)
+            ''', [(1 + i % 2, f'Post {i}', ['Tech', 'Career', 'Health'][i % 3], f'2024-01-{1 + i // 4:02} 12:00:00')
+                  for i in range(30)])
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def pages(self, query):
+        pages, path = [], f'/api/posts/feed?limit=7&{query}'
+        while path:
+            page = json.loads(self.fetch(path).body)
+            pages.append([post['title'] for post in page['posts']])
+            path = f"/api/posts/feed?limit=7&{query}&cursor={page['next_cursor']}" if page['next_cursor'] else None
+        return pages
+
+    def test_pages_and_filters(self):
+        with dbpool.connection() as conn:
+            rows = conn.execute('SELECT title, course_id, tag FROM posts ORDER BY date_submitted DESC, id DESC').fetchall()
+        for query, keep in [('', lambda course, tag: True),
+                            ('course_id=2', lambda course, tag: course == 2),
+                            ('tag=Tech', lambda course, tag: tag == 'Tech'),
+                            ('course_id=1&tag=Career', lambda course, tag: course == 1 and tag == 'Career')]:
+            with self.subTest(query=query):
+                pages = self.pages(query)
+                self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+                self.assertEqual([title for page in pages for title in page],
+                                 [title for title, course, tag in rows if keep(course, tag)])
+        self.assertEqual(self.fetch('/api/posts/feed?limit=500').code, 400)
+        self.assertEqual(self.fetch('/api/posts/feed?cursor=nope').code, 400)
+
+    def test_etag_and_cache(self):
+        first = self.fetch('/api/posts/feed?tag=Tech')
+        etag = first.headers['Etag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(self.fetch('/api/posts/feed?tag=Tech').body, first.body)
+        self.assertEqual(post_feed_cache.hits, 1)
+        self.assertEqual(self.fetch('/api/posts/feed?tag=Tech', headers={'If-None-Match': etag}).code, 304)
+
+        response = self.fetch('/api/posts', method='POST', body=json.dumps(
+            {'sender_name': 'john.doe', 'title': 'Fresh', 'course_id': 1, 'content': 'Hi', 'tag': 'Tech'}))
+        self.assertEqual(response.code, 201)
+        response = self.fetch('/api/posts/feed?tag=Tech', headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertNotEqual(response.headers['Etag'], etag)
+        self.assertEqual(json.loads(response.body)['posts'][0]['title'], 'Fresh')
+
+    def test_forged_cursors_do_not_grow_the_cache(self):
+        for i in range(200):
+            cursor = base64.urlsafe_b64encode(json.dumps([f'2024-02-{i}', i]).encode()).decode()
+            self.assertEqual(self.fetch(f'/api/posts/feed?limit=100&cursor={cursor}').code, 200)
+            self.assertEqual(self.fetch(f'/api/posts/feed?limit=99&cursor={cursor}').code, 200)
+        self.assertLessEqual(sum(len(entries) for entries in post_feed_cache._groups.values()), post_feed_cache.max_entries)
+
+
+class TestPostSearch(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            cursor = conn.cursor()
+            for title, content in [('Zebra grading policy', 'How are the labs graded?'),
+                                   ('Lab question', 'The zebra lab <script> is due Friday'),
+                                   ('Off topic', 'Nothing to see here')]:
+                cursor.execute("INSERT INTO posts (course_id, title, sender_name, content, likes, tag) VALUES (1, ?, 'jane.doe', ?, 0, 'Tech')",
+                               (title, content))
+                self.post_id = cursor.lastrowid
+                cursor.execute("INSERT INTO post_comments (post_id, floor, commenter_name, comment_content) VALUES (?, 1, 'jane.doe', ?)",
+                               (self.post_id, content))
+            cursor.executemany("INSERT INTO post_comments (post_id, floor, commenter_name, comment_content) VALUES (?, ?, 'john.doe', ?)",
+                               [(self.post_id, floor, f'Reply {floor} about zebras') for floor in range(2, 12)])
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def search(self, query):
+        response = self.fetch(f'/api/search/posts?{query}')
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_ranking_and_snippets(self):
+        results = self.search('q=zebra')['results']
+        # Title matches rank first; floor 1 repeats the post, so it is not a separate result.
+        self.assertEqual((results[0]['type'], results[0]['title']), ('post', 'Zebra grading policy'))
+        self.assertEqual(len(results), 12)
+        self.assertEqual({result['floor'] for result in results if result['type'] == 'reply'}, set(range(2, 12)))
+        lab = next(result for result in results if result['title'] == 'Lab question')
+        self.assertIn('<mark>zebra</mark> lab &lt;script&gt;', lab['snippet'])
+        self.assertEqual([result['title'] for result in self.search('q=grade')['results']], ['Zebra grading policy'])
+        self.assertEqual(len(self.search('q=zeb*')['results']), 12)
+        self.assertEqual(self.search('q=zebra+friday')['results'][0]['title'], 'Lab question')
+        self.assertEqual(self.search('q=%22AND+%28NEAR')['results'], [])
+
+    def test_pagination(self):
+        everything = self.search('q=zebra&limit=50')['results']
+        pages, path = [], 'q=zebra&limit=5'
+        while path:
+            page = self.search(path)
+            pages.append(page['results'])
+            path = f"q=zebra&limit=5&offset={page['next_offset']}" if page['next_offset'] else None
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual([result for page in pages for result in page], everything)
+        self.assertEqual(self.fetch('/api/search/posts?q=zebra&limit=500').code, 400)
+        self.assertEqual(self.fetch('/api/search/posts?q=zebra&offset=-1').code, 400)
+
+    def test_index_follows_changes(self):
+        with dbpool.connection() as conn:
+            conn.execute("UPDATE posts SET title = 'Quagga grading policy' WHERE title = 'Zebra grading policy'")
+            conn.execute("UPDATE post_comments SET comment_content = 'Reply about quaggas' WHERE floor = 2")
+            conn.execute('DELETE FROM post_comments WHERE floor = 3')
+            conn.execute("DELETE FROM posts WHERE title = 'Lab question'")
+            conn.commit()
+        self.assertEqual({(result['title'], result.get('floor')) for result in self.search('q=quagga')['results']},
+                         {('Quagga grading policy', None), ('Off topic', 2)})
+        self.assertEqual(len(self.search('q=zebra')['results']), 8)
+
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO post_replies_fts (post_replies_fts) VALUES ('integrity-check')")
+            conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('integrity-check')")
+        self.assertEqual(rebuild_search_index(), 11)
+        self.assertEqual(len(self.search('q=zebra')['results']), 8)
+
+
+class TestCourseSearch(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.executemany('INSERT INTO courses (id, title, description, owner, category, type) VALUES (?, ?, ?, ?, ?, ?)', [
+                (1, 'Linear Algebra', 'Vectors and matrices', 'ms.smith', 'Mathematics', 'open'),
+                (2, 'Algebra Basics', 'Equations', 'ms.smith', 'Mathematics', 'closed'),
+                (3, 'Physics I', 'Mechanics with some algebra', 'mr.jones', 'Physics', 'open'),
+                (4, 'Poetry', 'Reading poems', 'mr.jones', 'Literature', 'open'),
+            ])
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def search(self, query):
+        secret = self._app.settings['cookie_secret']
+        cookie = (f"user={create_signed_value(secret, 'user', 'jane.doe').decode()}; "
+                  f"session_id={create_signed_value(secret, 'session_id', sessions.store.create('jane.doe')).decode()}")
+        response = self.fetch(f'/api/course/search?{query}', headers={'Cookie': cookie})
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_ranking_and_facets(self):
+        result = self.search('q=algebra')
+        self.assertEqual(result['total'], 3)
+        self.assertEqual([course['id'] for course in result['courses']][2], 3)  # only the description matches
+        self.assertEqual(result['facets'], {'category': [['Mathematics', 2], ['Physics', 1]], 'type': [['open', 2], ['closed', 1]]})
+
+        result = self.search('q=algebra&type=open')
+        self.assertEqual([course['id'] for course in result['courses']], [1, 3])
+        # Each facet counts the matches narrowed by the other one.
+        self.assertEqual(result['facets'], {'category': [['Mathematics', 1], ['Physics', 1]], 'type': [['open', 2], ['closed', 1]]})
+        self.assertEqual(self.search('q=mathematic')['total'], 2)
+
+        result = self.search('category=Literature')
+        self.assertEqual([course['title'] for course in result['courses']], ['Poetry'])
+        self.assertEqual(result['facets']['category'][0], ['Mathematics', 2])
+
+    def test_pagination_and_sync(self):
+        first = self.search('limit=3')
+        self.assertEqual(([course['id'] for course in first['courses']], first['next_offset']), ([1, 2, 3], 3))
+        last = self.search('limit=3&offset=3')
+        self.assertEqual(([course['id'] for course in last['courses']], last['next_offset']), ([4], None))
+
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO courses (title, description, owner, category) VALUES ('Topology', 'Open sets', 'ms.smith', 'Mathematics')")
+            conn.execute("UPDATE courses SET description = 'Rhymes' WHERE id = 4")
+            conn.commit()
+        self.assertEqual([course['title'] for course in self.search('q=topology')['courses']], ['Topology'])
+        self.assertEqual(self.search('q=poems')['total'], 0)
+        self.assertEqual(self.search('q=rhymes')['total'], 1)
+
+
+class TestUserSearch(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.executemany("INSERT INTO users (username, password_hash, email, role) VALUES (?, '', ?, ?)",
+                             [(name, f'{name}@example.com', role) for name, role in [
+                                 ('annabel', 'student'), ('Anna', 'student'), ('joanna', 'student'), ('hannah', 'student'),
+                                 ('anna_t', 'teacher'), ('an%na', 'student'), ('bob', 'student')]])
+            conn.commit()
+        super().setUp()
+
+    def get_app(self):
+        return make_app()
+
+    def search(self, query):
+        response = self.fetch(f'/api/users/search?{query}')
+        self.assertEqual(response.code, 200)
+        return [user['username'] for user in json.loads(response.body)]
+
+    def test_prefix_matches_first(self):
+        self.assertEqual(self.search('query=ANN'), ['Anna', 'annabel', 'joanna', 'hannah'])
+        self.assertEqual(self.search('query=ann&limit=3'), ['Anna', 'annabel', 'joanna'])
+        self.assertEqual(self.search('query=an'), ['an%na', 'Anna', 'annabel'])
+        self.assertEqual(self.search('query=an%25'), ['an%na'])
+        self.assertEqual(self.search('query=nnab'), ['annabel'])
+        self.assertEqual(self.search('query=%20'), [])
+        self.assertEqual(self.fetch('/api/users/search?query=ann&limit=0').code, 400)
+
+    def test_index_follows_changes(self):
+        with dbpool.connection() as conn:
+            conn.execute("UPDATE users SET username = 'roberta' WHERE username = 'bob'")
+            conn.execute("DELETE FROM users WHERE username = 'joanna'")
+            conn.commit()
+        self.assertEqual(self.search('query=bert'), ['roberta'])
+        self.assertEqual(self.search('query=bob'), [])
+        self.assertEqual(self.search('query=anna'), ['Anna', 'annabel', 'hannah'])
+
+
+class TestPasswords(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, 'student')",
+                         ('jane.doe', bcrypt.hashpw(b'secret', bcrypt.gensalt(rounds=4)), 'jane@example.com'))
+            conn.commit()
+        login_throttle.configure({'user_burst': 2})
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        password_hasher.shutdown()
+        login_throttle.configure({})
+
+    def get_app(self):
+        return make_app()
+
+    def test_token_buckets(self):
+        now = [0.0]
+        buckets = TokenBuckets(rate=0.5, burst=2, max_keys=2, clock=lambda: now[0])
+        self.assertEqual([buckets.take('a'), buckets.take('a')], [0, 0])
+        self.assertEqual(buckets.take('a'), 2.0)
+        now[0] += 1
+        self.assertEqual(buckets.take('a'), 1.0)  # the refused attempt used up the refill
+        now[0] += 2
+        self.assertEqual(buckets.take('a'), 0)
+        buckets.take('b')
+        buckets.take('c')
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets.take('a'), 0)  # forgotten: a full bucket again
+
+        throttle = LoginThrottle(clock=lambda: now[0])
+        throttle.configure({'ip_burst': 3, 'user_burst': 1})
+        self.assertEqual(throttle.check('10.0.0.1', 'jane.doe'), 0)
+        self.assertGreater(throttle.check('10.0.0.1', 'jane.doe'), 0)
+        self.assertEqual(throttle.check('10.0.0.1', 'john.doe'), 0)
+        self.assertGreater(throttle.check('10.0.0.1', 'joan.doe'), 0)
+        self.assertEqual(throttle.metrics(), {'ips': 1, 'usernames': 2, 'throttled': 2})
+
+    @gen_test(timeout=30)
+    async def test_hasher(self):
+        password_hash = await password_hasher.hash('secret')
+        self.assertTrue(await password_hasher.verify('secret', password_hash))
+        self.assertFalse(await password_hasher.verify('wrong', password_hash))
+        self.assertFalse(await password_hasher.verify('secret', None))
+        self.assertEqual(password_hasher.metrics()['completed'], 4)
+
+        hasher = PasswordHasher(max_queue=0)
+        with self.assertRaises(HasherBusy):
+            await hasher.verify('secret', password_hash)
+        self.assertEqual(hasher.metrics()['rejected'], 1)
+
+    def test_login_throttled(self):
+        def login(password):
+            return self.fetch('/api/login', method='POST', body=f'username=jane.doe&password={password}')
+
+        self.assertTrue(json.loads(login('secret').body)['success'])
+        self.assertFalse(json.loads(login('guess').body)['success'])
+        response = login('secret')
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers['Retry-After'], '10')
+        self.assertEqual(login_throttle.metrics()['throttled'], 1)
+
+
+class TestVectorIndex(unittest.TestCase):
+    def vectors(self, count, seed):
+        import numpy as np
+
+        vectors = np.random.default_rng(seed).standard_normal((count, 32)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def check_index(self, index, min_recall):
+        import numpy as np
+
+        vectors = self.vectors(1000, 1)
+        index.add(range(1000), vectors)
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(index.search(vectors[7], 1)[0][0], 7)
+        self.assertNotIn(7, [item_id for item_id, _ in index.search(vectors[7], 10, exclude={7})])
+
+        found = 0
+        for query in self.vectors(50, 2):
+            exact = set(np.argsort(-(vectors @ query))[:10].tolist())
+            found += len(exact & {item_id for item_id, _ in index.search(query, 10)})
+        self.assertGreaterEqual(found / 500, min_recall)
+
+        index.remove(range(100))
+        self.assertEqual(len(index), 900)
+        self.assertNotIn(5, index)
+        self.assertNotIn(5, [item_id for item_id, _ in index.search(vectors[5], 50)])
+
+        replacement = self.vectors(2, 3)
+        index.add([5, 500], replacement)
+        self.assertEqual(len(index), 901)
+        self.assertEqual(index.search(replacement[0], 1)[0][0], 5)
+        self.assertEqual(index.search(replacement[1], 1)[0][0], 500)
+        np.testing.assert_allclose(index.get(500), replacement[1], atol=1e-6)
+
+    def test_flat_index(self):
+        self.check_index(FlatIndex(32), 1.0)
+
+    def test_ivf_index(self):
+        self.check_index(IVFIndex(32, min_train_size=200), 0.5)
+
+    @unittest.skipIf(importlib.util.find_spec('hnswlib') is None, 'hnswlib is not installed')
+    def test_hnsw_index(self):
+        self.check_index(HNSWIndex(32, capacity=100), 0.9)
+
+    def test_hnsw_falls_back_to_ivf(self):
+        with unittest.mock.patch('importlib.util.find_spec', return_value=None), self.assertLogs('vectorindex', 'WARNING'):
+            self.assertIsInstance(make_index('hnsw', 32), IVFIndex)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough of the Redis protocol (GET, SET [EX], DEL, PING) to test
+    RedisSessionBackend without a Redis server.
+    """
+    def read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def handle(self):
+        data = self.server.data
+        while (args := self.read_command()) is not None:
+            command = args[0].upper()
+            if command == 'PING':
+                self.wfile.write(b'+PONG\r\n')
+            elif command == 'SET':
+                expires = time.time() + int(args[4]) if len(args) > 4 else None
+                data[args[1]] = (args[2], expires)
+                self.wfile.write(b'+OK\r\n')
+            elif command == 'GET':
+                value, expires = data.get(args[1], (None, None))
+                if value is None or (expires is not None and expires <= time.time()):
+                    self.wfile.write(b'$-1\r\n')
+                else:
+                    self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value.encode()))
+            elif command == 'DEL':
+                self.wfile.write(b':%d\r\n' % (data.pop(args[1], None) is not None))
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        use_temp_database()
+
+    def check_backend(self, backend):
+        backend.set('jane.doe', 'first', 60)
+        self.assertEqual(backend.get('jane.doe'), 'first')
+        backend.set('jane.doe', 'second', 60)
+        self.assertEqual(backend.get('jane.doe'), 'second')
+        backend.delete('jane.doe')
+        self.assertIsNone(backend.get('jane.doe'))
+        backend.set('jane.doe', 'expired', 0)
+        self.assertIsNone(backend.get('jane.doe'))
+
+    def test_memory_backend(self):
+        self.check_backend(MemorySessionBackend())
+
+    def test_sqlite_backend(self):
+        self.check_backend(SQLiteSessionBackend())
+
+    def test_redis_backend(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+        server.daemon_threads = True
+        server.data = {}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = RedisSessionBackend(f'redis://127.0.0.1:{server.server_address[1]}/0')
+        try:
+            self.check_backend(backend)
+        finally:
+            backend.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_single_login_across_processes(self):
+        # Two stores sharing one backend stand in for two server processes.
+        first, second = SessionStore(SQLiteSessionBackend()), SessionStore(SQLiteSessionBackend(), cache_ttl=0)
+        old = first.create('jane.doe')
+        self.assertTrue(second.validate('jane.doe', old))
+        new = second.create('jane.doe')
+        self.assertTrue(first.validate('jane.doe', new))
+        self.assertFalse(second.validate('jane.doe', old))
+        first.revoke('jane.doe')
+        self.assertFalse(second.validate('jane.doe', new))
+
+
+class TestSessionLookup(AsyncHTTPTestCase):
+    def setUp(self):
+        use_temp_database()
+        self.lookups = []
+        backend = MemorySessionBackend()
+        get = backend.get
+        backend.get = lambda username: self.lookups.append(threading.current_thread()) or get(username)
+        self.saved_store, sessions.store = sessions.store, SessionStore(backend, cache_ttl=0)
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        sessions.store = self.saved_store
+
+    def get_app(self):
+        return make_app()
+
+    def fetch_as(self, username, session_id):
+        secret = self.get_app().settings['cookie_secret']
+        response = self.fetch('/api/', headers={'Cookie': (
+            f"user={create_signed_value(secret, 'user', username).decode()}; "
+            f"session_id={create_signed_value(secret, 'session_id', session_id).decode()}")})
+        return json.loads(response.body)['username']
+
+    def test_backend_is_asked_off_the_ioloop(self):
+        session_id = sessions.store.create('jane.doe')
+        self.assertEqual(self.fetch_as('jane.doe', session_id), 'jane.doe')
+        self.assertIsNone(self.fetch_as('jane.doe', 'forged'))
+        self.assertEqual(len(self.lookups), 2)
+        self.assertNotIn(threading.main_thread(), self.lookups)
+
+        sessions.store.cache_ttl = 60
+        self.lookups.clear()
+        self.assertEqual(self.fetch_as('jane.doe', sessions.store.create('jane.doe')), 'jane.doe')
+        self.assertEqual(self.lookups, [])  # the cache vouched for it
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to test OutboxSender without a mail server. Records
+    (receiver, message) for each delivery and answers RCPT for the recipients in
+    `server.replies` with the given reply.
+    """
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        receiver = None
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(' ')[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'RCPT':
+                receiver = command.partition(':')[2].strip('<> ')
+                self.reply(self.server.replies.get(receiver, '250 OK'))
+            elif verb == 'DATA':
+                self.reply('354 Go ahead')
+                message = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.delivered.append((receiver, message.decode()))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:  # MAIL, RSET, NOOP
+                self.reply('250 OK')
+
+
+class TestEmailOutbox(unittest.TestCase):
+    def setUp(self):
+        use_temp_database()
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeSMTPHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.delivered = []
+        self.server.replies = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.sender = self.make_sender(self.server.server_address[1])
+
+    def tearDown(self):
+        self.sender.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_sender(self, port):
+        return OutboxSender({'sender': 'noreply@example.com', 'password': '',
+                             'host': '127.0.0.1', 'port': port, 'ssl': False},
+                            batch_size=10, max_attempts=2, backoff=0)
+
+    def statuses(self):
+        with dbpool.connection() as conn:
+            return dict(conn.execute('SELECT receiver, status FROM email_outbox').fetchall())
+
+    def test_batches_share_one_connection(self):
+        queue_emails([(f'student{i}@example.com', 'Notice', f'Hello {i}') for i in range(25)])
+        self.assertEqual([self.sender.run_once() for _ in range(4)], [10, 10, 5, 0])
+        self.assertEqual(len(self.server.delivered), 25)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(outbox_status(), {'sent': 25, 'oldest_pending_age': 0.0})
+
+    def test_retries_and_failures(self):
+        self.server.replies = {'busy@example.com': '451 Try again later',
+                               'nobody@example.com': '550 No such user'}
+        queue_emails([(receiver, 'Notice', 'Hello') for receiver in
+                      ('ok@example.com', 'busy@example.com', 'nobody@example.com')])
+        self.sender.run_once()
+        self.assertEqual(self.statuses(), {'ok@example.com': 'sent', 'busy@example.com': 'pending',
+                                           'nobody@example.com': 'failed'})
+        self.sender.run_once()
+        self.assertEqual(self.statuses()['busy@example.com'], 'failed')
+        self.assertEqual([receiver for receiver, _ in self.server.delivered], ['ok@example.com'])
+
+    def test_lost_lease_is_not_recorded(self):
+        queue_emails([('ok@example.com', 'Notice', 'Hello'), ('late@example.com', 'Notice', 'Hello')])
+        batch, lease = self.sender._claim()
+        with dbpool.connection() as conn:
+            # Another sender reclaimed the first email after this lease ran out.
+            conn.execute("UPDATE email_outbox SET next_attempt_at = ? WHERE receiver = 'ok@example.com'", (lease + 1,))
+            conn.commit()
+        self.sender._deliver(batch[:1], lease)
+        self.assertEqual(self.statuses(), {'ok@example.com': 'sending', 'late@example.com': 'sending'})
+        self.sender._deliver(batch[1:], time.time() - 1)
+        self.assertEqual([receiver for receiver, _ in self.server.delivered], ['ok@example.com'])
+        self.assertEqual(self.statuses()['late@example.com'], 'sending')
+
+    def test_unreachable_server_is_retried(self):
+        unreachable = self.make_sender(self.server.server_address[1])
+        unreachable.settings['host'] = '127.0.0.2'
+        unreachable.settings['port'] = 1
+        queue_emails([('ok@example.com', 'Notice', 'Hello')])
+        self.assertEqual(unreachable.run_once(), 1)
+        self.assertEqual(self.statuses(), {'ok@example.com': 'pending'})
+        self.assertEqual(self.sender.run_once(), 1)
+        self.assertEqual(self.statuses(), {'ok@example.com': 'sent'})
+
+
+def multipart_body(boundary, fields, files):
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    return b''.join(parts) + f'--{boundary}--\r\n'.encode()
+
+
+class TestMultipartParser(unittest.TestCase):
+    def test_matches_tornado_parser_for_any_chunking(self):
+        rng = random.Random(7)
+        boundary = 'xYzBoundary'
+        # Content that contains most of a delimiter to catch split matches.
+        content = bytes(rng.randrange(256) for _ in range(50000)) + b'\r\n--xYzBoundar' + b'tail'
+        body = multipart_body(boundary, {'chapter_id': '12'}, {'file': ('lecture.mp4', content)})
+
+        fields, files = {}, {}
+        parse_multipart_form_data(boundary.encode(), body, fields, files)
+
+        for chunk_size in (1, 7, 64, 4096, len(body)):
+            parser = MultipartParser(boundary.encode())
+            parts, current = [], None
+            for i in range(0, len(body), chunk_size):
+                for kind, value in parser.feed(body[i:i + chunk_size]):
+                    if kind == 'headers':
+                        current = [value.get_param('name', header='content-disposition'), value.get_filename(), b'']
+                    elif kind == 'data':
+                        current[2] += value
+                    else:
+                        parts.append(tuple(current))
+            self.assertTrue(parser.finished)
+            self.assertEqual(parts, [('chapter_id', None, fields['chapter_id'][0]),
+                                     ('file', 'lecture.mp4', files['file'][0]['body'])])
+
+
+class TestStreamingUpload(AsyncHTTPTestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        use_temp_database()
+        with dbpool.connection() as conn:
+            conn.execute("INSERT INTO courses (id, title, description, owner, category) VALUES (1, 'CS101', '', 'ms.smith', 'General')")
+            conn.execute("INSERT INTO chapters (id, title, content, type, course_id) VALUES (1, 'Intro', '', 'teaching', 1)")
+            conn.commit()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        os.chdir(self.cwd)
+
+    def get_app(self):
+        return make_app()
+
+    def cookie(self, username):
+        secret = self._app.settings['cookie_secret']
+        session_id = sessions.store.create(username)
+        return (f"user={create_signed_value(secret, 'user', username).decode()}; "
+                f"session_id={create_signed_value(secret, 'session_id', session_id).decode()}")
+
+    def upload(self, username, content, filename='notes.pdf'):
+        body = multipart_body('b0undary', {'chapter_id': '1'}, {'file': (filename, content)})
+        return self.fetch('/api/courseware', method='POST', body=body, headers={
+            'Cookie': self.cookie(username), 'Content-Type': 'multipart/form-data; boundary=b0undary'})
+
+    def download(self, path, headers=None, username='ms.smith'):
+        headers = dict(headers or {}, Cookie=self.cookie(username))
+        return self.fetch(f'/api/files/courseware/1/{path}', headers=headers)
+
+    def blobs(self):
+        with dbpool.connection() as conn:
+            return conn.execute('SELECT sha256, refcount FROM blobs ORDER BY sha256').fetchall()
+
+    def test_upload_is_saved_and_temp_file_removed(self):
+        content = os.urandom(3 * 1024 * 1024)
+        response = self.upload('ms.smith', content)
+        self.assertEqual(response.code, 200)
+        response = self.download('notes.pdf')
+        self.assertEqual(response.body, content)
+        self.assertEqual(response.headers['Content-Type'], 'application/pdf')
+        self.assertEqual(os.listdir('files/tmp'), [])
+
+    def test_rejected_upload_leaves_nothing_behind(self):
+        response = self.upload('jane.doe', b'not yours')
+        self.assertEqual(response.code, 403)
+        self.assertEqual(self.blobs(), [])
+        time.sleep(0.05)  # temp files are removed on the upload thread pool
+        self.assertEqual(os.listdir('files/tmp'), [])
+
+    def test_versions_share_deduplicated_blobs(self):
+        self.upload('ms.smith', b'first draft')
+        self.upload('ms.smith', b'final')
+        self.upload('ms.smith', b'final', filename='copy.pdf')
+        self.assertEqual(len(self.blobs()), 2)
+        self.assertEqual(sorted(refcount for _, refcount in self.blobs()), [1, 2])
+
+        latest = self.download('notes.pdf')
+        self.assertEqual(latest.body, b'final')
+        self.assertEqual(self.download('notes.pdf?version=1').body, b'first draft')
+        self.assertEqual(self.download('notes.pdf?version=3').code, 404)
+        self.assertEqual(self.download('notes.pdf', {'If-None-Match': latest.headers['Etag']}).code, 304)
+
+        self.fetch('/api/courseware?chapter_id=1&filename=notes.pdf', method='DELETE',
+                   headers={'Cookie': self.cookie('ms.smith')})
+        self.assertEqual([refcount for _, refcount in self.blobs()], [1])
+        self.assertEqual(self.download('copy.pdf').body, b'final')
+        self.assertEqual(self.download('notes.pdf').code, 404)
+
+    def test_range_and_conditional_requests(self):
+        content = bytes(range(256)) * 1024
+        self.upload('ms.smith', content, filename='lecture.mp4')
+        response = self.download('lecture.mp4', {'Range': 'bytes=1000-1999'})
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 1000-1999/{len(content)}')
+        self.assertEqual(response.body, content[1000:2000])
+        self.assertEqual(response.headers['Content-Type'], 'video/mp4')
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+
+        pinned = self.download('lecture.mp4?version=1')
+        self.assertEqual(pinned.headers['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(self.download('lecture.mp4', {'If-Modified-Since': pinned.headers['Last-Modified']}).code, 304)
+        self.assertEqual(self.download('lecture.mp4', {'Range': f'bytes={len(content)}-'}).code, 416)
+
+    def test_missing_files_are_not_cached(self):
+        courseware_access_cache.clear()
+        for i in range(20):
+            self.assertEqual(self.download(f'missing-{i}.pdf', username='jane.doe').code, 403)
+            self.assertEqual(self.download(f'missing-{i}.pdf').code, 404)
+        self.assertEqual(courseware_access_cache.metrics()['groups'], 0)
+        self.upload('ms.smith', b'slides', filename='slides.pdf')
+        self.assertEqual(self.download('slides.pdf').code, 200)
+        self.assertEqual(courseware_access_cache.metrics()['groups'], 1)
+
+    def test_visibility_change_invalidates_cached_access(self):
+        self.upload('ms.smith', b'slides', filename='slides.pdf')
+        self.assertEqual(self.download('slides.pdf', username='jane.doe').code, 200)
+        response = self.fetch('/api/courseware', method='PUT', body='chapter_id=1&filename=slides.pdf&is_visible=0&is_downloadable=0',
+                              headers={'Cookie': self.cookie('ms.smith'), 'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.download('slides.pdf', username='jane.doe').code, 403)
+        self.assertEqual(self.download('slides.pdf').code, 200)
+
+    def test_chunked_form_is_parsed(self):
+        self.upload('ms.smith', b'slides', filename='slides.pdf')
+
+        async def body_producer(write):
+            for chunk in (b'chapter_id=1&filename=slid', b'es.pdf&is_visible=0&is_downloadable=0'):
+                await write(chunk)
+
+        # No Content-Length: the body is sent with chunked transfer encoding.
+        response = self.fetch('/api/courseware', method='PUT', body_producer=body_producer,
+                              headers={'Cookie': self.cookie('ms.smith'), 'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.download('slides.pdf', username='jane.doe').code, 403)
+
+    def test_empty_filename_is_rejected(self):
+        for filename in ('', '..', 'dir/'):
+            self.assertEqual(self.upload('ms.smith', b'nameless', filename=filename).code, 400)
+        self.assertEqual(self.blobs(), [])
+
+
+class TestQueryPlans(unittest.TestCase):
+    """
+    Hot-path queries must be answered from an index. A full table scan or a
+    temporary sort on any of them fails the build.
+    """
+    HOT_QUERIES = [
+        ('SELECT student FROM course_students WHERE course_id = ?', (1,)),
+        ('SELECT student FROM course_students WHERE course_id = ? AND student = ?', (1, 'a')),
+        ('''SELECT c.id, c.title, c.description FROM courses c
+            JOIN course_students cs ON c.id = cs.course_id WHERE cs.student = ?''', ('a',)),
+        ('SELECT id, title, description FROM courses WHERE owner = ?', ('a',)),
+        ('SELECT COUNT(*) FROM course_likes WHERE course_id = ?', (1,)),
+        ('SELECT student FROM course_likes WHERE course_id = ? AND student = ?', (1, 'a')),
+        ('SELECT id, title, content, type, published FROM chapters WHERE course_id = ?', (1,)),
+        ('''SELECT owner FROM courses c JOIN chapters ch ON c.id = ch.course_id WHERE ch.id = ?''', (1,)),
+        ('SELECT filename FROM courseware WHERE chapter_id = ?', (1,)),
+        ('''SELECT id, title, content, type, published FROM chapters
+            WHERE course_id = ? AND (published = 1 OR ? = 0) ORDER BY id''', (1, True)),
+        ('''SELECT cw.chapter_id, cw.filename FROM courseware cw
+            JOIN chapters ch ON ch.id = cw.chapter_id WHERE ch.course_id = ?''', (1,)),
+        ('SELECT filename FROM hwpj WHERE chapter_id = ?', (1,)),
+        ('SELECT AVG(star) FROM rating WHERE course_id = ?', (1,)),
+        ('SELECT student, comment, date_submitted FROM course_comments WHERE course_id = ?', (1,)),
+        ('SELECT * FROM post_comments WHERE post_id = ?', (1,)),
+        ('SELECT * FROM posts WHERE tag = ?', ('Tech',)),
+        ('SELECT id, course_id, title FROM posts WHERE course_id = ?', (1,)),
+        ('''SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+            WHERE (date_submitted, id) < (?, ?) ORDER BY date_submitted DESC, id DESC LIMIT ?''', ('2024-01-01', 1, 20)),
+        ('''SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+            WHERE course_id = ? AND (date_submitted, id) < (?, ?) ORDER BY date_submitted DESC, id DESC LIMIT ?''', (1, '2024-01-01', 1, 20)),
+        ('''SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+            WHERE tag = ? AND (date_submitted, id) < (?, ?) ORDER BY date_submitted DESC, id DESC LIMIT ?''', ('Tech', '2024-01-01', 1, 20)),
+        ('''SELECT id, course_id, title, sender_name, content, likes, tag, date_submitted FROM posts
+            WHERE course_id = ? AND tag = ? ORDER BY date_submitted DESC, id DESC LIMIT ?''', (1, 'Tech', 20)),
+        ("SELECT version FROM cache_versions WHERE name = 'posts'", ()),
+        ('''SELECT chapter_id FROM course_progress WHERE username = ?
+            AND chapter_id IN (SELECT id FROM chapters WHERE course_id = ?)''', ('a', 1)),
+        ('''SELECT sender, receiver, subject, body, timestamp, read, type, priority, id FROM messages
+            WHERE receiver = ? ORDER BY priority DESC, timestamp DESC, id DESC LIMIT ?''', ('a', 20)),
+        ('''SELECT sender, receiver, subject, body, timestamp, read, type, priority, id FROM messages
+            WHERE receiver = ? AND (priority, timestamp, id) < (?, ?, ?)
+            ORDER BY priority DESC, timestamp DESC, id DESC LIMIT ?''', ('a', 0, '2024-01-01 00:00:00', 1, 20)),
+        ('SELECT unread FROM inbox_unread WHERE username = ?', ('a',)),
+        ('''SELECT COALESCE(SUM(t.total - COALESCE(r.reads, 0)), 0) FROM course_students cs
+            JOIN course_broadcast_counts t ON t.course_id = cs.course_id
+            LEFT JOIN course_broadcast_read_counts r ON r.username = cs.student AND r.course_id = cs.course_id
+            WHERE cs.student = ?''', ('a',)),
+        ('SELECT course_id FROM course_students WHERE student = ?', ('a',)),
+        ('''SELECT b.sender, ?, b.subject, b.body, b.timestamp,
+            EXISTS (SELECT 1 FROM course_broadcast_reads r WHERE r.username = ? AND r.broadcast_id = b.id),
+            b.type, b.priority, -b.id FROM course_broadcasts b
+            WHERE b.course_id = ? AND (b.priority, b.timestamp, -b.id) < (?, ?, ?)
+            ORDER BY b.priority DESC, b.timestamp DESC, b.id LIMIT ?''', ('a', 'a', 1, 0, '2024-01-01 00:00:00', -1, 20)),
+        ('SELECT role FROM users WHERE username = ?', ('a',)),
+        ('SELECT session_id FROM sessions WHERE username = ? AND expires > ?', ('a', 0)),
+        ('DELETE FROM sessions WHERE expires <= ?', (0,)),
+        ('''SELECT id, receiver, subject, body, attempts FROM email_outbox
+            WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? LIMIT ?''', (0, 50)),
+        ('SELECT course_id, score FROM user_recommendations WHERE username = ? ORDER BY rank', ('a',)),
+    ]
+
+    def setUp(self):
+        use_temp_database()
+
+    def assert_indexed(self, sql, params):
+        with dbpool.connection() as conn:
+            plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        for step in plan:
+            self.assertFalse(step.startswith('SCAN') or 'TEMP B-TREE' in step,
+                             f'{step!r} in plan for: {" ".join(sql.split())}')
+
+    def test_hot_queries_use_indexes(self):
+        for sql, params in self.HOT_QUERIES:
+            with self.subTest(sql=sql):
+                self.assert_indexed(sql, params)
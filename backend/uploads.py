@@ -0,0 +1,299 @@
+"""
+Streaming multipart uploads.
+
+Tornado normally buffers a whole request body in memory before calling the
+handler. Handlers decorated with @tornado.web.stream_request_body instead get
+the body chunk by chunk; StreamingUploadMixin parses multipart/form-data as it
+arrives and writes files to disk on a thread pool, so an upload of any size
+only ever holds about one chunk in memory.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesHeaderParser
+
+import tornado.web
+from tornado.httputil import parse_body_arguments
+
+# Largest accepted upload (lecture videos can be several GB).
+MAX_UPLOAD_SIZE = 8 * 1024 ** 3
+
+# Largest accepted plain form field of a multipart body, and largest non-multipart body.
+MAX_FIELD_SIZE = 64 * 1024
+MAX_FORM_SIZE = 1024 * 1024
+
+# Uploads are written here first. It is on the same filesystem as files/, so
+# moving a finished upload into place is an atomic rename.
+UPLOAD_TMP_DIR = 'files/tmp'
+
+_io = ThreadPoolExecutor(max_workers=4, thread_name_prefix='upload-io')
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class MultipartParser:
+    """
+    Incremental multipart/form-data parser.
+
+    feed() takes the body in chunks of any size and returns a list of events:
+    ('headers', email.message.Message) when a part starts, ('data', bytes) for
+    its content, and ('end', None) when it is complete.
+    """
+    MAX_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, boundary):
+        self._delimiter = b'\r\n--' + boundary
+        # A leading CRLF makes the first boundary look like every other delimiter.
+        self._buffer = b'\r\n'
+        self._state = 'preamble'
+        self.finished = False
+
+    def feed(self, data):
+        events = []
+        self._buffer += data
+        while True:
+            if self._state in ('preamble', 'body'):
+                index = self._buffer.find(self._delimiter)
+                if index < 0:
+                    # Hold back enough bytes to recognise a delimiter split across chunks.
+                    keep = len(self._delimiter) - 1
+                    if len(self._buffer) > keep:
+                        if self._state == 'body':
+                            events.append(('data', self._buffer[:-keep]))
+                        self._buffer = self._buffer[-keep:]
+                    return events
+                if self._state == 'body':
+                    if index:
+                        events.append(('data', self._buffer[:index]))
+                    events.append(('end', None))
+                self._buffer = self._buffer[index + len(self._delimiter):]
+                self._state = 'delimiter'
+            elif self._state == 'delimiter':
+                if len(self._buffer) < 2:
+                    return events
+                if self._buffer.startswith(b'--'):
+                    self._state = 'epilogue'
+                    self.finished = True
+                    continue
+                index = self._buffer.find(b'\r\n')
+                if index < 0:
+                    if len(self._buffer) > self.MAX_HEADER_SIZE:
+                        raise MultipartError('Malformed multipart boundary.')
+                    return events
+                # Keep the CRLF: the header block is then always '\r\n...\r\n\r\n'.
+                self._buffer = self._buffer[index:]
+                self._state = 'headers'
+            elif self._state == 'headers':
+                index = self._buffer.find(b'\r\n\r\n')
+                if index < 0:
+                    if len(self._buffer) > self.MAX_HEADER_SIZE:
+                        raise MultipartError('Multipart headers too large.')
+                    return events
+                events.append(('headers', BytesHeaderParser().parsebytes(self._buffer[2:index + 2])))
+                self._buffer = self._buffer[index + 4:]
+                self._state = 'body'
+            else:
+                self._buffer = b''
+                return events
+
+
+class UploadedFile:
+    """
+    A file received by StreamingUploadMixin. `path` is a temporary file until
+    the handler saves it; `sha256` is the hex digest of its content.
+    """
+    __slots__ = ('name', 'filename', 'content_type', 'path', 'size', 'sha256', '_file', '_hash')
+
+    def __init__(self, name, filename, content_type):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+        self._file = None
+        self._hash = hashlib.sha256()
+
+    def _open(self):
+        os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, prefix='upload-')
+        os.fchmod(fd, 0o644)  # mkstemp creates 0600; saved files keep these permissions
+        self._file = os.fdopen(fd, 'wb')
+
+    def _write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+        self.sha256 = self._hash.hexdigest()
+
+    def _discard(self):
+        if self._file is not None:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class StreamingUploadMixin:
+    """
+    For handlers decorated with @tornado.web.stream_request_body.
+
+    multipart/form-data bodies are parsed as they arrive. Plain fields become
+    regular arguments (get_argument works as usual); files are written to a
+    temporary file while their SHA-256 is computed. In the handler method,
+    `self.get_upload(name)` returns the UploadedFile and
+    `await self.save_upload(upload, path)` atomically moves it into place.
+    Uploads that were not saved are deleted when the request finishes.
+
+    Other bodies (e.g. form-encoded DELETE and PUT requests) are buffered up to
+    MAX_FORM_SIZE and parsed as Tornado would once the body has ended, i.e.
+    when the handler method is called, so chunked bodies work as well.
+    """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in ('post', 'put', 'patch', 'delete'):
+            if name in cls.__dict__:
+                setattr(cls, name, _after_body(cls.__dict__[name]))
+
+    async def prepare(self):
+        await super().prepare()
+        self.uploads = {}
+        self._parser = None
+        self._part = None
+        self._form = bytearray()
+        self._pending = []
+        self._upload_error = None
+
+        content_type = self.request.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            # Refuse before reading what may be gigabytes.
+            if not self.current_user:
+                raise tornado.web.HTTPError(403)
+            boundary = content_type.partition('boundary=')[2].split(';')[0].strip('" ')
+            if not boundary:
+                raise tornado.web.HTTPError(400, reason='Missing multipart boundary.')
+            self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+            self._parser = MultipartParser(boundary.encode('latin-1'))
+
+    async def data_received(self, chunk):
+        if self._upload_error:
+            return
+        if self._parser is None:
+            self._buffer_form(chunk)
+            return
+        try:
+            for kind, value in self._parser.feed(chunk):
+                await self._handle_event(kind, value)
+        except MultipartError as e:
+            self._upload_error = str(e)
+
+    def get_upload(self, name):
+        """
+        Returns the first file uploaded as `name`; fails the request with 400 if
+        there is none or the body was malformed.
+        """
+        if self._upload_error:
+            raise tornado.web.HTTPError(400, reason=self._upload_error)
+        uploads = self.uploads.get(name)
+        if not uploads:
+            raise tornado.web.HTTPError(400, reason=f'Missing file: {name}')
+        return uploads[0]
+
+    async def save_upload(self, upload, path):
+        """
+        Moves an upload to `path`, creating its directory and replacing any file already there.
+        """
+        def save():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(upload.path, path)
+
+        await asyncio.get_running_loop().run_in_executor(_io, save)
+        self._pending.remove(upload)
+        upload.path = path
+
+    def on_finish(self):
+        self._discard_pending()
+
+    def on_connection_close(self):
+        self._discard_pending()
+
+    def _discard_pending(self):
+        pending, self._pending = getattr(self, '_pending', []), []
+        for upload in pending:
+            _io.submit(upload._discard)
+
+    async def _handle_event(self, kind, value):
+        loop = asyncio.get_running_loop()
+        if kind == 'headers':
+            name = value.get_param('name', header='content-disposition')
+            filename = value.get_filename()
+            if filename is None:
+                self._part = (name, bytearray())
+            else:
+                filename = os.path.basename(filename)
+                if filename in ('', '.', '..'):
+                    raise MultipartError(f'Missing file name: {name}')
+                upload = UploadedFile(name, filename, value.get_content_type())
+                self._pending.append(upload)
+                await loop.run_in_executor(_io, upload._open)
+                self._part = (name, upload)
+        elif kind == 'data':
+            name, target = self._part
+            if isinstance(target, bytearray):
+                target += value
+                if len(target) > MAX_FIELD_SIZE:
+                    raise MultipartError(f'Form field too large: {name}')
+            else:
+                await loop.run_in_executor(_io, target._write, value)
+        else:
+            name, target = self._part
+            self._part = None
+            if isinstance(target, bytearray):
+                self.request.body_arguments.setdefault(name, []).append(bytes(target))
+                self.request.arguments.setdefault(name, []).append(bytes(target))
+            else:
+                await loop.run_in_executor(_io, target._close)
+                self.uploads.setdefault(name, []).append(target)
+
+    def _buffer_form(self, chunk):
+        self._form += chunk
+        if len(self._form) > MAX_FORM_SIZE:
+            self._upload_error = 'Request body too large.'
+            self._form = bytearray()
+
+    def _end_of_body(self):
+        if self._parser is not None:
+            return
+        if self._upload_error:
+            raise tornado.web.HTTPError(400, reason=self._upload_error)
+        if self._form:
+            parse_body_arguments(self.request.headers.get('Content-Type', ''), bytes(self._form),
+                                 self.request.body_arguments, self.request.files, self.request.headers)
+            for name, values in self.request.body_arguments.items():
+                self.request.arguments.setdefault(name, []).extend(values)
+            self._form = bytearray()
+
+
+def _after_body(method):
+    """
+    Wraps a handler method of a StreamingUploadMixin subclass so that a buffered
+    form is parsed before it runs. Tornado calls it once the whole body is in.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        self._end_of_body()
+        result = method(self, *args, **kwargs)
+        return await result if inspect.isawaitable(result) else result
+    return wrapper
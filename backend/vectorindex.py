@@ -0,0 +1,239 @@
+"""
+Nearest-neighbour search over course embeddings.
+
+All indexes store unit-length float32 vectors under integer ids, score by inner
+product (i.e. cosine similarity), and support incremental add (insert or
+replace), remove and top-k search:
+
+- FlatIndex: exact; one matrix-vector product per query.
+- IVFIndex: k-means partitions the vectors into lists and a query only scans
+  the `nprobe` lists closest to it. Exact (a single list) until it holds
+  `min_train_size` vectors, and retrained whenever it has doubled since.
+- HNSWIndex: a graph index from the optional `hnswlib` package.
+
+make_index() picks one by name, falling back to IVFIndex if HNSW is asked for
+but hnswlib is not installed.
+"""
+
+import importlib.util
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FlatIndex:
+    def __init__(self, dim, capacity=64):
+        self.dim = dim
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._rows = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    def ids(self):
+        return self._ids[:len(self._rows)]
+
+    def vectors(self):
+        return self._vectors[:len(self._rows)]
+
+    def get(self, item_id):
+        return self._vectors[self._rows[item_id]]
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        for item_id, vector in zip(ids, vectors):
+            row = self._rows.get(item_id)
+            if row is None:
+                row = len(self._rows)
+                if row == len(self._ids):
+                    self._grow()
+                self._rows[item_id] = row
+                self._ids[row] = item_id
+            self._vectors[row] = vector
+
+    def remove(self, ids):
+        for item_id in ids:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                continue
+            # Move the last vector into the hole, so live rows stay contiguous.
+            last = len(self._rows)
+            if row != last:
+                moved = int(self._ids[last])
+                self._ids[row] = moved
+                self._vectors[row] = self._vectors[last]
+                self._rows[moved] = row
+
+    def search(self, vector, k, exclude=()):
+        """
+        Returns up to `k` (id, score) pairs, best first, skipping ids in `exclude`.
+        """
+        count = len(self._rows)
+        if not count or k <= 0:
+            return []
+        scores = self._vectors[:count] @ np.asarray(vector, dtype=np.float32)
+        wanted = min(count, k + len(exclude))
+        best = np.argpartition(-scores, wanted - 1)[:wanted] if wanted < count else np.arange(count)
+        best = best[np.argsort(-scores[best], kind='stable')]
+        results = [(int(self._ids[row]), float(scores[row])) for row in best]
+        return [result for result in results if result[0] not in exclude][:k]
+
+    def _grow(self):
+        capacity = 2 * len(self._ids)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:len(self._ids)] = self._vectors
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:len(self._ids)] = self._ids
+        self._vectors, self._ids = vectors, ids
+
+
+class IVFIndex:
+    def __init__(self, dim, nprobe=8, min_train_size=1000, iterations=10, seed=0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self._rng = np.random.default_rng(seed)
+        self._centroids = np.zeros((1, dim), dtype=np.float32)
+        self._lists = [FlatIndex(dim)]
+        self._assignment = {}
+        self._trained_size = 0
+
+    def __len__(self):
+        return len(self._assignment)
+
+    def __contains__(self, item_id):
+        return item_id in self._assignment
+
+    def get(self, item_id):
+        return self._lists[self._assignment[item_id]].get(item_id)
+
+    def add(self, ids, vectors):
+        ids = list(ids)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self.remove([item_id for item_id in ids if item_id in self._assignment])
+        lists = np.argmax(vectors @ self._centroids.T, axis=1) if len(ids) else []
+        for item_id, vector, number in zip(ids, vectors, lists):
+            self._lists[number].add([item_id], vector)
+            self._assignment[item_id] = int(number)
+        if len(self) >= max(self.min_train_size, 2 * self._trained_size):
+            self.train()
+
+    def remove(self, ids):
+        for item_id in ids:
+            number = self._assignment.pop(item_id, None)
+            if number is not None:
+                self._lists[number].remove([item_id])
+
+    def train(self):
+        """
+        Repartitions the vectors with k-means into about sqrt(n) lists.
+        """
+        ids = np.concatenate([index.ids() for index in self._lists])
+        vectors = np.concatenate([index.vectors() for index in self._lists])
+        nlist = max(1, int(np.sqrt(len(ids))))
+        centroids = vectors[self._rng.choice(len(ids), nlist, replace=False)]
+        for _ in range(self.iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # An empty list keeps its old centroid.
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1, norms), centroids)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+
+        self._centroids = centroids.astype(np.float32)
+        self._lists = [FlatIndex(self.dim) for _ in range(nlist)]
+        self._assignment = {}
+        for number in range(nlist):
+            members = np.flatnonzero(assignment == number)
+            self._lists[number].add(ids[members].tolist(), vectors[members])
+            self._assignment.update((int(item_id), number) for item_id in ids[members])
+        self._trained_size = len(ids)
+
+    def search(self, vector, k, exclude=()):
+        vector = np.asarray(vector, dtype=np.float32)
+        probes = np.argsort(-(self._centroids @ vector))[:self.nprobe]
+        results = []
+        for number in probes:
+            results.extend(self._lists[number].search(vector, k, exclude))
+        results.sort(key=lambda result: -result[1])
+        return results[:k]
+
+
+class HNSWIndex:
+    def __init__(self, dim, capacity=1024, m=16, ef_construction=200, ef=64):
+        import hnswlib
+
+        self.dim = dim
+        self._index = hnswlib.Index(space='ip', dim=dim)
+        self._index.init_index(max_elements=capacity, M=m, ef_construction=ef_construction,
+                               allow_replace_deleted=True)
+        self._index.set_ef(ef)
+        self._ef = ef
+        self._live = set()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, item_id):
+        return item_id in self._live
+
+    def get(self, item_id):
+        return np.asarray(self._index.get_items([item_id])[0], dtype=np.float32)
+
+    def add(self, ids, vectors):
+        ids = list(ids)
+        if not ids:
+            return
+        new = len(set(ids) - self._live)
+        if self._index.get_current_count() + new > self._index.get_max_elements():
+            self._index.resize_index(2 * (self._index.get_current_count() + new))
+        for item_id in ids:
+            if item_id not in self._live:
+                try:
+                    # Removed earlier; its slot may since have been reused by another id.
+                    self._index.unmark_deleted(item_id)
+                except RuntimeError:
+                    pass
+        self._index.add_items(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim), ids,
+                              replace_deleted=True)
+        self._live.update(ids)
+
+    def remove(self, ids):
+        for item_id in ids:
+            if item_id in self._live:
+                self._index.mark_deleted(item_id)
+                self._live.discard(item_id)
+
+    def search(self, vector, k, exclude=()):
+        wanted = min(len(self._live), k + len(exclude))
+        if wanted <= 0:
+            return []
+        self._index.set_ef(max(self._ef, wanted))
+        labels, distances = self._index.knn_query(np.asarray(vector, dtype=np.float32), k=wanted)
+        # hnswlib's inner-product distance is 1 - dot product.
+        results = [(int(label), 1 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+        return [result for result in results if result[0] not in exclude][:k]
+
+
+INDEXES = {
+    'flat': FlatIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+}
+
+
+def make_index(name, dim):
+    if name not in INDEXES:
+        raise ValueError(f'Unknown vector index: {name}')
+    if name == 'hnsw' and importlib.util.find_spec('hnswlib') is None:
+        logger.warning('hnswlib is not installed; using the IVF index instead of HNSW.')
+        name = 'ivf'
+    return INDEXES[name](dim)
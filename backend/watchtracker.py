@@ -0,0 +1,240 @@
+"""
+Viewing sessions for the video anti-cheat check.
+
+While a video plays, the player sends a heartbeat every few seconds, saying
+whether the viewer interacted with the page since the previous one. A user
+watches one video at a time: a heartbeat for another chapter while their
+session is live is a violation. Watching for more than `hang_up` seconds
+without any interaction is a violation too (the video is left playing to run
+up the time). A session whose heartbeats stop for `idle_timeout` seconds ends,
+which frees the user to start another video.
+
+Watch time is credited on each heartbeat (the time since the previous one, up
+to `max_gap` seconds, and nothing while in violation) and written behind: it
+accumulates in memory per (user, chapter) and flush() adds it to the
+`watch_sessions` table every `flush_interval` seconds, in one transaction. A
+chapter is marked complete in `course_progress` once a user has watched it for
+`complete_after` seconds.
+
+Expiry uses a hashed timer wheel. A heartbeat only stamps the session; when
+the slot the session was filed under comes due, the session either ends or is
+filed again under its new deadline. Each tick therefore looks only at the
+sessions due in that slot, never at all of them, and a live session costs one
+record plus one slot entry however long it runs; a stopped one costs nothing.
+
+The tracker is not thread-safe; use it from the IOLoop thread. Live sessions
+exist only in the memory of one process: with several server processes a user's
+heartbeats would reach different trackers, so neither rule would hold. The
+server therefore refuses to start with `--processes` other than 1.
+"""
+
+import math
+import time
+
+import tornado.ioloop
+
+from asyncdb import pool
+from dbpool import connection
+
+
+class TimerWheel:
+    """
+    Items filed under a time at most `horizon` seconds ahead, in slots of
+    `tick` seconds. advance() returns the items whose slot came due.
+    """
+    def __init__(self, horizon, tick, now):
+        self.tick = tick
+        # One spare slot for rounding and one for the tick in progress.
+        self._slots = [set() for _ in range(math.ceil(horizon / tick) + 2)]
+        self._current = math.floor(now / tick)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, item, at):
+        """
+        Files `item` to come due at `at`. Returns its slot, for cancel().
+
+        If the wheel was not advanced for a while, `at` may be beyond its reach;
+        the item is then filed under the furthest slot and comes due early.
+        """
+        target = min(max(math.ceil(at / self.tick), self._current + 1), self._current + len(self._slots) - 1)
+        slot = target % len(self._slots)
+        self._slots[slot].add(item)
+        return slot
+
+    def cancel(self, item, slot):
+        self._slots[slot].discard(item)
+
+    def advance(self, now):
+        """
+        Moves the wheel to `now` and returns the items that came due.
+        """
+        end = math.floor(now / self.tick)
+        due = []
+        for target in range(self._current + 1, min(end, self._current + len(self._slots)) + 1):
+            index = target % len(self._slots)
+            due.extend(self._slots[index])
+            self._slots[index] = set()
+        self._current = max(self._current, end)
+        return due
+
+
+class WatchSession:
+    __slots__ = ('username', 'chapter_id', 'started', 'last_heartbeat', 'last_interaction', 'violations', 'slot')
+
+    def __init__(self, username, chapter_id, now):
+        self.username = username
+        self.chapter_id = chapter_id
+        self.started = now
+        self.last_heartbeat = now
+        self.last_interaction = now
+        self.violations = 0
+        self.slot = None
+
+
+class WatchTracker:
+    def __init__(self, idle_timeout=60, hang_up=300, tick=1.0, clock=time.monotonic):
+        self.clock = clock
+        self.configure({'idle_timeout': idle_timeout, 'hang_up': hang_up, 'tick': tick})
+
+    def configure(self, settings):
+        """
+        Applies the optional [anticheat] section of config.toml:
+
+            idle_timeout = 60      # seconds without a heartbeat before a session ends
+            hang_up = 300          # seconds of playback without interaction allowed
+            tick = 1.0             # timer wheel resolution, in seconds
+            max_gap = 15           # most seconds credited for one heartbeat
+            complete_after = 540   # seconds watched to complete a chapter
+            flush_interval = 5     # seconds between writes of watch time
+
+        Forgets every session and unsaved watch time, so call it before start().
+        """
+        self.idle_timeout = settings.get('idle_timeout', 60)
+        self.hang_up = settings.get('hang_up', 300)
+        self.tick_interval = settings.get('tick', 1.0)
+        self.max_gap = settings.get('max_gap', 15)
+        # The player asks for 90% of a video it assumes to last 10 minutes.
+        self.complete_after = settings.get('complete_after', 540)
+        self.flush_interval = settings.get('flush_interval', 5)
+        self._sessions = {}
+        self._wheel = TimerWheel(self.idle_timeout, self.tick_interval, self.clock())
+        self._pending = {}
+        self.expired = 0
+        self.violations = 0
+        self.flushes = 0
+        self.completed = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def session(self, username):
+        return self._sessions.get(username)
+
+    def heartbeat(self, username, chapter_id, interacted=False):
+        """
+        Records that `username` is playing `chapter_id`. Returns None if all is
+        well, or the violation: 'another_video' if the user's live session is
+        for another chapter, 'hang_up' if they have not interacted for too long.
+        """
+        now = self.clock()
+        session = self._sessions.get(username)
+        if session is not None and session.chapter_id != chapter_id:
+            session.violations += 1
+            self.violations += 1
+            return 'another_video'
+        if session is None:
+            session = self._sessions[username] = WatchSession(username, chapter_id, now)
+            session.slot = self._wheel.schedule(session, now + self.idle_timeout)
+        credit = min(now - session.last_heartbeat, self.max_gap)
+        session.last_heartbeat = now
+        if interacted:
+            session.last_interaction = now
+        if now - session.last_interaction > self.hang_up:
+            session.violations += 1
+            self.violations += 1
+            return 'hang_up'
+        if credit > 0:
+            key = (username, chapter_id)
+            self._pending[key] = self._pending.get(key, 0.0) + credit
+        return None
+
+    def stop(self, username, chapter_id):
+        """
+        Ends the user's session for `chapter_id`, if it is the live one.
+        """
+        session = self._sessions.get(username)
+        if session is not None and session.chapter_id == chapter_id:
+            del self._sessions[username]
+            self._wheel.cancel(session, session.slot)
+
+    def sweep(self):
+        """
+        Ends the sessions that had no heartbeat for idle_timeout seconds.
+        Returns the number ended.
+        """
+        now = self.clock()
+        ended = 0
+        for session in self._wheel.advance(now):
+            deadline = session.last_heartbeat + self.idle_timeout
+            if deadline <= now:
+                del self._sessions[session.username]
+                ended += 1
+            else:
+                session.slot = self._wheel.schedule(session, deadline)
+        self.expired += ended
+        return ended
+
+    async def flush(self):
+        """
+        Saves the watch time credited since the last flush. Returns the number of
+        (user, chapter) pairs saved.
+        """
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            completed = await pool.run(save_watch_time, pending, self.complete_after)
+        except BaseException:
+            for key, seconds in pending.items():
+                self._pending[key] = self._pending.get(key, 0.0) + seconds
+            raise
+        self.flushes += 1
+        self.completed += completed
+        return len(pending)
+
+    def start(self):
+        tornado.ioloop.PeriodicCallback(self.sweep, self.tick_interval * 1000).start()
+        tornado.ioloop.PeriodicCallback(self.flush, self.flush_interval * 1000).start()
+
+    def metrics(self):
+        return {'sessions': len(self._sessions), 'expired': self.expired, 'violations': self.violations,
+                'pending': len(self._pending), 'flushes': self.flushes, 'completed': self.completed}
+
+
+def save_watch_time(pending, complete_after):
+    """
+    Adds {(username, chapter_id): seconds} to watch_sessions in one transaction
+    and marks the chapters watched for `complete_after` seconds as completed.
+    Unknown chapters are ignored. Returns the number of chapters completed.
+    """
+    with connection() as conn:
+        conn.executemany('''
+            INSERT INTO watch_sessions (username, chapter_id, watched, last_watched)
+            SELECT ?, id, ?, CURRENT_TIMESTAMP FROM chapters WHERE id = ?
+            ON CONFLICT(username, chapter_id) DO UPDATE
+            SET watched = watched + excluded.watched, last_watched = excluded.last_watched
+        ''', ((username, seconds, chapter_id) for (username, chapter_id), seconds in pending.items()))
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO course_progress (chapter_id, username)
+            SELECT chapter_id, username FROM watch_sessions
+            WHERE username = ? AND chapter_id = ? AND watched >= ?
+        ''', ((username, chapter_id, complete_after) for username, chapter_id in pending))
+        completed = conn.total_changes - before
+        conn.commit()
+    return completed
+
+
+watch_tracker = WatchTracker()